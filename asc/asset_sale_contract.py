@@ -1,9 +1,33 @@
 from pyteal import *
 
 from helpers.consts import DefaultValues
+from helpers.min_balance import ESCROW_TXNS, escrow_min_balance
+from helpers.utils import int_to_bytes
+
+TEAL_VERSION = 6
+
+
+# payouts of a sale at `price`: (seller 25%, each of the 7 collaborators (60/7)%, alaska organization 15%)
+def sale_shares(price: int):
+    return int(price * 0.25), int(price * 0.6 / 7), int(price * 0.15)
+
+
+# a listing value as an 8 byte constant read with btoi: unlike an int constant (a varuint) it has the same width
+# for every value, so every listing compiles to the layout of the escrow template (helpers/escrow_template.py)
+def listing_int(value: bytes) -> Expr:
+    return Btoi(Bytes('base16', value.hex()))
 
 
 def asset_sale_contract(seller: str, asset_index: int, price: int):
+    values = [listing_int(int_to_bytes(value)) for value in (asset_index, *sale_shares(price))]
+    contract_py = asset_sale_program(Addr(seller), *values)
+    return compileTeal(contract_py, Mode.Signature, version=TEAL_VERSION)
+
+
+# the escrow logic with the listing values as expressions, so it can be compiled either for one listing or once
+# as a template (see helpers/escrow_template.py)
+def asset_sale_program(seller: Expr, asset_index: Expr, seller_share: Expr, collab_share: Expr,
+                       alaska_share: Expr) -> Expr:
     # collaborating artists: 60% total
     COLLAB_1_ADDRESS = 'HV7FWNWDGRTAP4WOOW7T6ZCFELJ4OSFWKELNCPRSLS4HHAODOHLI6IFNCU'
     COLLAB_2_ADDRESS = '26QGZSQQRNPNKB6PS5KWKTZ4EUXB7XYM4DHBYKL3JHBAEAYOWBBXRF5ZFY'
@@ -17,10 +41,10 @@ def asset_sale_contract(seller: str, asset_index: int, price: int):
 
     put_on_sale = And(
         Global.group_size() == Int(3),
-        # fund escrow
+        # fund escrow: min balance with the nft opted in, plus the fees it pays at the network's min fee
         Gtxn[0].type_enum() == TxnType.Payment,
-        Gtxn[0].amount() == Int(int(0.5)),
-        Gtxn[0].sender() == Addr(seller),
+        Gtxn[0].amount() == Int(escrow_min_balance()) + Int(ESCROW_TXNS) * Global.min_txn_fee(),
+        Gtxn[0].sender() == seller,
         Gtxn[0].close_remainder_to() == Global.zero_address(),
         # opt in escrow
         Gtxn[1].type_enum() == TxnType.AssetTransfer,
@@ -28,22 +52,22 @@ def asset_sale_contract(seller: str, asset_index: int, price: int):
         Gtxn[1].sender() == Gtxn[0].receiver(),
         Gtxn[1].sender() == Gtxn[1].asset_receiver(),
         Gtxn[1].asset_close_to() == Global.zero_address(),
-        Gtxn[1].xfer_asset() == Int(asset_index),
+        Gtxn[1].xfer_asset() == asset_index,
         # transfer asset to escrow
         Gtxn[2].type_enum() == TxnType.AssetTransfer,
         Gtxn[2].asset_amount() == Int(1),
-        Gtxn[2].sender() == Addr(seller),
+        Gtxn[2].sender() == seller,
         Gtxn[2].asset_receiver() == Gtxn[1].sender(),
         Gtxn[2].asset_close_to() == Global.zero_address(),
-        Gtxn[2].xfer_asset() == Int(asset_index),
+        Gtxn[2].xfer_asset() == asset_index,
     )
 
     buy_asset = And(
         Global.group_size() == Int(12),
         # pay seller 25% of the sale
         Gtxn[0].type_enum() == TxnType.Payment,
-        Gtxn[0].amount() == Int(int(price * 0.25)),
-        Gtxn[0].receiver() == Addr(seller),
+        Gtxn[0].amount() == seller_share,
+        Gtxn[0].receiver() == seller,
         Gtxn[0].close_remainder_to() == Global.zero_address(),
         # opt in buyer to nft
         Gtxn[1].type_enum() == TxnType.AssetTransfer,
@@ -51,51 +75,51 @@ def asset_sale_contract(seller: str, asset_index: int, price: int):
         Gtxn[1].sender() == Gtxn[0].sender(),
         Gtxn[1].sender() == Gtxn[1].asset_receiver(),
         Gtxn[1].asset_close_to() == Global.zero_address(),
-        Gtxn[1].xfer_asset() == Int(asset_index),
+        Gtxn[1].xfer_asset() == asset_index,
         # transfer asset to buyer
         Gtxn[2].type_enum() == TxnType.AssetTransfer,
         Gtxn[2].asset_amount() == Int(1),
         Gtxn[2].asset_receiver() == Gtxn[1].sender(),
         Gtxn[2].asset_close_to() == Gtxn[1].sender(),
-        Gtxn[2].xfer_asset() == Int(asset_index),
+        Gtxn[2].xfer_asset() == asset_index,
         # pay collaborator 1 (60/7)% of the sale
         Gtxn[3].type_enum() == TxnType.Payment,
-        Gtxn[3].amount() == Int(int(price * 0.6 / 7)),
+        Gtxn[3].amount() == collab_share,
         Gtxn[3].receiver() == Addr(COLLAB_1_ADDRESS),
         Gtxn[3].close_remainder_to() == Global.zero_address(),
         # pay collaborator 2 (60/7)% of the sale
         Gtxn[4].type_enum() == TxnType.Payment,
-        Gtxn[4].amount() == Int(int(price * 0.6 / 7)),
+        Gtxn[4].amount() == collab_share,
         Gtxn[4].receiver() == Addr(COLLAB_2_ADDRESS),
         Gtxn[4].close_remainder_to() == Global.zero_address(),
         # pay collaborator 3 (60/7)% of the sale
         Gtxn[5].type_enum() == TxnType.Payment,
-        Gtxn[5].amount() == Int(int(price * 0.6 / 7)),
+        Gtxn[5].amount() == collab_share,
         Gtxn[5].receiver() == Addr(COLLAB_3_ADDRESS),
         Gtxn[5].close_remainder_to() == Global.zero_address(),
         # pay collaborator 4 (60/7)% of the sale
         Gtxn[6].type_enum() == TxnType.Payment,
-        Gtxn[6].amount() == Int(int(price * 0.6 / 7)),
+        Gtxn[6].amount() == collab_share,
         Gtxn[6].receiver() == Addr(COLLAB_4_ADDRESS),
         Gtxn[6].close_remainder_to() == Global.zero_address(),
         # pay collaborator 5 (60/7)% of the sale
         Gtxn[7].type_enum() == TxnType.Payment,
-        Gtxn[7].amount() == Int(int(price * 0.6 / 7)),
+        Gtxn[7].amount() == collab_share,
         Gtxn[7].receiver() == Addr(COLLAB_5_ADDRESS),
         Gtxn[7].close_remainder_to() == Global.zero_address(),
         # pay collaborator 6 (60/7)% of the sale
         Gtxn[8].type_enum() == TxnType.Payment,
-        Gtxn[8].amount() == Int(int(price * 0.6 / 7)),
+        Gtxn[8].amount() == collab_share,
         Gtxn[8].receiver() == Addr(COLLAB_6_ADDRESS),
         Gtxn[8].close_remainder_to() == Global.zero_address(),
         # pay collaborator 7 (60/7)% of the sale
         Gtxn[9].type_enum() == TxnType.Payment,
-        Gtxn[9].amount() == Int(int(price * 0.6 / 7)),
+        Gtxn[9].amount() == collab_share,
         Gtxn[9].receiver() == Addr(COLLAB_7_ADDRESS),
         Gtxn[9].close_remainder_to() == Global.zero_address(),
         # pay collaborator 8 15% of the sale
         Gtxn[10].type_enum() == TxnType.Payment,
-        Gtxn[10].amount() == Int(int(price * 0.15)),
+        Gtxn[10].amount() == alaska_share,
         Gtxn[10].receiver() == Addr(COLLAB_8_ADDRESS),
         Gtxn[10].close_remainder_to() == Global.zero_address(),
     )
@@ -105,15 +129,15 @@ def asset_sale_contract(seller: str, asset_index: int, price: int):
         # close asset to seller
         Gtxn[0].type_enum() == TxnType.AssetTransfer,
         Gtxn[0].asset_amount() == Int(1),
-        Gtxn[0].xfer_asset() == Int(asset_index),
-        Gtxn[0].asset_receiver() == Addr(seller),
-        Gtxn[0].asset_close_to() == Addr(seller),
+        Gtxn[0].xfer_asset() == asset_index,
+        Gtxn[0].asset_receiver() == seller,
+        Gtxn[0].asset_close_to() == seller,
         # close escrow remainder to seller
         Gtxn[1].type_enum() == TxnType.Payment,
         Gtxn[1].amount() == Int(0),
         Gtxn[1].sender() == Gtxn[1].sender(),
-        Gtxn[1].receiver() == Addr(seller),
-        Gtxn[1].close_remainder_to() == Addr(seller),
+        Gtxn[1].receiver() == seller,
+        Gtxn[1].close_remainder_to() == seller,
     )
 
     security = And(
@@ -122,7 +146,7 @@ def asset_sale_contract(seller: str, asset_index: int, price: int):
         Txn.rekey_to() == Global.zero_address(),
     )
 
-    contract_py = And(
+    return And(
         security,
         Cond(
             [Global.group_size() == Int(2), cancel],
@@ -131,13 +155,12 @@ def asset_sale_contract(seller: str, asset_index: int, price: int):
         ),
     )
 
-    return compileTeal(contract_py, Mode.Signature, version=6)
-
 
-# test run
-CREATOR_ADDRESS = "E6U45JTJJQKGIQXECBTUAEARHU7PKCSRVLR5Q4PWT2EDG5XSOVOMK77LUA"
-ASSET_ID = 78961298
+if __name__ == '__main__':
+    # test run
+    CREATOR_ADDRESS = "E6U45JTJJQKGIQXECBTUAEARHU7PKCSRVLR5Q4PWT2EDG5XSOVOMK77LUA"
+    ASSET_ID = 78961298
 
-contract_teal = asset_sale_contract(CREATOR_ADDRESS, ASSET_ID, DefaultValues.royalty_fee)
-with open('../teal/asset_sale_contract.teal', 'w+') as f:
-    f.write(str(contract_teal))
+    contract_teal = asset_sale_contract(CREATOR_ADDRESS, ASSET_ID, DefaultValues.royalty_fee)
+    with open('../teal/asset_sale_contract.teal', 'w+') as f:
+        f.write(str(contract_teal))
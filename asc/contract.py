@@ -1,9 +1,24 @@
 from pyteal import *
 
-from helpers.consts import AppVariables
+from helpers.consts import AppVariables, InnerTxns, RoyaltySplit
+from helpers.program import MulDivMod
 
 
-def approval():
+# `fee_pooling` compiles a variant where inner transactions carry a zero fee and the outer call has to
+# cover them through fee pooling, instead of the app paying them out of its own balance
+def approval(fee_pooling: bool = False):
+    # fee set on every inner transaction: 0 when fees are pooled by the outer call
+    inner_fee = Int(0) if fee_pooling else Global.min_txn_fee()
+
+    def check_pooled_fee(inner_txns):
+        # with fee pooling the outer call must pay for itself and for `inner_txns` (an int or an expression)
+        # inner transactions
+        if not fee_pooling:
+            return []
+        if isinstance(inner_txns, int):
+            return [Assert(Txn.fee() >= Global.min_txn_fee() * Int(1 + inner_txns))]
+        return [Assert(Txn.fee() >= Global.min_txn_fee() * (Int(1) + inner_txns))]
+
     @Subroutine(TealType.none)
     def default_transaction_checks(txn_id: Int) -> TealType.none:
         # verifies the rekeyTo, closeRemainderTo, and the assetCloseTo attributes are set equal to the zero address
@@ -25,7 +40,7 @@ def approval():
                 TxnField.type_enum: TxnType.Payment,
                 TxnField.amount: amount,
                 TxnField.receiver: receiver,
-                TxnField.fee: Global.min_txn_fee()
+                TxnField.fee: inner_fee
             }),
             InnerTxnBuilder.Submit(),
         ])
@@ -44,7 +59,7 @@ def approval():
                 TxnField.asset_sender: sender,  # indicates a clawback transaction
                 # TxnField.sender: sender,
                 TxnField.xfer_asset: asset_id,
-                TxnField.fee: Global.min_txn_fee()
+                TxnField.fee: inner_fee
             }),
             InnerTxnBuilder.Submit(),
         ])
@@ -63,42 +78,48 @@ def approval():
     @Subroutine(TealType.uint64)
     def compute_royalty_fee(amount: Int, fee: Int) -> TealType.uint64:
         # computes the fee given a specific `amount` and predefined `fee` (expressed in thousands)
-        # note: must call check_royalty_fee_computation() before calling this function
-        # the safety of computing `remainder` and `division` is given by calling check_royalty_fee_computation()
+        # amount * fee is computed on 128 bits and divided by 1000 in one pass (see MulDivMod), so any amount works;
+        # below 1000 the fee keeps the quotient under `amount`, which fits in 64 bits
         remainder = ScratchVar(TealType.uint64)
         division = ScratchVar(TealType.uint64)
-        # if the fee is equal to 0, or the amount is very small, the fee will be 0
         # if the royalty fee is larger or equal to 1000, then return the original amount
+        # if the fee is equal to 0, or the amount is very small, the fee will be 0
         # if the remainder of fee * amount / 1000 is larger than 500 round up the
         # result and return  1 + fee * amount / 1000
         # otherwise  just return fee * amount / 1000
-        return Seq([
-            check_royalty_fee_computation(amount, fee),
-            remainder.store(Mod(Mul(amount, fee), Int(1000))),
-            division.store(Div(Mul(amount, fee), Int(1000))),
-            Return(If(Or(fee == Int(0), division.load() == Int(0))).Then(Int(0)) \
-                   .ElseIf(fee >= Int(1000)).Then(amount) \
-                   .ElseIf(remainder.load() > Int(500)).Then(division.load() + Int(1)) \
-                   .Else(division.load()))
-        ])
-
-    @Subroutine(TealType.none)
-    def check_royalty_fee_computation(amount: Int, fee: Int) -> TealType.none:
-        # checks that there are no problems computing the royalty fee given a specific `amount` and `fee`
-        # `fee` must be expressed in thousands
-        return Seq([
-            Assert(amount > Int(0)),
-            Assert(fee <= Div(Int(2 ** 64 - 1), amount)),
-        ])
+        return Return(If(fee >= Int(1000)).Then(amount).Else(Seq([
+            MulDivMod(amount, fee, Int(1000), division, remainder),
+            If(division.load() == Int(0)).Then(Int(0)) \
+                .ElseIf(remainder.load() > Int(500)).Then(division.load() + Int(1)) \
+                .Else(division.load())
+        ])))
 
     # [step 1] initialize smart contract; called only at creation
-    service_cost = Int(2) * Global.min_txn_fee()  # cost of 2 inner transactions
+    # cost of the 2 inner transactions of execute_transfer, nothing when the caller pools the fees
+    service_cost = Int(0) if fee_pooling else Int(InnerTxns.execute_transfer) * Global.min_txn_fee()
     royalty_fee = Btoi(Txn.application_args[2])
     asset_decimals = AssetParam.decimals(Btoi(Txn.application_args[1]))
     asset_frozen = AssetParam.defaultFrozen(Btoi(Txn.application_args[1]))
+    # optional royalty split: a 5th arg packs the payees, each a 32 byte address followed by its share in basis
+    # points (8 bytes), and the shares must add up to 100%. without a split the creator receives all the royalty fees
+    split = Txn.application_args[4]
+    split_count = ScratchVar(TealType.uint64)
+    split_total = ScratchVar(TealType.uint64)
+
+    def save_payee(i: int):
+        payee = Extract(split, Int(RoyaltySplit.entry_size * i), Int(32))
+        share = ExtractUint64(split, Int(RoyaltySplit.entry_size * i + 32))
+        return If(Int(i) < split_count.load()).Then(Seq([
+            Assert(And(share > Int(0), share <= Int(RoyaltySplit.total_bps))),  # verify the share is between 0 and 100%
+            App.globalPut(AppVariables.payees[i], payee),
+            App.globalPut(AppVariables.shares[i], share),
+            split_total.store(split_total.load() + share),
+        ]))
+
     initialize = Seq([
         Assert(Txn.type_enum() == TxnType.ApplicationCall),  # ensure type is an application call
-        Assert(Txn.application_args.length() == Int(4)),  # check for 4 args: creator, asset_id, fee, roundWait
+        # check for 4 args: creator, asset_id, fee, roundWait, optionally followed by the royalty split
+        Assert(Or(Txn.application_args.length() == Int(4), Txn.application_args.length() == Int(5))),
         Assert(Int(0) < royalty_fee <= Int(1000)),  # verify fee is between 0 and 1000
         default_transaction_checks(Int(0)),  # call default transaction checks
         asset_decimals,  # load the asset decimals
@@ -113,6 +134,16 @@ def approval():
         App.globalPut(AppVariables.royalty_fee, royalty_fee),  # save the royalty fee
         App.globalPut(AppVariables.waiting_time, Btoi(Txn.application_args[3])),
         # save waiting_time in number of rounds
+        split_count.store(Int(0)),  # save the royalty split, of up to `max_payees` whole entries
+        If(Txn.application_args.length() == Int(5)).Then(Seq([
+            Assert(Len(split) % Int(RoyaltySplit.entry_size) == Int(0)),
+            split_count.store(Len(split) / Int(RoyaltySplit.entry_size)),
+            Assert(And(split_count.load() > Int(0), split_count.load() <= Int(RoyaltySplit.max_payees))),
+        ])),
+        split_total.store(Int(0)),
+        *[save_payee(i) for i in range(RoyaltySplit.max_payees)],
+        Assert(Or(split_count.load() == Int(0), split_total.load() == Int(RoyaltySplit.total_bps))),
+        App.globalPut(AppVariables.split_count, split_count.load()),
         Approve()
     ])
 
@@ -120,13 +151,14 @@ def approval():
     #   1. the command to execute, in this case 'setup_sale'
     #   2. payment amount
     # first verify the seller owns the NFT, then locally save the arguments
+    # the call may be grouped with other setup_sale calls (bulk listing, see helpers/bulk_listing.py): it only checks
+    # its own transaction and writes the sender's local state
     price = Btoi(Txn.application_args[1])
     asset_clawback = AssetParam.clawback(App.globalGet(AppVariables.asset_id))
     # asset_freeze = AssetParam.freeze(App.globalGet(AppVariables.asset_id))
     setup_sale = Seq([
         Assert(Txn.application_args.length() == Int(2)),  # check that there are 2 arguments
-        Assert(Global.group_size() == Int(1)),  # verify that it is only 1 transaction
-        default_transaction_checks(Int(0)),  # perform default transaction checks
+        default_transaction_checks(Txn.group_index()),  # perform default transaction checks
         Assert(price > Int(0)),  # check that the price is greater than 0
         asset_clawback,  # verify that the clawback address is the contract
         Assert(asset_clawback.hasValue()),
@@ -135,6 +167,8 @@ def approval():
         # Assert(asset_freeze.hasValue()),
         # Assert(asset_freeze.value() == Global.current_application_address()),
         check_nft_balance(Txn.sender(), App.globalGet(AppVariables.asset_id)),  # verify that the seller owns the NFT
+        # a paid sale must be executed or refunded first: resetting the approval would strand the buyer's payment
+        Assert(App.localGet(Txn.sender(), AppVariables.approve_transfer) == Int(0)),
         Assert(price > service_cost),  # check that the price is greater than the service cost
         App.localPut(Txn.sender(), AppVariables.amount_payment, price),  # save the price
         App.localPut(Txn.sender(), AppVariables.approve_transfer, Int(0)),  # reject transfer until payment is done
@@ -157,6 +191,7 @@ def approval():
         Assert(Gtxn[1].type_enum() == TxnType.Payment),  # check that the second transaction is a payment
         Assert(App.globalGet(AppVariables.asset_id) == Btoi(Gtxn[0].application_args[1])),  # ensure correct asset_id
         Assert(transfer_approval == Int(0)),  # check that the transfer has not been issued yet
+        Assert(amt_to_pay > Int(0)),  # check that the seller has listed the NFT
         Assert(amt_to_pay == Gtxn[1].amount()),  # check that the amount to be paid is correct
         Assert(Global.current_application_address() == Gtxn[1].receiver()),  # ensure payment receiver is current app
         # default_transaction_checks(Int(0)),  # perform default transaction checks
@@ -172,49 +207,93 @@ def approval():
     # [step 4] transfer the NFT: pay the seller and send royalty fees to the creator(s),
     # requires a NoOp App call transaction, with 1 argument:
     #   1. command to execute, in this case 'execute_transfer'
+    # also pass the seller's address, and the buyer's after it when the seller forces the transaction
     # also account for the service_cost to pay the inner transaction
     royalty_fee = App.globalGet(AppVariables.royalty_fee)
     collected_fees = App.globalGet(AppVariables.collected_fees)
     fees_to_pay = ScratchVar(TealType.uint64)
+    execute_buyer = ScratchVar(TealType.bytes)
+
+    def settle_sale(seller: Expr, buyer: Expr, amt_to_pay: Expr):
+        # moves the NFT to `buyer` with the clawback, pays the seller and collects the royalty fees, then closes
+        # the seller's listing. shared by execute_transfer and buy_now
+        return [
+            Assert(service_cost < amt_to_pay),  # check underflow
+            check_nft_balance(seller, App.globalGet(AppVariables.asset_id)),  # check that the seller owns the NFT
+            # reduce number of subroutine calls by saving the variable inside a `temp` variable
+            fees_to_pay.store(If(seller == App.globalGet(AppVariables.creator)).Then(Int(1)).Else(
+                compute_royalty_fee(amt_to_pay - service_cost, royalty_fee))),
+            # compute royalty fees: if the seller is the creator, the fees are 0
+            # the seller is paid the rest, and adding the fees to collected_fees fails the call if it overflows
+            Assert(amt_to_pay - service_cost > fees_to_pay.load()),
+
+            transfer_asset(seller, buyer, App.globalGet(AppVariables.asset_id)),
+            send_payment(seller, amt_to_pay - service_cost - fees_to_pay.load()),  # pay seller
+            App.globalPut(AppVariables.collected_fees, collected_fees + fees_to_pay.load()),  # collect fees
+            App.localDel(seller, AppVariables.amount_payment),  # delete local variables
+            App.localDel(seller, AppVariables.approve_transfer),
+        ]
+
     execute_transfer = Seq([
         Assert(Gtxn[0].application_args.length() == Int(1)),  # check that there is only 1 argument
         Assert(Global.group_size() == Int(1)),  # check that is only 1 transaction
         default_transaction_checks(Int(0)),  # perform default transaction checks
+        *check_pooled_fee(InnerTxns.execute_transfer),  # check the outer fee covers the inner transactions
         Assert(App.localGet(seller, AppVariables.approve_transfer) == Int(1)),  # check seller side transfer_approval
-        # check transfer_approval from buyer' side, alternatively, seller can force transaction if enough time has passed
-        Assert(Or(And(seller != buyer, App.localGet(buyer, AppVariables.approve_transfer) == Int(1)),
-                  Global.round() > App.globalGet(AppVariables.waiting_time) + App.localGet(seller,
-                                                                                           AppVariables.round_sale_began))),
-        Assert(service_cost < amt_to_pay),  # check underflow
-        check_nft_balance(seller, App.globalGet(AppVariables.asset_id)),  # check that the seller owns the NFT
-        # reduce number of subroutine calls by saving the variable inside a `temp` variable
-        fees_to_pay.store(If(seller == App.globalGet(AppVariables.creator)).Then(Int(1)).Else(
-            compute_royalty_fee(amt_to_pay - service_cost, royalty_fee))),
-        # compute royalty fees: if the seller is the creator, the fees are 0
-        Assert(Int(2 ** 64 - 1) - fees_to_pay.load() >= amt_to_pay - service_cost),  # check overflow on payment
-        Assert(Int(2 ** 64 - 1) - collected_fees >= fees_to_pay.load()),  # check overflow on collected fees
-        Assert(amt_to_pay - service_cost > fees_to_pay.load()),
+        # the NFT always goes to a buyer who paid: the sender, or the buyer named by the seller
+        execute_buyer.store(If(Txn.accounts.length() == Int(2)).Then(Txn.accounts[2]).Else(Txn.sender())),
+        Assert(execute_buyer.load() != seller),  # make sure the seller is not the buyer
+        Assert(App.localGet(execute_buyer.load(), AppVariables.approve_transfer) == Int(1)),  # buyer side approval
+        # the buyer executes, alternatively the seller can force the transaction if enough time has passed
+        Assert(Or(Txn.sender() == execute_buyer.load(),
+                  And(Txn.sender() == seller,
+                      Global.round() > App.globalGet(AppVariables.waiting_time) + App.localGet(
+                          seller, AppVariables.round_sale_began)))),
+        *settle_sale(seller, execute_buyer.load(), amt_to_pay),
+        App.localDel(execute_buyer.load(), AppVariables.approve_transfer),
+        Approve()
+    ])
 
-        transfer_asset(seller, buyer, App.globalGet(AppVariables.asset_id)),
-        send_payment(seller, amt_to_pay - service_cost - fees_to_pay.load()),  # pay seller
-        App.globalPut(AppVariables.collected_fees, collected_fees + fees_to_pay.load()),  # collect fees
-        App.localDel(seller, AppVariables.amount_payment),  # delete local variables
-        App.localDel(seller, AppVariables.approve_transfer),
-        App.localDel(buyer, AppVariables.approve_transfer),
+    # [buy now] pay for the NFT and receive it in the same round, with two transactions:
+    # first transaction is the payment (the receiver is the app), so the app holds it before paying out
+    # second transaction is a NoOp call requiring 2 arguments:
+    #   1. command to execute, in this case 'buy_now'
+    #   2. asset id
+    # also pass the seller's address into the second transaction. the buyer does not need to opt in to the app
+    now_seller = Txn.accounts[1]
+    now_amt_to_pay = App.localGet(now_seller, AppVariables.amount_payment)
+    buy_now = Seq([
+        Assert(Txn.application_args.length() == Int(2)),  # check that there are 2 arguments
+        Assert(Global.group_size() == Int(2)),  # check that there are 2 transactions
+        Assert(Txn.group_index() == Int(1)),  # check that the call comes after the payment
+        default_transaction_checks(Int(0)),  # perform default transaction checks
+        default_transaction_checks(Int(1)),
+        *check_pooled_fee(InnerTxns.buy_now),  # check the outer fee covers the inner transactions
+        Assert(Gtxn[0].type_enum() == TxnType.Payment),  # check that the first transaction is a payment
+        Assert(Gtxn[0].sender() == Txn.sender()),  # check that the buyer pays
+        Assert(Global.current_application_address() == Gtxn[0].receiver()),  # ensure payment receiver is current app
+        Assert(App.globalGet(AppVariables.asset_id) == Btoi(Txn.application_args[1])),  # ensure correct asset_id
+        Assert(App.localGet(now_seller, AppVariables.approve_transfer) == Int(0)),  # no paid sale pending
+        Assert(now_amt_to_pay == Gtxn[0].amount()),  # check that the amount paid is the listed price
+        Assert(Txn.sender() != now_seller),  # make sure the seller is not the buyer
+        *settle_sale(now_seller, Txn.sender(), now_amt_to_pay),
         Approve()
     ])
 
     # [refund sequence]
     # buyer can get a refund if the payment has already been done but the NFT has not been transferred yet
+    # the inner transaction fee is taken from the refund, unless the buyer pools it in the outer fee
+    refund_cost = Int(0) if fee_pooling else Global.min_txn_fee()
     refund = Seq([
         Assert(Global.group_size() == Int(1)),  # verify that it is only 1 transaction
         Assert(Txn.application_args.length() == Int(1)),  # check that there is only 1 argument
         default_transaction_checks(Int(0)),  # perform default transaction checks
+        *check_pooled_fee(InnerTxns.refund),  # check the outer fee covers the inner transaction
         Assert(buyer != seller),  # assert that the buyer is not the seller
         Assert(App.localGet(seller, AppVariables.approve_transfer) == Int(1)),  # assert payment has already been done
         Assert(App.localGet(buyer, AppVariables.approve_transfer) == Int(1)),
-        Assert(amt_to_pay > Global.min_txn_fee()),  # underflow check: verify amount is greater than transaction fee
-        send_payment(buyer, amt_to_pay - Global.min_txn_fee()),  # refund buyer
+        Assert(amt_to_pay > refund_cost),  # underflow check: verify amount is greater than transaction fee
+        send_payment(buyer, amt_to_pay - refund_cost),  # refund buyer
         App.localPut(seller, AppVariables.approve_transfer, Int(0)),  # reset local variables
         App.localDel(buyer, AppVariables.approve_transfer),
         Approve()
@@ -222,27 +301,67 @@ def approval():
 
     # [claim fees sequence]
     # sequence can be called only by the creator, used to claim all the royalty fees
-    # may fail if the contract does not have enough algo to pay the inner transaction
-    # (the creator should take care of funding the contract in this case)
+    # with a royalty split the payees are paid a page at a time: each call pays the next payees from the claim
+    # cursor, as many as it passes foreign accounts (their addresses, in split order, at most `payees_per_call` in
+    # AVM v5), and the pages of a claim may be grouped. the first page sets the collected fees aside as the claim
+    # amount, the last payee gets what rounding left over and the cursor goes back to 0
+    # may fail if the contract does not have enough algo to pay the inner transactions
+    # (the creator should take care of funding the contract in this case, or pool the fees in the outer call)
+    payees = App.globalGet(AppVariables.split_count)
+    claim_cursor = App.globalGet(AppVariables.claim_cursor)
+    claim_amount = App.globalGet(AppVariables.claim_amount)
+    claim_paid = App.globalGet(AppVariables.claim_paid)
+    page_start = ScratchVar(TealType.uint64)
+    page_end = ScratchVar(TealType.uint64)
+    payee_fees = ScratchVar(TealType.uint64)
+
+    def pay_payee(i: int):
+        share = WideRatio([claim_amount, App.globalGet(AppVariables.shares[i])], [Int(RoyaltySplit.total_bps)])
+        return If(And(Int(i) >= page_start.load(), Int(i) < page_end.load())).Then(Seq([
+            payee_fees.store(If(payees == Int(i + 1)).Then(claim_amount - claim_paid).Else(share)),
+            send_payment(App.globalGet(AppVariables.payees[i]), payee_fees.load()),
+            App.globalPut(AppVariables.claim_paid, claim_paid + payee_fees.load()),
+        ]))
+
+    claim_page = Seq([
+        page_start.store(claim_cursor),
+        page_end.store(If(payees < page_start.load() + Txn.accounts.length()).Then(payees).Else(
+            page_start.load() + Txn.accounts.length())),
+        Assert(page_end.load() > page_start.load()),  # pay at least one payee
+        *check_pooled_fee(page_end.load() - page_start.load()),  # one inner transaction per payee paid
+        If(page_start.load() == Int(0)).Then(Seq([  # first page: set the collected fees aside for this claim
+            Assert(collected_fees > Int(0)),  # check that there are enough fees to collect
+            App.globalPut(AppVariables.claim_amount, collected_fees),
+            App.globalPut(AppVariables.claim_paid, Int(0)),
+            App.globalPut(AppVariables.collected_fees, Int(0)),
+        ])),
+        *[pay_payee(i) for i in range(RoyaltySplit.max_payees)],
+        App.globalPut(AppVariables.claim_cursor, If(page_end.load() == payees).Then(Int(0)).Else(page_end.load())),
+    ])
+
     claim_fees = Seq([
-        Assert(Global.group_size() == Int(1)),  # verify that it is only 1 transaction
         Assert(Txn.application_args.length() == Int(1)),  # check that there is only 1 argument
-        default_transaction_checks(Int(0)),  # perform default transaction checks
+        default_transaction_checks(Txn.group_index()),  # perform default transaction checks
         Assert(Txn.sender() == App.globalGet(AppVariables.creator)),  # verify that the sender is the creator
-        Assert(App.globalGet(AppVariables.collected_fees) > Int(0)),  # check that there are enough fees to collect
-        send_payment(App.globalGet(AppVariables.creator), App.globalGet(AppVariables.collected_fees)),  # pay creator
-        App.globalPut(AppVariables.collected_fees, Int(0)),  # reset collected fees
+        If(payees == Int(0)).Then(Seq([
+            Assert(Global.group_size() == Int(1)),  # verify that it is only 1 transaction
+            *check_pooled_fee(InnerTxns.claim_fees),  # check the outer fee covers the payment to the creator
+            Assert(collected_fees > Int(0)),  # check that there are enough fees to collect
+            send_payment(App.globalGet(AppVariables.creator), collected_fees),  # pay creator
+            App.globalPut(AppVariables.collected_fees, Int(0)),  # reset collected fees
+        ])).Else(claim_page),
         Approve()
     ])
 
     # [call sequence]
     # checks that the first transaction is an Application call, and that there is at least 1 argument
     # then checks the first argument of the call, the first argument must be a valid value between
-    # 'setup_sale', 'buy', 'execute_transfer', 'refund' and 'claim_fees'
+    # 'setup_sale', 'buy', 'execute_transfer', 'buy_now', 'refund' and 'claim_fees'
     on_call = If(Or(Txn.type_enum() != TxnType.ApplicationCall, Txn.application_args.length() == Int(0))).Then(
         Reject()).ElseIf(Txn.application_args[0] == AppVariables.setup_sale).Then(setup_sale).ElseIf(
         Txn.application_args[0] == AppVariables.buy).Then(buy).ElseIf(
         Txn.application_args[0] == AppVariables.execute_transfer).Then(execute_transfer).ElseIf(
+        Txn.application_args[0] == AppVariables.buy_now).Then(buy_now).ElseIf(
         Txn.application_args[0] == AppVariables.refund).Then(refund).ElseIf(
         Txn.application_args[0] == AppVariables.claim_fees).Then(claim_fees).Else(Reject())
 
@@ -6,9 +6,10 @@ from algosdk.future import transaction
 from algosdk.logic import get_application_address
 from pyteal import compileTeal, Mode
 
-from contract import approval, clear
-from helpers.consts import DefaultValues
+from asc.contract import approval, clear
+from helpers.consts import AppSchema, DefaultValues
 from helpers.operations import create_app
+from helpers.registry import Deployment, Registry, program_hash
 from helpers.utils import (
     compile_program,
     get_public_key_from_mnemonic,
@@ -18,83 +19,110 @@ from helpers.utils import (
 )
 from helpers.utils import get_algod_client
 
-load_dotenv()
-
-creator_mnemonic = os.getenv('CREATOR_MNEMONIC')
-asset_id = int(os.getenv('ASSET_ID'))
-royalty_fee = DefaultValues.royalty_fee
-waiting_time = DefaultValues.waiting_time
-
-print(f'creator public key: {get_public_key_from_mnemonic(creator_mnemonic)}')
-print(f'asset ID: {asset_id}')
-print(f'royalty fee: {royalty_fee / 10}%')
-print(f'waiting time: {waiting_time} seconds')
-
-# create purestake client
-algod_client = get_algod_client()
-
-# define private keys
-creator_private_key = mnemonic.to_private_key(creator_mnemonic)
-
-# declare application state storage (immutable)
-local_ints = 3
-local_bytes = 0
-global_ints = 4
-global_bytes = 1
-global_schema = transaction.StateSchema(global_ints, global_bytes)
-local_schema = transaction.StateSchema(local_ints, local_bytes)
-
-# get pyteal approval program
-approval_program_ast = approval()
-# compile program to TEAL assembly
-approval_program_teal = compileTeal(approval_program_ast, mode=Mode.Application, version=5)
-# compile program to binary
-approval_program_compiled = compile_program(algod_client, approval_program_teal)
-# create approval teal file for verification
-with open('../teal/approval.teal', 'w+') as f:
-    f.write(str(approval_program_teal))
-
-# get pyteal clear state program
-clear_state_program_ast = clear()
-# compile program to TEAL assembly
-clear_state_program_teal = compileTeal(clear_state_program_ast, mode=Mode.Application, version=5)
-# compile program to binary
-clear_state_program_compiled = compile_program(algod_client, clear_state_program_teal)
-# create clear teal file for verification
-with open('../teal/clear.teal', 'w+') as f:
-    f.write(str(clear_state_program_teal))
-
-# configure app args
-creator_public_key = get_public_key_from_mnemonic(creator_mnemonic)
-print_asset_holding(algod_client, creator_public_key, asset_id)
-
-# create list of bytes for app args
-app_args = [
-    address_to_bytes(creator_public_key),
-    int_to_bytes(asset_id),
-    int_to_bytes(royalty_fee),
-    int_to_bytes(waiting_time),
-]
-
-foreign_assets = [asset_id]
-
-# create new application
-app_id = create_app(
-    algod_client,
-    creator_private_key,
-    approval_program_compiled,
-    clear_state_program_compiled,
-    global_schema,
-    local_schema,
-    app_args,
-    foreign_assets,
-)
-
-app_address = get_application_address(app_id)
-
-print(f'application id: {app_id}')
-print(f'application address: {app_address}')
-
-with open('../.env', 'a') as f:
-    f.write(f'APP_ID={app_id}\n')
-    f.write(f'APP_ADDRESS={app_address}\n')
+TEAL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'teal')
+
+
+# compiles the approval and clear programs to TEAL assembly and writes them to `teal_dir` for verification
+def compile_teal(fee_pooling: bool = False, teal_dir: str = TEAL_DIR):
+    # get pyteal approval program
+    approval_program_ast = approval(fee_pooling)
+    # compile program to TEAL assembly
+    approval_program_teal = compileTeal(approval_program_ast, mode=Mode.Application, version=5)
+    # create approval teal file for verification
+    with open(os.path.join(teal_dir, 'approval.teal'), 'w+') as f:
+        f.write(str(approval_program_teal))
+
+    # get pyteal clear state program
+    clear_state_program_ast = clear()
+    # compile program to TEAL assembly
+    clear_state_program_teal = compileTeal(clear_state_program_ast, mode=Mode.Application, version=5)
+    # create clear teal file for verification
+    with open(os.path.join(teal_dir, 'clear.teal'), 'w+') as f:
+        f.write(str(clear_state_program_teal))
+
+    return approval_program_teal, clear_state_program_teal
+
+
+# compiles the approval and clear programs through algod, returns their bytecode
+def compile_programs(algod_client, fee_pooling: bool = False):
+    approval_program_teal, clear_state_program_teal = compile_teal(fee_pooling)
+    return compile_program(algod_client, approval_program_teal), compile_program(algod_client, clear_state_program_teal)
+
+
+# compiles the programs and creates the sale application for `asset_id`, returns the app id and address
+# `split` optionally lists (address, basis points) pairs sharing the royalty fees instead of the creator
+# the deployment is recorded in the registry (helpers/registry.py)
+# `programs` is the (approval, clear) bytecode of compile_programs, compiled here when not given
+def deploy(algod_client, creator_mnemonic: str, asset_id: int, royalty_fee: int = DefaultValues.royalty_fee,
+           waiting_time: int = DefaultValues.waiting_time, fee_pooling: bool = False, split: list = None,
+           registry: Registry = None, programs: tuple = None):
+    print(f'creator public key: {get_public_key_from_mnemonic(creator_mnemonic)}')
+    print(f'asset ID: {asset_id}')
+    print(f'royalty fee: {royalty_fee / 10}%')
+    print(f'waiting time: {waiting_time} seconds')
+    print(f'fee pooling: {fee_pooling}')
+    for payee, share in split or []:
+        print(f'royalty split: {payee} {share / 100}%')
+
+    # define private keys
+    creator_private_key = mnemonic.to_private_key(creator_mnemonic)
+
+    # declare application state storage (immutable)
+    global_schema = transaction.StateSchema(AppSchema.global_ints, AppSchema.global_bytes)
+    local_schema = transaction.StateSchema(AppSchema.local_ints, AppSchema.local_bytes)
+
+    # compile programs to binary
+    approval_program_compiled, clear_state_program_compiled = programs or compile_programs(algod_client, fee_pooling)
+
+    # configure app args
+    creator_public_key = get_public_key_from_mnemonic(creator_mnemonic)
+    print_asset_holding(algod_client, creator_public_key, asset_id)
+
+    # create list of bytes for app args
+    app_args = [
+        address_to_bytes(creator_public_key),
+        int_to_bytes(asset_id),
+        int_to_bytes(royalty_fee),
+        int_to_bytes(waiting_time),
+    ]
+    if split:
+        # the royalty split is packed in one arg: each payee address followed by its share
+        app_args.append(b''.join(address_to_bytes(payee) + int_to_bytes(share) for payee, share in split))
+
+    foreign_assets = [asset_id]
+
+    # create new application
+    app_id = create_app(
+        algod_client,
+        creator_private_key,
+        approval_program_compiled,
+        clear_state_program_compiled,
+        global_schema,
+        local_schema,
+        app_args,
+        foreign_assets,
+    )
+
+    app_address = get_application_address(app_id)
+
+    print(f'application id: {app_id}')
+    print(f'application address: {app_address}')
+    (registry or Registry()).add_deployment(Deployment(
+        app_id, app_address, asset_id, creator_public_key, program_hash(approval_program_compiled), royalty_fee,
+        waiting_time, fee_pooling))
+    return app_id, app_address
+
+
+if __name__ == '__main__':
+    load_dotenv()
+
+    # when set, inner transaction fees are pooled by the outer calls instead of being paid by the app
+    fee_pooling = os.getenv('FEE_POOLING', '').lower() in ('1', 'true', 'yes')
+
+    # create purestake client
+    algod_client = get_algod_client()
+
+    # the asset is ASSET_ID when set, otherwise the creator's latest asset in the registry
+    creator_mnemonic = os.getenv('CREATOR_MNEMONIC')
+    asset_id = os.getenv('ASSET_ID') or Registry().latest_asset(get_public_key_from_mnemonic(creator_mnemonic)).asset_id
+    deploy(algod_client, creator_mnemonic, int(asset_id), fee_pooling=fee_pooling)
@@ -0,0 +1,316 @@
+import asyncio
+import base64
+import copy
+
+import aiohttp
+from algosdk import account, encoding
+from algosdk.error import AlgodHTTPError
+from algosdk.future import transaction
+from algosdk.logic import get_application_address
+
+from helpers.consts import AppArgs, DefaultValues, InnerTxns, Network
+from helpers.utils import claim_pages, decode_state, int_to_bytes, pooled_fee_params
+
+# asyncio version of helpers/operations.py, for running many sale flows concurrently in one process: each flow is
+# a coroutine instead of a thread, and all of them share one aiohttp session (one connection pool) on one event loop.
+# transactions are built and signed with algosdk as in the blocking helpers, only the node round trips are awaited.
+#
+# confirmation waiting is shared as well: one task long-polls the node for new blocks and wakes every waiting flow,
+# which then checks its own transaction once per block, instead of every flow polling the node for blocks itself.
+# nothing is printed per operation, with thousands of flows it would only be noise
+#
+#   async def main():
+#       async with get_async_algod_client() as client:
+#           await asyncio.gather(*(sale(client, ...) for ...))
+#   asyncio.run(main())
+
+
+class AsyncAlgodClient:
+    # `max_in_flight` caps the requests open at once (the connection pool size); throttled requests (429) are
+    # retried with backoff like in helpers/limiter.py
+    def __init__(self, algod_token: str, algod_address: str, headers: dict = None, max_in_flight: int = 64,
+                 retries: int = 3, backoff: float = 0.25, timeout: float = 30.0):
+        self.address = algod_address.rstrip('/')
+        self.headers = {'X-Algo-API-Token': algod_token} if algod_token else {}
+        self.headers.update(headers or {})
+        self.max_in_flight = max_in_flight
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = None
+        self.last_round = None
+        self.new_block = None  # condition notified by the block watcher
+        self.watcher = None
+        self.watch_error = None  # unexpected error that stopped the watcher, raised to its waiters
+        self.waiters = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        if self.watcher is not None:
+            self.watcher.cancel()
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    # the session is created on first use, inside the running event loop
+    def _session(self) -> aiohttp.ClientSession:
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                headers=self.headers, connector=aiohttp.TCPConnector(limit=self.max_in_flight),
+                timeout=aiohttp.ClientTimeout(total=None, sock_read=self.timeout))
+        return self.session
+
+    # same contract as AlgodClient.algod_request: `requrl` without the /v2 prefix, json or msgpack responses and
+    # AlgodHTTPError on http errors
+    async def algod_request(self, method: str, requrl: str, params: dict = None, data: bytes = None,
+                            headers: dict = None, response_format: str = 'json'):
+        params = dict(params or {})
+        if response_format != 'json':
+            params['format'] = response_format
+        url = self.address + '/v2' + requrl
+        for attempt in range(self.retries + 1):
+            async with self._session().request(method, url, params=params, data=data, headers=headers) as response:
+                if response.status == 429 and attempt < self.retries:
+                    await asyncio.sleep(self.backoff * 2 ** attempt)
+                    continue
+                if response.status >= 400:
+                    body = await response.text()
+                    try:
+                        message = (await response.json(content_type=None))['message']
+                    except (ValueError, KeyError, TypeError):
+                        message = body
+                    raise AlgodHTTPError(message, code=response.status)
+                if response_format == 'json':
+                    return await response.json(content_type=None)
+                return await response.read()
+
+    async def status(self) -> dict:
+        return await self.algod_request('GET', '/status')
+
+    async def status_after_block(self, block_num: int) -> dict:
+        return await self.algod_request('GET', f'/status/wait-for-block-after/{block_num}')
+
+    async def suggested_params(self) -> transaction.SuggestedParams:
+        res = await self.algod_request('GET', '/transactions/params')
+        return transaction.SuggestedParams(res['fee'], res['last-round'], res['last-round'] + 1000,
+                                           res['genesis-hash'], res['genesis-id'], False, res['consensus-version'],
+                                           res['min-fee'])
+
+    async def account_info(self, address: str) -> dict:
+        return await self.algod_request('GET', f'/accounts/{address}')
+
+    async def application_info(self, app_id: int) -> dict:
+        return await self.algod_request('GET', f'/applications/{app_id}')
+
+    async def asset_info(self, asset_id: int) -> dict:
+        return await self.algod_request('GET', f'/assets/{asset_id}')
+
+    async def pending_transaction_info(self, txn_id: str) -> dict:
+        return await self.algod_request('GET', f'/transactions/pending/{txn_id}')
+
+    # returns the compiled program bytes
+    async def compile(self, source: str) -> bytes:
+        res = await self.algod_request('POST', '/teal/compile', data=source.encode(),
+                                       headers={'Content-Type': 'application/x-binary'})
+        return base64.b64decode(res['result'])
+
+    # sends signed transactions (one group) and returns the id of the first one
+    async def send_transactions(self, signed_txns: list) -> str:
+        data = b''.join(base64.b64decode(encoding.msgpack_encode(signed_txn)) for signed_txn in signed_txns)
+        res = await self.algod_request('POST', '/transactions', data=data,
+                                       headers={'Content-Type': 'application/x-binary'})
+        return res['txId']
+
+    # waits for a block after `round_num`, sharing one long poll with every other waiter. an unexpected error of the
+    # watcher is raised to every waiter, the next call starts a new watcher
+    async def wait_for_block_after(self, round_num: int) -> int:
+        if self.new_block is None:
+            self.new_block = asyncio.Condition()
+        self.waiters += 1
+        try:
+            if self.watcher is None or self.watcher.done():
+                self.watch_error = None
+                self.watcher = asyncio.ensure_future(self._watch_blocks(round_num))
+            async with self.new_block:
+                await self.new_block.wait_for(lambda: self.watch_error is not None or (
+                    self.last_round is not None and self.last_round > round_num))
+                if self.last_round is None or self.last_round <= round_num:
+                    raise self.watch_error
+            return self.last_round
+        finally:
+            self.waiters -= 1
+
+    # long polls the node for new blocks while flows are waiting on one. throttling (429), node errors (5xx) and
+    # connection errors are retried; anything else (e.g. a 401 for a bad token) stops the watcher
+    async def _watch_blocks(self, round_num: int):
+        last_round = round_num
+        try:
+            while self.waiters:
+                try:
+                    status = await self.status_after_block(last_round)
+                except (aiohttp.ClientError, asyncio.TimeoutError, AlgodHTTPError) as err:
+                    if isinstance(err, AlgodHTTPError) and err.code != 429 and (err.code or 0) < 500:
+                        raise
+                    await asyncio.sleep(self.backoff)
+                    continue
+                last_round = status['last-round']
+                async with self.new_block:
+                    self.last_round = last_round
+                    self.new_block.notify_all()
+        except Exception as err:
+            # e.g. a malformed status or a refused request: without a notification the waiters would wait forever
+            async with self.new_block:
+                self.watch_error = err
+                self.new_block.notify_all()
+
+
+def get_async_algod_client(max_in_flight: int = 64) -> AsyncAlgodClient:
+    return AsyncAlgodClient(Network.algod_token, Network.algod_endpoint, max_in_flight=max_in_flight)
+
+
+# wait until the transaction is confirmed before proceeding
+async def wait_for_confirmation(client: AsyncAlgodClient, txn_id: str) -> dict:
+    txn_info = await client.pending_transaction_info(txn_id)
+    last_round = client.last_round
+    if last_round is None:
+        last_round = (await client.status())['last-round']
+    while not (txn_info.get('confirmed-round') and txn_info.get('confirmed-round') > 0):
+        if txn_info.get('pool-error'):
+            raise AlgodHTTPError(f'transaction {txn_id} rejected: {txn_info["pool-error"]}')
+        last_round = await client.wait_for_block_after(last_round)
+        txn_info = await client.pending_transaction_info(txn_id)
+    return txn_info
+
+
+# signs `txns` (a group when there are several) with `private_key`, sends them and waits for the last one
+async def _send(client: AsyncAlgodClient, private_key, txns: list) -> list:
+    if len(txns) > 1:
+        transaction.assign_group_id(txns)
+    signed_txns = [txn.sign(private_key) for txn in txns]
+    await client.send_transactions(signed_txns)
+    txn_ids = [signed_txn.transaction.get_txid() for signed_txn in signed_txns]
+    await wait_for_confirmation(client, txn_ids[-1])
+    return txn_ids
+
+
+# create new application, returns its id
+async def create_app(client: AsyncAlgodClient, private_key, approval_program, clear_program, global_schema,
+                     local_schema, app_args, foreign_assets) -> int:
+    sender = account.address_from_private_key(private_key)
+    params = await client.suggested_params()
+    txn = transaction.ApplicationCreateTxn(sender, params, transaction.OnComplete.NoOpOC.real, approval_program,
+                                           clear_program, global_schema, local_schema, app_args,
+                                           foreign_assets=foreign_assets)
+    txn_id, = await _send(client, private_key, [txn])
+    return (await client.pending_transaction_info(txn_id))['application-index']
+
+
+# opt-in to application
+async def opt_in(client: AsyncAlgodClient, private_key: str, index: int) -> str:
+    sender = account.address_from_private_key(private_key)
+    params = await client.suggested_params()
+    txn_id, = await _send(client, private_key, [transaction.ApplicationOptInTxn(sender, params, index)])
+    return txn_id
+
+
+# opt-in to asset
+async def opt_in_asset(client: AsyncAlgodClient, private_key: str, asset_id: int) -> str:
+    sender = account.address_from_private_key(private_key)
+    params = await client.suggested_params()
+    txn = transaction.AssetTransferTxn(sender=sender, sp=params, receiver=sender, amt=0, index=asset_id)
+    txn_id, = await _send(client, private_key, [txn])
+    return txn_id
+
+
+async def send_funds(client: AsyncAlgodClient, private_key, receiver, amount: int = DefaultValues.app_funding) -> str:
+    sender = account.address_from_private_key(private_key)
+    params = await client.suggested_params()
+    txn_id, = await _send(client, private_key, [transaction.PaymentTxn(sender, params, receiver, amount, None)])
+    return txn_id
+
+
+async def set_clawback(client: AsyncAlgodClient, private_key: str, asset_id: int, app_address: str) -> str:
+    manager = account.address_from_private_key(private_key)
+    params = await client.suggested_params()
+    txn = transaction.AssetConfigTxn(sender=manager, sp=params, index=asset_id, manager=manager, reserve=manager,
+                                     freeze=app_address, clawback=app_address)
+    txn_id, = await _send(client, private_key, [txn])
+    return txn_id
+
+
+# setup sale using the application
+async def setup_sale(client: AsyncAlgodClient, private_key, app_id, app_args, foreign_assets) -> str:
+    sender = account.address_from_private_key(private_key)
+    params = await client.suggested_params()
+    txn = transaction.ApplicationCallTxn(sender=sender, sp=params, index=app_id,
+                                         on_complete=transaction.OnComplete.NoOpOC, app_args=app_args,
+                                         foreign_assets=foreign_assets)
+    txn_id, = await _send(client, private_key, [txn])
+    return txn_id
+
+
+# pays for a listed nft in a group with the buy call, returns (app call id, payment id)
+async def buy_asset(client: AsyncAlgodClient, private_key, app_account, app_id, app_args, foreign_assets,
+                    price: int) -> tuple:
+    buyer = account.address_from_private_key(private_key)
+    params = await client.suggested_params()
+    app_call_txn = transaction.ApplicationCallTxn(sender=buyer, sp=params, index=app_id,
+                                                  on_complete=transaction.OnComplete.NoOpOC, app_args=app_args,
+                                                  accounts=[app_account], foreign_assets=foreign_assets)
+    pay_txn = transaction.PaymentTxn(sender=buyer, receiver=get_application_address(app_id), amt=price, sp=params)
+    app_txn_id, pay_txn_id = await _send(client, private_key, [app_call_txn, pay_txn])
+    return app_txn_id, pay_txn_id
+
+
+# payment and buy_now call in one group, see operations.buy_now; returns (app call id, payment id)
+async def buy_now(client: AsyncAlgodClient, private_key, seller_address, app_id, asset_id: int, price: int,
+                  fee_pooling: bool = False) -> tuple:
+    buyer = account.address_from_private_key(private_key)
+    params = await client.suggested_params()
+    call_params = pooled_fee_params(copy.copy(params), InnerTxns.buy_now) if fee_pooling else params
+    pay_txn = transaction.PaymentTxn(sender=buyer, receiver=get_application_address(app_id), amt=price, sp=params)
+    app_call_txn = transaction.ApplicationCallTxn(sender=buyer, sp=call_params, index=app_id,
+                                                  on_complete=transaction.OnComplete.NoOpOC,
+                                                  app_args=[AppArgs.buy_now, int_to_bytes(asset_id)],
+                                                  accounts=[seller_address], foreign_assets=[asset_id])
+    pay_txn_id, app_txn_id = await _send(client, private_key, [pay_txn, app_call_txn])
+    return app_txn_id, pay_txn_id
+
+
+# execute the transfer
+# with `fee_pooling` the outer fee also pays for the inner transactions of the app
+async def buyer_execute_transfer(client: AsyncAlgodClient, buyer_private_key, seller_address, app_id, app_args,
+                                 foreign_assets, fee_pooling: bool = False) -> str:
+    buyer = account.address_from_private_key(buyer_private_key)
+    params = await client.suggested_params()
+    if fee_pooling:
+        pooled_fee_params(params, InnerTxns.execute_transfer)
+    txn = transaction.ApplicationCallTxn(sender=buyer, sp=params, index=app_id,
+                                         on_complete=transaction.OnComplete.NoOpOC, app_args=app_args,
+                                         accounts=[seller_address], foreign_assets=foreign_assets)
+    txn_id, = await _send(client, buyer_private_key, [txn])
+    return txn_id
+
+
+# claim royalty fees
+# `payees` are the addresses of the app's royalty split, if it has one: the payees from the claim cursor on are paid
+# a page per call, see operations.creator_claim_fees; returns the id of the last call
+async def creator_claim_fees(client: AsyncAlgodClient, private_key: str, app_id: int, app_args,
+                             fee_pooling: bool = False, payees: list = None) -> str:
+    creator = account.address_from_private_key(private_key)
+    params = await client.suggested_params()
+    cursor = 0
+    if payees:
+        app_info = await client.application_info(app_id)
+        cursor = decode_state(app_info['params'].get('global-state')).get(b'claim_cursor', 0)
+    txns = [transaction.ApplicationCallTxn(sender=creator, index=app_id, on_complete=transaction.OnComplete.NoOpOC,
+                                           sp=pooled_fee_params(copy.copy(params), len(page) or InnerTxns.claim_fees)
+                                           if fee_pooling else params, app_args=app_args, accounts=page or None)
+            for page in claim_pages(payees or [], cursor)]
+    txn_ids = await _send(client, private_key, txns)
+    return txn_ids[-1]
@@ -0,0 +1,203 @@
+import csv
+import itertools
+import json
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+from algosdk.error import AlgodHTTPError
+from algosdk.logic import get_application_address
+
+from helpers.consts import InnerTxns
+from helpers.min_balance import MAX_GROUP_SIZE
+from helpers.registry import Registry
+from helpers.txn_templates import cached_template, send_signed, setup_sale_template, setup_sale_values, sign_group
+from helpers.utils import decode_state, wait_for_confirmation
+
+# lists a whole drop at once: (seller, asset, price) rows are streamed from a csv or jsonl price file and checked in
+# bulk (one account lookup per seller for ownership, app opt-in and existing listings, one per creator for the
+# clawback of all its assets) instead of per item. the setup_sale calls of a seller are then signed in groups of up
+# to 16 (the contract accepts grouped setup_sale calls) and the groups of all sellers are sent and confirmed in
+# parallel. a rejected group is retried item by item, so one bad row does not hold back the other 15; a group whose
+# send or confirmation wait failed is looked up first, so a group that went through anyway is not sent twice
+#
+#   price file: seller,asset_id,price[,app_id] (csv with that header) or {"seller": ..., "asset_id": ..., ...} lines
+#   app_id defaults to the latest app deployed for the asset in the registry
+#
+#   results = bulk_list(client, addresses_to_keys(private_keys), read_listings('drop.csv'))
+
+CHUNK_SIZE = 2000  # rows checked and submitted at a time, so memory does not grow with the file
+
+
+@dataclass
+class Listing:
+    seller: str
+    asset_id: int
+    price: int
+    app_id: Optional[int] = None
+
+
+@dataclass
+class ListingResult:
+    listing: Listing
+    status: str  # listed, skipped or failed
+    detail: Optional[str] = None  # txn id when listed, reason otherwise
+
+
+# yields the listings of a .csv or .jsonl price file one row at a time
+def read_listings(path: str):
+    with open(path, newline='') as f:
+        rows = csv.DictReader(f) if path.endswith('.csv') else (json.loads(line) for line in f if line.strip())
+        for row in rows:
+            app_id = row.get('app_id')
+            yield Listing(row['seller'], int(row['asset_id']), int(row['price']), int(app_id) if app_id else None)
+
+
+def _chunks(iterable, size: int):
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+class BulkLister:
+    def __init__(self, client, keys: dict, registry: Registry = None, workers: int = 8):
+        self.client = client
+        self.keys = keys  # seller address -> private key
+        self.registry = registry or Registry()
+        self.workers = workers
+        self.deployments = {}  # asset id -> latest Deployment, or None when the registry has none
+        self.apps = {}  # app id -> Deployment, or None when the registry has none
+        self.clawbacks = {}  # asset id -> clawback address
+
+    def deployment(self, asset_id: int):
+        if asset_id not in self.deployments:
+            self.deployments[asset_id] = self.registry.deployment_for_asset(asset_id)
+        return self.deployments[asset_id]
+
+    def app_deployment(self, app_id: int):
+        if app_id not in self.apps:
+            self.apps[app_id] = self.registry.deployment(app_id)
+        return self.apps[app_id]
+
+    # looks up the clawback of `asset_ids` through the account of their creator: one call per creator in the
+    # registry, one per asset for the others
+    def load_clawbacks(self, asset_ids: set):
+        by_creator = {}
+        for asset_id in asset_ids - self.clawbacks.keys():
+            asset = self.registry.asset(asset_id)
+            if asset is None:
+                try:
+                    self.clawbacks[asset_id] = self.client.asset_info(asset_id)['params'].get('clawback')
+                except AlgodHTTPError:
+                    self.clawbacks[asset_id] = None  # unknown or destroyed asset
+            else:
+                by_creator.setdefault(asset.creator, set()).add(asset_id)
+
+        def created_assets(creator):
+            return self.client.account_info(creator).get('created-assets', [])
+
+        with ThreadPoolExecutor(self.workers) as executor:
+            for wanted, created in zip(by_creator.values(), executor.map(created_assets, by_creator)):
+                for asset in created:
+                    if asset['index'] in wanted:
+                        self.clawbacks[asset['index']] = asset['params'].get('clawback')
+
+    # splits `listings` into (listings to send, skipped results); every check is made against one account lookup
+    # per seller
+    def check(self, listings: list, min_fee: int) -> tuple:
+        for listing in listings:
+            if listing.app_id is None and self.deployment(listing.asset_id):
+                listing.app_id = self.deployment(listing.asset_id).app_id
+        self.load_clawbacks({listing.asset_id for listing in listings})
+        sellers = sorted({listing.seller for listing in listings if listing.seller in self.keys})
+        with ThreadPoolExecutor(self.workers) as executor:
+            accounts = dict(zip(sellers, executor.map(self.client.account_info, sellers)))
+        ready, skipped = [], []
+        for listing in listings:
+            reason = self.problem(listing, accounts.get(listing.seller), min_fee)
+            if reason:
+                skipped.append(ListingResult(listing, 'skipped', reason))
+            else:
+                ready.append(listing)
+        return ready, skipped
+
+    # why `listing` cannot be listed, or None
+    def problem(self, listing: Listing, info: dict, min_fee: int) -> Optional[str]:
+        if listing.seller not in self.keys:
+            return 'no key for the seller'
+        if listing.app_id is None:
+            return 'no app deployed for the asset in the registry'
+        deployment = self.app_deployment(listing.app_id)
+        service_cost = 0 if deployment and deployment.fee_pooling else InnerTxns.execute_transfer * min_fee
+        if listing.price <= service_cost:
+            return f'price must be above {service_cost}'
+        if self.clawbacks.get(listing.asset_id) != get_application_address(listing.app_id):
+            return 'the app is not the clawback of the asset'
+        holdings = {holding['asset-id']: holding['amount'] for holding in info.get('assets', [])}
+        if holdings.get(listing.asset_id) != 1:
+            return 'the seller does not hold the nft'
+        local = next((local for local in info.get('apps-local-state', []) if local['id'] == listing.app_id), None)
+        if local is None:
+            return 'the seller has not opted in to the app'
+        state = decode_state(local.get('key-value'))
+        if state.get(b'approve_transfer') == 1:
+            return 'a sale is pending'
+        if state.get(b'amount_payment') == listing.price and state.get(b'approve_transfer') == 0:
+            return 'already listed at this price'
+        return None
+
+    # whether `txn_id` confirmed after its send or confirmation wait failed: a transaction still in the pool is waited
+    # for until it confirms or the node drops it
+    def confirmed(self, txn_id: str) -> bool:
+        try:
+            txn_info = self.client.pending_transaction_info(txn_id)
+            last_round = None
+            while not txn_info.get('confirmed-round') and not txn_info.get('pool-error'):
+                last_round = (last_round or self.client.status()['last-round']) + 1
+                self.client.status_after_block(last_round)
+                txn_info = self.client.pending_transaction_info(txn_id)
+        except AlgodHTTPError:
+            return False  # never reached the node, or dropped from the pool
+        return bool(txn_info.get('confirmed-round'))
+
+    # signs and sends the setup_sale calls of one seller as a group, returns their results. the calls are signed
+    # from the cached template of each app (see helpers/txn_templates.py)
+    def send_group(self, listings: list, params) -> list:
+        private_key = self.keys[listings[0].seller]
+        parts = [(cached_template(setup_sale_template, params, listing.app_id, listing.asset_id),
+                  setup_sale_values(listing.price, params.first, params.last)) for listing in listings]
+        signed_txns, txn_ids = sign_group(private_key, parts)
+        try:
+            send_signed(self.client, signed_txns)
+            wait_for_confirmation(self.client, txn_ids[-1])
+        except Exception as err:
+            # the group is atomic: it confirmed as a whole (e.g. only the confirmation wait timed out) or not at all
+            if not self.confirmed(txn_ids[-1]):
+                if len(listings) == 1:
+                    return [ListingResult(listings[0], 'failed', str(err))]
+                # find the rows that broke the group: the others go through on their own
+                return [result for listing in listings for result in self.send_group([listing], params)]
+        return [ListingResult(listing, 'listed', txn_id) for listing, txn_id in zip(listings, txn_ids)]
+
+    def list_chunk(self, listings: list) -> list:
+        params = self.client.suggested_params()
+        ready, results = self.check(listings, params.min_fee)
+        by_seller = {}
+        for listing in ready:
+            by_seller.setdefault(listing.seller, []).append(listing)
+        groups = [seller_listings[start:start + MAX_GROUP_SIZE] for seller_listings in by_seller.values()
+                  for start in range(0, len(seller_listings), MAX_GROUP_SIZE)]
+        print(f'listing {len(ready)} item(s) in {len(groups)} group(s), {len(results)} skipped')
+        with ThreadPoolExecutor(self.workers) as executor:
+            for group_results in executor.map(lambda group: self.send_group(group, params), groups):
+                results += group_results
+        return results
+
+    # lists every row of `listings` (any iterable, read chunk by chunk) and yields its result
+    def run(self, listings):
+        for chunk in _chunks(listings, CHUNK_SIZE):
+            yield from self.list_chunk(chunk)
+
+
+def bulk_list(client, keys: dict, listings, registry: Registry = None, workers: int = 8) -> list:
+    return list(BulkLister(client, keys, registry, workers).run(listings))
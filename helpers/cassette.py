@@ -0,0 +1,166 @@
+import atexit
+import hashlib
+import os
+import threading
+import time
+import zlib
+from collections import defaultdict, deque
+
+import msgpack
+from algosdk.error import AlgodHTTPError
+from algosdk.v2client.algod import AlgodClient
+
+# record/replay transport for algod clients, to benchmark and regression test flows offline on the traffic of a real
+# run. recording wraps the algod_request of a client (every AlgodClient method, the node pool and the rate limiter go
+# through it) and keeps each request with its response or error, its start time, its latency and the last round seen
+# so far. the cassette is a zlib compressed msgpack file, written when the process exits.
+#
+# replaying answers the same requests from the cassette without network access: requests are matched on method,
+# path, params and a hash of the body, and identical requests (status polls) get their responses in recorded order.
+# by default responses come back at once; a time warp factor sleeps for the recorded latencies scaled by the factor
+# (1 reproduces the original run).
+#
+# get_algod_client uses it from the environment:
+#   ALGOD_CASSETTE=run.cassette ALGOD_CASSETTE_MODE=record python services/workflow.py
+#   ALGOD_CASSETTE=run.cassette ALGOD_CASSETTE_MODE=replay [ALGOD_TIME_WARP=1] python services/workflow.py
+
+CASSETTE_VERSION = 1
+
+
+class CassetteMiss(Exception):
+    pass
+
+
+def request_key(method: str, requrl: str, params: dict = None, data=None) -> tuple:
+    if isinstance(data, str):
+        data = data.encode()
+    digest = hashlib.sha256(data).hexdigest() if data else ''
+    return method, requrl, tuple(sorted((params or {}).items())), digest
+
+
+class Cassette:
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = []
+        self.round = None  # last round seen in a response
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+    # runs `call` (the real request) and records its outcome
+    def record(self, method: str, requrl: str, params: dict, data, call):
+        start = time.monotonic()
+        try:
+            result = call()
+        except Exception as err:
+            code = err.code if isinstance(err, AlgodHTTPError) else None
+            self._add(method, requrl, params, data, start, error=[str(err), code])
+            raise
+        self._add(method, requrl, params, data, start, response=result)
+        return result
+
+    def _add(self, method, requrl, params, data, start, response=None, error=None):
+        elapsed = time.monotonic() - start
+        with self.lock:
+            if isinstance(response, dict) and 'last-round' in response:
+                self.round = response['last-round']
+            self.entries.append({
+                'method': method, 'url': requrl, 'params': params or {},
+                'data': data.encode() if isinstance(data, str) else data,
+                'response': response, 'error': error,
+                'start': start - self.started, 'elapsed': elapsed, 'round': self.round,
+            })
+
+    def save(self):
+        with self.lock:
+            packed = msgpack.packb({'version': CASSETTE_VERSION, 'entries': self.entries}, use_bin_type=True)
+        with open(self.path + '.tmp', 'wb') as f:
+            f.write(zlib.compress(packed, 9))
+        os.replace(self.path + '.tmp', self.path)
+
+
+def load(path: str) -> dict:
+    with open(path, 'rb') as f:
+        cassette = msgpack.unpackb(zlib.decompress(f.read()), raw=False, strict_map_key=False)
+    if cassette.get('version') != CASSETTE_VERSION:
+        raise ValueError(f'{path}: unsupported cassette version {cassette.get("version")}')
+    return cassette
+
+
+# makes `client` record every request into `cassette`, returns the client
+def record(client, cassette: Cassette):
+    request = client.algod_request
+
+    def algod_request(method, requrl, params=None, data=None, headers=None, response_format='json'):
+        return cassette.record(method, requrl, params, data,
+                               lambda: request(method, requrl, params, data, headers, response_format))
+
+    client.algod_request = algod_request
+    return client
+
+
+class ReplayAlgodClient(AlgodClient):
+    # `time_warp` scales the recorded latencies, 0 answers at once
+    def __init__(self, path: str, time_warp: float = 0.0):
+        super().__init__('', 'http://cassette')
+        self.path = path
+        self.time_warp = time_warp
+        self.queues = defaultdict(deque)
+        for entry in load(path)['entries']:
+            self.queues[request_key(entry['method'], entry['url'], entry['params'], entry['data'])].append(entry)
+        self.lock = threading.Lock()
+
+    def algod_request(self, method, requrl, params=None, data=None, headers=None, response_format='json'):
+        with self.lock:
+            queue = self.queues.get(request_key(method, requrl, params, data))
+            if not queue or (len(queue) == 1 and queue[0].get('replayed') and method != 'GET'):
+                raise CassetteMiss(f'{method} {requrl} is not in {self.path}, or was made more often than recorded')
+            # reads made more often than recorded (one more poll) get the last recorded answer again
+            entry = queue.popleft() if len(queue) > 1 else queue[0]
+            entry['replayed'] = True
+        if self.time_warp:
+            time.sleep(entry['elapsed'] * self.time_warp)
+        if entry['error']:
+            raise AlgodHTTPError(*entry['error'])
+        return entry['response']
+
+
+_cassettes = {}
+_replays = {}
+_lock = threading.Lock()
+
+
+# the cassette recording to `path`, shared by every client of the process and saved when it exits
+def cassette_for(path: str) -> Cassette:
+    with _lock:
+        if path not in _cassettes:
+            _cassettes[path] = Cassette(path)
+            atexit.register(_cassettes[path].save)
+        return _cassettes[path]
+
+
+# the replay client of `path`, shared so that every client of the process consumes the same recorded traffic
+def replay_client(path: str, time_warp: float = 0.0) -> ReplayAlgodClient:
+    with _lock:
+        if path not in _replays:
+            _replays[path] = ReplayAlgodClient(path, time_warp)
+        return _replays[path]
+
+
+# request counts, latencies and round span of a cassette, by endpoint (ids and addresses left out of the path)
+def describe(path: str) -> dict:
+    entries = load(path)['entries']
+    endpoints = {}
+    for entry in entries:
+        name = '/'.join(part for part in entry['url'].split('/') if not part or part.replace('-', '').islower())
+        stats = endpoints.setdefault(f'{entry["method"]} {name}', {'count': 0, 'errors': 0, 'latency': 0.0})
+        stats['count'] += 1
+        stats['errors'] += entry['error'] is not None
+        stats['latency'] += entry['elapsed']
+    rounds = [entry['round'] for entry in entries if entry['round'] is not None]
+    return {
+        'requests': len(entries),
+        'duration': round(max((e['start'] + e['elapsed'] for e in entries), default=0.0), 3),
+        'rounds': [rounds[0], rounds[-1]] if rounds else None,
+        'endpoints': {name: {**stats, 'latency': round(stats['latency'], 3)}
+                      for name, stats in sorted(endpoints.items())},
+    }
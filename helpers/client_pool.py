@@ -0,0 +1,219 @@
+import json
+import socket
+import threading
+import time
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from urllib import parse
+from urllib.request import Request, urlopen
+
+from algosdk import constants
+from algosdk.error import AlgodHTTPError, AlgodResponseError
+from algosdk.v2client.algod import AlgodClient, api_version_path_prefix
+
+# algod client spread over several nodes. every request goes through algod_request, so all AlgodClient methods
+# (and every helper taking an AlgodClient) work unchanged:
+#   - reads go to the fastest healthy node; if it has not answered after `failover_after` seconds the next node is
+#     asked as well and the first answer wins
+#   - latency-critical long polls (status_after_block) are hedged: sent to `hedge_fanout` nodes at once
+#   - submissions (POST) go to the primary, failing over to the other nodes in order; pending transaction lookups
+#     follow the same order (the node that accepted a transaction knows it first) and a 404 asks the next node
+# nodes that time out, refuse connections or answer 429/5xx are put in a cooldown that grows with each failure.
+# every node request has a timeout (algosdk sets none), so a hanging node fails over instead of blocking
+
+HEDGED_PATHS = ('/status/wait-for-block-after/',)
+PENDING_PATHS = ('/transactions/pending/',)
+EWMA_WEIGHT = 0.3
+REQUEST_TIMEOUT = 10.0  # seconds
+LONG_POLL_TIMEOUT = 75.0  # the node holds wait-for-block-after for up to a minute when no block comes
+
+
+def is_node_failure(err: Exception) -> bool:
+    # True when the error says something about the node rather than about the request
+    if isinstance(err, AlgodHTTPError):
+        return err.code is None or err.code == 429 or err.code >= 500
+    return isinstance(err, (urllib.error.URLError, socket.timeout, ConnectionError, TimeoutError))
+
+
+# AlgodClient whose requests give up after `timeout` seconds (`long_poll_timeout` for wait-for-block-after)
+class TimeoutAlgodClient(AlgodClient):
+    def __init__(self, algod_token: str, algod_address: str, headers=None, timeout: float = REQUEST_TIMEOUT,
+                 long_poll_timeout: float = LONG_POLL_TIMEOUT):
+        super().__init__(algod_token, algod_address, headers)
+        self.timeout = timeout
+        self.long_poll_timeout = long_poll_timeout
+
+    # same request as AlgodClient.algod_request, with the timeout passed to urlopen
+    def algod_request(self, method, requrl, params=None, data=None, headers=None, response_format='json'):
+        timeout = self.long_poll_timeout if requrl.startswith(HEDGED_PATHS) else self.timeout
+        header = {'User-Agent': 'py-algorand-sdk'}
+        if self.headers:
+            header.update(self.headers)
+        if headers:
+            header.update(headers)
+        if requrl not in constants.no_auth:
+            header.update({constants.algod_auth_header: self.algod_token})
+        if requrl not in constants.unversioned_paths:
+            requrl = api_version_path_prefix + requrl
+        if params:
+            requrl = requrl + '?' + parse.urlencode(params)
+        req = Request(self.algod_address + requrl, headers=header, method=method, data=data)
+        try:
+            with urlopen(req, timeout=timeout) as resp:
+                body = resp.read()
+        except urllib.error.HTTPError as err:
+            message = err.read().decode('utf-8')
+            try:
+                message = json.loads(message)['message']
+            except (ValueError, KeyError, TypeError):
+                pass
+            raise AlgodHTTPError(message, err.code)
+        if response_format != 'json':
+            return body
+        try:
+            return json.loads(body)
+        except ValueError as err:
+            raise AlgodResponseError('Failed to parse JSON response from algod') from err
+
+
+class Node:
+    def __init__(self, client: AlgodClient):
+        self.client = client
+        self.latency = None  # exponentially weighted moving average, in seconds
+        self.failures = 0  # consecutive failures
+        self.down_until = 0.0
+
+    @property
+    def endpoint(self):
+        return self.client.algod_address
+
+    def healthy(self, now: float) -> bool:
+        return now >= self.down_until
+
+    def record_latency(self, elapsed: float):
+        self.latency = elapsed if self.latency is None else EWMA_WEIGHT * elapsed + (1 - EWMA_WEIGHT) * self.latency
+
+    def record_success(self, elapsed: float = None):
+        self.failures = 0
+        self.down_until = 0.0
+        if elapsed is not None:
+            self.record_latency(elapsed)
+
+    def record_failure(self, cooldown: float):
+        self.failures += 1
+        self.down_until = time.monotonic() + cooldown * 2 ** min(self.failures - 1, 6)
+
+
+class AlgodClientPool(AlgodClient):
+    # `client_class` builds the client of each node, e.g. a rate limited one (see helpers/limiter.py); it takes the
+    # `timeout` of node requests
+    def __init__(self, algod_token: str, endpoints: list, headers=None, hedge_fanout: int = 2,
+                 failover_after: float = 2.0, cooldown: float = 5.0, max_workers: int = 16,
+                 client_class=TimeoutAlgodClient, timeout: float = REQUEST_TIMEOUT):
+        if not endpoints:
+            raise ValueError('at least one endpoint is required')
+        super().__init__(algod_token, endpoints[0], headers)
+        self.nodes = [Node(client_class(algod_token, endpoint, headers, timeout=timeout)) for endpoint in endpoints]
+        self.hedge_fanout = hedge_fanout
+        self.failover_after = failover_after
+        self.cooldown = cooldown
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='algod-pool')
+        self.lock = threading.Lock()
+
+    # healthy nodes first, fastest first; nodes without measurements yet are tried early to get one
+    def ranked_nodes(self) -> list:
+        now = time.monotonic()
+        with self.lock:
+            return sorted(self.nodes, key=lambda n: (not n.healthy(now), n.latency or 0.0))
+
+    # submissions stick to the first configured healthy node, the others are fallbacks in configured order
+    def primary_order(self) -> list:
+        now = time.monotonic()
+        return [n for n in self.nodes if n.healthy(now)] + [n for n in self.nodes if not n.healthy(now)]
+
+    def algod_request(self, method, requrl, params=None, data=None, headers=None, response_format='json'):
+        def call(node: Node):
+            return node.client.algod_request(method, requrl, params, data, headers, response_format)
+
+        if method != 'GET':
+            return self._failover(call, self.primary_order())
+        if requrl.startswith(HEDGED_PATHS):
+            return self._race(call, self.ranked_nodes(), fanout=self.hedge_fanout, delay=None, track_latency=False)
+        if requrl.startswith(PENDING_PATHS):
+            return self._race(call, self.primary_order(), fanout=1, delay=self.failover_after, retry_not_found=True)
+        return self._race(call, self.ranked_nodes(), fanout=1, delay=self.failover_after)
+
+    def _timed(self, node: Node, call, track_latency: bool = True):
+        start = time.monotonic()
+        try:
+            result = call(node)
+        except Exception as err:
+            with self.lock:
+                if is_node_failure(err):
+                    node.record_failure(self.cooldown)
+                else:
+                    node.record_success()  # the node answered, the request itself was refused
+            raise
+        with self.lock:
+            node.record_success(time.monotonic() - start if track_latency else None)
+        return result
+
+    def _failover(self, call, nodes: list):
+        last_error = None
+        for node in nodes:
+            try:
+                return self._timed(node, call)
+            except Exception as err:
+                if not is_node_failure(err):
+                    raise
+                last_error = err
+        raise last_error
+
+    # asks `fanout` nodes at once, then one more node every `delay` seconds (or after a failure) until one answers.
+    # with `retry_not_found`, a 404 also moves on to the next node (a node that has not seen the transaction yet)
+    def _race(self, call, nodes: list, fanout: int, delay, track_latency: bool = True, retry_not_found: bool = False):
+        queue = list(nodes)
+        futures = {}
+        last_error = None
+
+        def launch():
+            node = queue.pop(0)
+            futures[self.executor.submit(self._timed, node, call, track_latency)] = node
+
+        for _ in range(min(fanout, len(queue))):
+            launch()
+        while futures:
+            done, _ = wait(futures, timeout=delay if queue else None, return_when=FIRST_COMPLETED)
+            if not done:
+                # hedge: the nodes in flight are slow, count that against them and ask the next one as well
+                with self.lock:
+                    for node in futures.values():
+                        node.record_latency(delay)
+                launch()
+                continue
+            for future in done:
+                futures.pop(future)
+                try:
+                    return future.result()
+                except Exception as err:
+                    not_found = retry_not_found and isinstance(err, AlgodHTTPError) and err.code == 404
+                    if not (is_node_failure(err) or not_found):
+                        raise
+                    last_error = err
+                    if queue:
+                        launch()
+        raise last_error
+
+    # probes /health on every node and updates their scores, returns {endpoint: healthy}
+    def check_health(self) -> dict:
+        def probe(node: Node):
+            try:
+                self._timed(node, lambda n: n.client.health())
+            except Exception as err:
+                return not is_node_failure(err)
+            return True
+
+        return dict(zip([n.endpoint for n in self.nodes], self.executor.map(probe, self.nodes)))
+
+    def close(self):
+        self.executor.shutdown(wait=False)
@@ -1,29 +1,47 @@
-from pyteal import *
-
-
-class AppVariables:
-    # global variables
-    creator = Bytes('creator')  # asset creator, byteslice
-    asset_id = Bytes('asset_id')  # asset id, byteslice
-    royalty_fee = Bytes('royalty_fee')  # royalty fee in thousands, uint64
-    waiting_time = Bytes('waiting_time')  # number of rounds to wait before the seller can force the transaction, uint64
-    collected_fees = Bytes('collected_fees')  # amount of collected fees, stored globally, uint64,
-    round_sale_began = Bytes('round_sale_began')  # round in which the sale began, uint64
-    # locals
-    amount_payment = Bytes('amount_payment')  # amt to be paid for the asset, stored on seller's account, uint64
-    approve_transfer = Bytes('approve_transfer')  # approval variable stored on seller's and buyer's accounts, byteslice
-    # method calls
-    setup_sale = Bytes('setup_sale')
-    buy = Bytes('buy')
-    execute_transfer = Bytes('execute_transfer')
-    claim_fees = Bytes('claim_fees')
-    refund = Bytes('refund')
+import os
+
+
+def __getattr__(name):
+    # AppVariables wraps every key in a pyteal expression, so it is only built when the contract asks for it:
+    # clients importing the plain constants below do not pay for importing pyteal
+    if name != 'AppVariables':
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    from pyteal import Bytes
+
+    class AppVariables:
+        # global variables
+        creator = Bytes('creator')  # asset creator, byteslice
+        asset_id = Bytes('asset_id')  # asset id, byteslice
+        royalty_fee = Bytes('royalty_fee')  # royalty fee in thousands, uint64
+        waiting_time = Bytes('waiting_time')  # number of rounds to wait before the seller can force the transaction
+        collected_fees = Bytes('collected_fees')  # amount of collected fees, stored globally, uint64,
+        round_sale_began = Bytes('round_sale_began')  # round in which the sale began, uint64
+        split_count = Bytes('split_count')  # number of payees of the royalty split, 0 when the creator gets it all
+        payees = [Bytes(f'payee_{i}') for i in range(RoyaltySplit.max_payees)]  # royalty split addresses, byteslice
+        shares = [Bytes(f'share_{i}') for i in range(RoyaltySplit.max_payees)]  # royalty split in basis points, uint64
+        claim_cursor = Bytes('claim_cursor')  # next payee of a claim paid over several calls, 0 between claims, uint64
+        claim_amount = Bytes('claim_amount')  # fees shared by the claim in progress, uint64
+        claim_paid = Bytes('claim_paid')  # part of claim_amount already paid out, uint64
+        # locals
+        amount_payment = Bytes('amount_payment')  # amt to be paid for the asset, stored on seller's account, uint64
+        approve_transfer = Bytes('approve_transfer')  # approval variable stored on seller's and buyer's accounts
+        # method calls
+        setup_sale = Bytes('setup_sale')
+        buy = Bytes('buy')
+        execute_transfer = Bytes('execute_transfer')
+        buy_now = Bytes('buy_now')
+        claim_fees = Bytes('claim_fees')
+        refund = Bytes('refund')
+
+    globals()['AppVariables'] = AppVariables
+    return AppVariables
 
 
 class AppArgs:
     setup_sale = 'setup_sale'.encode()
     buy = 'buy'.encode()
     execute_transfer = 'execute_transfer'.encode()
+    buy_now = 'buy_now'.encode()
     claim_fees = 'claim_fees'.encode()
     refund = 'refund'.encode()
 
@@ -32,3 +50,90 @@ class DefaultValues:
     royalty_fee = int(50)
     waiting_time = int(15)
     nft_price = int(1000000)  # 1 algo
+    app_funding = int(200000)  # app funding when the app pays its own inner transaction fees
+    app_min_balance = int(100000)  # app funding when inner transaction fees are pooled by the caller
+
+
+class RoyaltySplit:
+    # claim_fees pays every payee with an inner payment, and in AVM v5 their addresses have to be passed as foreign
+    # accounts of the call, which are limited to 4: a split with more payees is paid over several claim_fees calls
+    # (sent as one group), each paying the next `payees_per_call`
+    max_payees = 8
+    payees_per_call = 4
+    total_bps = 10000
+    entry_size = 40  # a payee in the creation argument: 32 byte address, 8 byte share
+
+
+class AppSchema:
+    # application state storage declared at creation (immutable)
+    local_ints = 3
+    local_bytes = 0
+    # asset_id, royalty_fee, waiting_time, collected_fees, split_count, claim_cursor, claim_amount, claim_paid, shares
+    global_ints = 8 + RoyaltySplit.max_payees
+    global_bytes = 1 + RoyaltySplit.max_payees  # creator, payees
+
+
+class MinBalance:
+    # protocol minimum balance requirements, in microAlgos (see helpers/min_balance.py)
+    account = 100000
+    asset_opt_in = 100000  # per asset held
+    app_opt_in = 100000  # per app opted in, plus its local schema
+    app_page = 100000  # per page of an app created, plus its global schema
+    schema_int = 28500  # per uint64 of a schema
+    schema_bytes = 50000  # per byteslice of a schema
+    txn_fee = 1000
+
+
+class InnerTxns:
+    # number of inner transactions issued by each method call, used to size pooled fees
+    execute_transfer = 2
+    buy_now = 2  # same payout as execute_transfer
+    refund = 1
+    claim_fees = 1  # one per payee paid by the call when the app has a royalty split
+
+
+class _Network:
+    # algod node used by every client, overridable from the environment. every setting is read when it is used, so
+    # a .env loaded after this module was imported still applies
+    @property
+    def algod_endpoint(self) -> str:
+        return os.getenv('ALGOD_ENDPOINT', 'https://node.testnet.algoexplorerapi.io')
+
+    @property
+    def algod_token(self) -> str:
+        return os.getenv('ALGOD_TOKEN', '')
+
+    # comma separated list of nodes; with more than one, clients are pooled across them (see helpers/client_pool.py)
+    @property
+    def algod_endpoints(self) -> list:
+        return [e.strip() for e in os.getenv('ALGOD_ENDPOINTS', '').split(',') if e.strip()] or [self.algod_endpoint]
+
+    # indexer used for collection-wide queries (see helpers/holder_index.py)
+    @property
+    def indexer_endpoint(self) -> str:
+        return os.getenv('INDEXER_ENDPOINT', 'https://algoindexer.testnet.algoexplorerapi.io')
+
+    @property
+    def indexer_token(self) -> str:
+        return os.getenv('INDEXER_TOKEN', '')
+
+    # starting request rate per node, in requests per second (see helpers/limiter.py)
+    @property
+    def algod_rate(self) -> float:
+        return float(os.getenv('ALGOD_RATE', '10'))
+
+    # record the algod traffic to, or replay it from, a cassette file (see helpers/cassette.py)
+    @property
+    def cassette(self) -> str:
+        return os.getenv('ALGOD_CASSETTE', '')
+
+    @property
+    def cassette_mode(self) -> str:
+        return os.getenv('ALGOD_CASSETTE_MODE', '')  # record or replay
+
+    @property
+    def time_warp(self) -> float:
+        return float(os.getenv('ALGOD_TIME_WARP', '0'))  # replayed latency factor, 0 for full speed
+
+
+Network = _Network()
@@ -0,0 +1,153 @@
+import base64
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+
+from algosdk import encoding, logic
+
+from helpers.program import CompiledSignature
+from helpers.utils import int_to_bytes
+
+# the asset sale escrow compiled once for all listings. the listing values are compiled in as fixed-width
+# sentinels (a 32 byte address for the seller, 8 byte big-endian constants turned into ints with btoi for the asset
+# and the sale shares) so a listing's bytecode is the template bytecode with its values written over the sentinels,
+# at offsets recorded when the template was compiled. the escrow address is then hashed locally: no compile call
+# per listing. asset_sale_contract() compiles the listing values the same way, so both give the same program.
+# a listing whose values repeat each other or another constant of the escrow is compiled through algod instead:
+# the assembler shares repeated constants, which changes the layout.
+#
+# the template is cached next to the other teal output and only recompiled when the escrow teal changes
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'teal', 'asset_sale_template.json')
+SLOTS = ('seller', 'asset_index', 'seller_share', 'collab_share', 'alaska_share')
+
+
+def _sentinel(slot: str) -> bytes:
+    digest = hashlib.sha256(b'asset_sale_template/' + slot.encode()).digest()
+    return digest if slot == 'seller' else digest[:8]
+
+
+SENTINELS = {slot: _sentinel(slot) for slot in SLOTS}
+
+
+def template_teal() -> str:
+    from pyteal import Addr, Mode, compileTeal
+    from asc.asset_sale_contract import TEAL_VERSION, asset_sale_program, listing_int
+
+    values = [listing_int(SENTINELS[slot]) for slot in SLOTS[1:]]
+    program = asset_sale_program(Addr(encoding.encode_address(SENTINELS['seller'])), *values)
+    return compileTeal(program, Mode.Signature, version=TEAL_VERSION)
+
+
+# the bytes written over each slot's sentinel for a listing
+def listing_values(seller: str, asset_index: int, price: int) -> dict:
+    from asc.asset_sale_contract import sale_shares
+
+    seller_share, collab_share, alaska_share = sale_shares(price)
+    return {
+        'seller': encoding.decode_address(seller),
+        'asset_index': int_to_bytes(asset_index),
+        'seller_share': int_to_bytes(seller_share),
+        'collab_share': int_to_bytes(collab_share),
+        'alaska_share': int_to_bytes(alaska_share),
+    }
+
+
+# how a slot value is written in the teal source
+def _teal_value(slot: str, value: bytes) -> str:
+    return encoding.encode_address(value) if slot == 'seller' else '0x' + value.hex()
+
+
+def find_offsets(bytecode: bytes) -> dict:
+    offsets = {}
+    for slot, sentinel in SENTINELS.items():
+        found = []
+        start = bytecode.find(sentinel)
+        while start != -1:
+            found.append(start)
+            start = bytecode.find(sentinel, start + 1)
+        if not found:
+            raise ValueError(f'sentinel for {slot} not found in the compiled escrow')
+        offsets[slot] = found
+    return offsets
+
+
+@dataclass
+class EscrowTemplate:
+    bytecode: bytes
+    offsets: dict  # slot -> offsets of its sentinel in `bytecode`
+    teal: str
+
+    # whether the listing's values can be written over the sentinels: all different, and none a constant the
+    # escrow already has
+    def fits(self, seller: str, asset_index: int, price: int) -> bool:
+        teal_values = [_teal_value(slot, value) for slot, value in listing_values(seller, asset_index, price).items()]
+        return len(set(teal_values)) == len(teal_values) and not any(value in self.teal for value in teal_values)
+
+    def program(self, seller: str, asset_index: int, price: int) -> bytes:
+        if not self.fits(seller, asset_index, price):
+            raise ValueError('the listing values repeat a constant of the escrow, compile it with asset_sale_contract')
+        code = bytearray(self.bytecode)
+        for slot, value in listing_values(seller, asset_index, price).items():
+            for offset in self.offsets[slot]:
+                code[offset:offset + len(value)] = value
+        return bytes(code)
+
+    def signature(self, seller: str, asset_index: int, price: int) -> CompiledSignature:
+        program = self.program(seller, asset_index, price)
+        teal = self.teal
+        for slot, value in listing_values(seller, asset_index, price).items():
+            teal = teal.replace(_teal_value(slot, SENTINELS[slot]), _teal_value(slot, value))
+        return CompiledSignature(
+            address=logic.address(program),
+            bytecode_b64=base64.b64encode(program).decode(),
+            teal=teal,
+        )
+
+    def save(self, path: str = TEMPLATE_PATH):
+        with open(path, 'w') as f:
+            json.dump({'bytecode': base64.b64encode(self.bytecode).decode(), 'offsets': self.offsets,
+                       'teal': self.teal}, f)
+
+    @classmethod
+    def load(cls, path: str = TEMPLATE_PATH) -> 'EscrowTemplate':
+        with open(path) as f:
+            data = json.load(f)
+        return cls(bytecode=base64.b64decode(data['bytecode']), offsets=data['offsets'], teal=data['teal'])
+
+
+def compile_template(algod_client) -> EscrowTemplate:
+    teal = template_teal()
+    bytecode = base64.b64decode(algod_client.compile(teal)['result'])
+    return EscrowTemplate(bytecode=bytecode, offsets=find_offsets(bytecode), teal=teal)
+
+
+# the cached template if it was compiled from the current escrow teal, otherwise compiles and caches it
+def get_template(algod_client=None, path: str = TEMPLATE_PATH) -> EscrowTemplate:
+    teal = template_teal()
+    if os.path.exists(path):
+        template = EscrowTemplate.load(path)
+        if template.teal == teal:
+            return template
+    if algod_client is None:
+        from helpers.utils import get_algod_client
+        algod_client = get_algod_client()
+    template = compile_template(algod_client)
+    template.save(path)
+    return template
+
+
+# the escrow of a listing: from the template, or compiled through algod when its values do not fit the template
+def listing_signature(seller: str, asset_index: int, price: int, algod_client=None,
+                      path: str = TEMPLATE_PATH) -> CompiledSignature:
+    if algod_client is None:
+        from helpers.utils import get_algod_client
+        algod_client = get_algod_client()
+    template = get_template(algod_client, path)
+    if template.fits(seller, asset_index, price):
+        return template.signature(seller, asset_index, price)
+    from asc.asset_sale_contract import asset_sale_contract
+    teal = asset_sale_contract(seller, asset_index, price)
+    compiled = algod_client.compile(teal)
+    return CompiledSignature(address=compiled['hash'], bytecode_b64=compiled['result'], teal=teal)
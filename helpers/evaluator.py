@@ -0,0 +1,578 @@
+import copy
+from dataclasses import dataclass, field
+
+from algosdk import encoding
+from algosdk.logic import get_application_address
+
+# local evaluator for the TEAL assembly produced by pyteal's compileTeal(..., Mode.Application)
+# it covers the opcodes emitted for asc/contract.py and models just enough of the ledger (algo balances,
+# one asset per holding, app global/local state, inner transactions and fee pooling) to run groups offline
+
+MIN_TXN_FEE = 1000
+MIN_BALANCE = 100000
+ASSET_MIN_BALANCE = 100000
+APP_OPT_IN_MIN_BALANCE = 100000
+SCHEMA_INT_MIN_BALANCE = 28500
+SCHEMA_BYTES_MIN_BALANCE = 50000
+APP_CALL_BUDGET = 700
+MAX_UINT64 = 2 ** 64 - 1
+ZERO_ADDRESS = bytes(32)
+
+TYPE_ENUMS = {'unknown': 0, 'pay': 1, 'keyreg': 2, 'acfg': 3, 'axfer': 4, 'afrz': 5, 'appl': 6}
+ON_COMPLETIONS = {'NoOp': 0, 'OptIn': 1, 'CloseOut': 2, 'ClearState': 3, 'UpdateApplication': 4,
+                  'DeleteApplication': 5}
+NAMED_INTS = {**TYPE_ENUMS, **ON_COMPLETIONS}
+
+# default value of every transaction field the programs may read
+TXN_DEFAULTS = {
+    'Sender': ZERO_ADDRESS,
+    'Fee': 0,
+    'FirstValid': 0,
+    'LastValid': 0,
+    'Note': b'',
+    'Lease': ZERO_ADDRESS,
+    'Receiver': ZERO_ADDRESS,
+    'Amount': 0,
+    'CloseRemainderTo': ZERO_ADDRESS,
+    'TypeEnum': 0,
+    'XferAsset': 0,
+    'AssetAmount': 0,
+    'AssetSender': ZERO_ADDRESS,
+    'AssetReceiver': ZERO_ADDRESS,
+    'AssetCloseTo': ZERO_ADDRESS,
+    'ApplicationID': 0,
+    'OnCompletion': 0,
+    'ApplicationArgs': [],
+    'Accounts': [],
+    'Assets': [],
+    'RekeyTo': ZERO_ADDRESS,
+}
+
+OP_COSTS = {'divmodw': 20}
+INNER_ADDRESS_FIELDS = ('Sender', 'Receiver', 'CloseRemainderTo', 'AssetSender', 'AssetReceiver', 'AssetCloseTo')
+
+
+class EvaluationError(Exception):
+    def __init__(self, msg, txn_index=None, pc=None, line=None, cost=0):
+        super().__init__(msg)
+        self.txn_index = txn_index
+        self.pc = pc
+        self.line = line
+        self.cost = cost
+
+
+@dataclass
+class GroupResult:
+    cost: int  # opcodes executed across all app calls
+    inner_txns: int  # number of inner transactions submitted
+    fees: int  # total fees paid by the group, outer and inner
+
+
+@dataclass
+class Account:
+    amount: int = 0
+    assets: dict = field(default_factory=dict)  # asset id -> amount
+    local: dict = field(default_factory=dict)  # app id -> {key: value}
+
+
+@dataclass
+class Asset:
+    creator: bytes
+    total: int = 1
+    decimals: int = 0
+    default_frozen: int = 0
+    manager: bytes = ZERO_ADDRESS
+    reserve: bytes = ZERO_ADDRESS
+    freeze: bytes = ZERO_ADDRESS
+    clawback: bytes = ZERO_ADDRESS
+
+
+@dataclass
+class App:
+    creator: bytes
+    address: bytes
+    program: 'Program'
+    local_schema: tuple = (0, 0)  # (ints, bytes)
+    global_state: dict = field(default_factory=dict)
+
+
+@dataclass
+class Ledger:
+    round: int = 1
+    accounts: dict = field(default_factory=dict)  # 32-byte address -> Account
+    assets: dict = field(default_factory=dict)  # asset id -> Asset
+    apps: dict = field(default_factory=dict)  # app id -> App
+    fee_sink: int = 0  # fees collected by the network
+    next_index: int = 1000
+
+    def account(self, address: bytes) -> Account:
+        if address not in self.accounts:
+            self.accounts[address] = Account()
+        return self.accounts[address]
+
+    def create_asset(self, creator: bytes, **params) -> int:
+        asset_id = self._new_index()
+        self.assets[asset_id] = Asset(creator=creator, **params)
+        self.account(creator).assets[asset_id] = self.assets[asset_id].total
+        return asset_id
+
+    def min_balance(self, address: bytes) -> int:
+        acct = self.accounts.get(address)
+        if acct is None or (acct.amount == 0 and not acct.assets and not acct.local):
+            return 0
+        required = MIN_BALANCE + ASSET_MIN_BALANCE * len(acct.assets)
+        for app_id in acct.local:
+            ints, byte_slices = self.apps[app_id].local_schema
+            required += APP_OPT_IN_MIN_BALANCE + SCHEMA_INT_MIN_BALANCE * ints + SCHEMA_BYTES_MIN_BALANCE * byte_slices
+        return required
+
+    def total_algos(self) -> int:
+        return sum(a.amount for a in self.accounts.values()) + self.fee_sink
+
+    def _new_index(self) -> int:
+        self.next_index += 1
+        return self.next_index
+
+
+class Program:
+    # parsed TEAL assembly: a list of (opcode, immediates, source line) and the label table
+    def __init__(self, teal: str):
+        self.ops = []
+        self.labels = {}
+        for line_no, raw in enumerate(teal.splitlines(), start=1):
+            line = raw.split('//')[0].strip()
+            if not line or line.startswith('#pragma'):
+                continue
+            if line.endswith(':'):
+                self.labels[line[:-1]] = len(self.ops)
+                continue
+            op, _, rest = line.partition(' ')
+            self.ops.append((op, _parse_immediates(op, rest.strip()), line_no))
+
+    def __deepcopy__(self, memo):
+        # programs are immutable, ledger snapshots can share them
+        return self
+
+
+def _parse_immediates(op: str, rest: str):
+    if op == 'byte':
+        if rest.startswith('"'):
+            return [rest[1:-1].encode().decode('unicode_escape').encode('latin-1')]
+        if rest.startswith('0x'):
+            return [bytes.fromhex(rest[2:])]
+        raise ValueError(f'unsupported byte constant: {rest}')
+    if op == 'addr':
+        return [encoding.decode_address(rest)]
+    if op == 'int':
+        return [NAMED_INTS[rest] if rest in NAMED_INTS else int(rest)]
+    return rest.split() if rest else []
+
+
+def _to_address(address) -> bytes:
+    return encoding.decode_address(address) if isinstance(address, str) else address
+
+
+# builds an outer transaction dict keyed by TEAL field names, e.g. txn('appl', Sender=..., ApplicationID=...)
+def txn(type_name: str, **fields) -> dict:
+    t = {'TypeEnum': TYPE_ENUMS[type_name], 'Fee': MIN_TXN_FEE}
+    t.update(fields)
+    return t
+
+
+class _Context:
+    def __init__(self, ledger: Ledger, group: list, index: int, app_id: int, fee_credit: list):
+        self.ledger = ledger
+        self.group = group
+        self.index = index
+        self.txn = group[index]
+        self.app_id = app_id
+        self.fee_credit = fee_credit
+        self.inner = None
+        self.inner_count = 0
+        self.inner_fees = 0
+        self.cost = 0
+
+    # helpers resolving references the way AVM v5 does
+    def field(self, t: dict, name: str, array_index=None):
+        if name == 'NumAppArgs':
+            return len(t.get('ApplicationArgs', []))
+        if name == 'NumAccounts':
+            return len(t.get('Accounts', []))
+        if name == 'NumAssets':
+            return len(t.get('Assets', []))
+        if name == 'GroupIndex':
+            return next(i for i, g in enumerate(self.group) if g is t)
+        if name == 'Accounts':
+            return t['Sender'] if array_index == 0 else t.get('Accounts', [])[array_index - 1]
+        if name not in TXN_DEFAULTS:
+            raise EvaluationError(f'unsupported txn field {name}')
+        value = t.get(name, TXN_DEFAULTS[name])
+        if array_index is not None:
+            if array_index >= len(value):
+                raise EvaluationError(f'{name} index {array_index} out of range')
+            value = value[array_index]
+        return value
+
+    def global_field(self, name: str):
+        values = {
+            'MinTxnFee': MIN_TXN_FEE,
+            'MinBalance': MIN_BALANCE,
+            'ZeroAddress': ZERO_ADDRESS,
+            'GroupSize': len(self.group),
+            'Round': self.ledger.round,
+            'CurrentApplicationID': self.app_id,
+            'CurrentApplicationAddress': self.ledger.apps[self.app_id].address,
+            'CreatorAddress': self.ledger.apps[self.app_id].creator,
+        }
+        if name not in values:
+            raise EvaluationError(f'unsupported global field {name}')
+        return values[name]
+
+    def account_ref(self, ref) -> bytes:
+        if isinstance(ref, int):
+            return self.field(self.txn, 'Accounts', ref)
+        if ref == self.txn['Sender'] or ref in self.txn.get('Accounts', []) or ref == self.global_field(
+                'CurrentApplicationAddress'):
+            return ref
+        raise EvaluationError('invalid account reference')
+
+    def asset_ref(self, ref: int) -> int:
+        assets = self.txn.get('Assets', [])
+        if ref in assets:
+            return ref
+        if ref < len(assets):
+            return assets[ref]
+        raise EvaluationError(f'invalid asset reference {ref}')
+
+    def local_state(self, address: bytes) -> dict:
+        acct = self.ledger.accounts.get(address)
+        if acct is None or self.app_id not in acct.local:
+            raise EvaluationError('account is not opted in to the application')
+        return acct.local[self.app_id]
+
+
+def _check_uint(value):
+    if not isinstance(value, int):
+        raise EvaluationError('expected uint64')
+    return value
+
+
+def _check_bytes(value):
+    if not isinstance(value, bytes):
+        raise EvaluationError('expected bytes')
+    return value
+
+
+def _binary(stack, fn):
+    b = _check_uint(stack.pop())
+    a = _check_uint(stack.pop())
+    result = fn(a, b)
+    if result < 0 or result > MAX_UINT64:
+        raise EvaluationError('arithmetic overflow' if result > 0 else 'arithmetic underflow')
+    stack.append(result)
+
+
+def _divide(a, b, mod=False):
+    if b == 0:
+        raise EvaluationError('division by zero')
+    return a % b if mod else a // b
+
+
+def _run(program: Program, ctx: _Context, budget: int) -> int:
+    stack = []
+    scratch = [0] * 256
+    frames = []
+    pc = 0
+    cost = 0
+    ops = program.ops
+    try:
+        while pc < len(ops):
+            op, imm, _ = ops[pc]
+            cost += OP_COSTS.get(op, 1)
+            if cost > budget:
+                raise EvaluationError('dynamic cost budget exceeded')
+            pc += 1
+            if op in ('int', 'byte', 'addr'):
+                stack.append(imm[0])
+            elif op == 'txn':
+                stack.append(ctx.field(ctx.txn, imm[0]))
+            elif op == 'txna':
+                stack.append(ctx.field(ctx.txn, imm[0], int(imm[1])))
+            elif op == 'gtxn':
+                stack.append(ctx.field(ctx.group[int(imm[0])], imm[1]))
+            elif op == 'gtxna':
+                stack.append(ctx.field(ctx.group[int(imm[0])], imm[1], int(imm[2])))
+            elif op == 'gtxns':
+                index = _check_uint(stack.pop())
+                if index >= len(ctx.group):
+                    raise EvaluationError('gtxns index out of range')
+                stack.append(ctx.field(ctx.group[index], imm[0]))
+            elif op == 'global':
+                stack.append(ctx.global_field(imm[0]))
+            elif op == 'store':
+                scratch[int(imm[0])] = stack.pop()
+            elif op == 'load':
+                stack.append(scratch[int(imm[0])])
+            elif op == 'pop':
+                stack.pop()
+            elif op == 'dup':
+                stack.append(stack[-1])
+            elif op == 'swap':
+                stack[-1], stack[-2] = stack[-2], stack[-1]
+            elif op == 'btoi':
+                value = _check_bytes(stack.pop())
+                if len(value) > 8:
+                    raise EvaluationError('btoi arg too long')
+                stack.append(int.from_bytes(value, 'big'))
+            elif op in ('extract3', 'extract_uint64'):
+                length = _check_uint(stack.pop()) if op == 'extract3' else 8
+                start = _check_uint(stack.pop())
+                value = _check_bytes(stack.pop())
+                if start + length > len(value):
+                    raise EvaluationError(f'{op} range beyond the end of the bytes')
+                chunk = value[start:start + length]
+                stack.append(chunk if op == 'extract3' else int.from_bytes(chunk, 'big'))
+            elif op == 'itob':
+                stack.append(_check_uint(stack.pop()).to_bytes(8, 'big'))
+            elif op == 'len':
+                stack.append(len(_check_bytes(stack.pop())))
+            elif op == '+':
+                _binary(stack, lambda a, b: a + b)
+            elif op == '-':
+                _binary(stack, lambda a, b: a - b)
+            elif op == '*':
+                _binary(stack, lambda a, b: a * b)
+            elif op == '/':
+                _binary(stack, _divide)
+            elif op == '%':
+                _binary(stack, lambda a, b: _divide(a, b, mod=True))
+            elif op in ('<', '>', '<=', '>='):
+                b = _check_uint(stack.pop())
+                a = _check_uint(stack.pop())
+                stack.append(int({'<': a < b, '>': a > b, '<=': a <= b, '>=': a >= b}[op]))
+            elif op in ('==', '!='):
+                b = stack.pop()
+                a = stack.pop()
+                if type(a) is not type(b):
+                    raise EvaluationError('cannot compare uint64 to bytes')
+                stack.append(int((a == b) == (op == '==')))
+            elif op in ('&&', '||'):
+                b = _check_uint(stack.pop())
+                a = _check_uint(stack.pop())
+                stack.append(int(bool(a and b) if op == '&&' else bool(a or b)))
+            elif op == '!':
+                stack.append(int(_check_uint(stack.pop()) == 0))
+            elif op == 'mulw':
+                b = _check_uint(stack.pop())
+                a = _check_uint(stack.pop())
+                stack.extend([(a * b) >> 64, (a * b) & MAX_UINT64])
+            elif op == 'divmodw':
+                d_lo, d_hi = _check_uint(stack.pop()), _check_uint(stack.pop())
+                n_lo, n_hi = _check_uint(stack.pop()), _check_uint(stack.pop())
+                denominator = (d_hi << 64) | d_lo
+                if denominator == 0:
+                    raise EvaluationError('division by zero')
+                q, r = divmod((n_hi << 64) | n_lo, denominator)
+                stack.extend([q >> 64, q & MAX_UINT64, r >> 64, r & MAX_UINT64])
+            elif op == 'assert':
+                if not _check_uint(stack.pop()):
+                    raise EvaluationError('assert failed')
+            elif op == 'err':
+                raise EvaluationError('err opcode executed')
+            elif op == 'return':
+                return _check_uint(stack.pop())
+            elif op == 'b':
+                pc = program.labels[imm[0]]
+            elif op in ('bnz', 'bz'):
+                if bool(_check_uint(stack.pop())) == (op == 'bnz'):
+                    pc = program.labels[imm[0]]
+            elif op == 'callsub':
+                frames.append(pc)
+                pc = program.labels[imm[0]]
+            elif op == 'retsub':
+                pc = frames.pop()
+            elif op == 'app_global_get':
+                stack.append(ctx.ledger.apps[ctx.app_id].global_state.get(_check_bytes(stack.pop()), 0))
+            elif op == 'app_global_put':
+                value = stack.pop()
+                ctx.ledger.apps[ctx.app_id].global_state[_check_bytes(stack.pop())] = value
+            elif op == 'app_local_get':
+                key = _check_bytes(stack.pop())
+                stack.append(ctx.local_state(ctx.account_ref(stack.pop())).get(key, 0))
+            elif op == 'app_local_put':
+                value = stack.pop()
+                key = _check_bytes(stack.pop())
+                ctx.local_state(ctx.account_ref(stack.pop()))[key] = value
+            elif op == 'app_local_del':
+                key = _check_bytes(stack.pop())
+                ctx.local_state(ctx.account_ref(stack.pop())).pop(key, None)
+            elif op == 'asset_holding_get':
+                asset_id = ctx.asset_ref(_check_uint(stack.pop()))
+                holder = ctx.ledger.accounts.get(ctx.account_ref(stack.pop()))
+                if holder is not None and asset_id in holder.assets:
+                    stack.extend([holder.assets[asset_id], 1])
+                else:
+                    stack.extend([0, 0])
+            elif op == 'asset_params_get':
+                asset = ctx.ledger.assets.get(ctx.asset_ref(_check_uint(stack.pop())))
+                if asset is None:
+                    stack.extend([0, 0])
+                else:
+                    name = imm[0][len('Asset'):]
+                    value = {'Total': asset.total, 'Decimals': asset.decimals,
+                             'DefaultFrozen': asset.default_frozen, 'Manager': asset.manager,
+                             'Reserve': asset.reserve, 'Freeze': asset.freeze, 'Clawback': asset.clawback,
+                             'Creator': asset.creator}[name]
+                    stack.extend([value, 1])
+            elif op == 'itxn_begin':
+                ctx.inner = {'Sender': ctx.global_field('CurrentApplicationAddress'), 'Fee': MIN_TXN_FEE}
+            elif op == 'itxn_field':
+                value = stack.pop()
+                # addresses set on inner transactions must be available to the outer call, as for account refs
+                ctx.inner[imm[0]] = ctx.account_ref(value) if imm[0] in INNER_ADDRESS_FIELDS else value
+            elif op == 'itxn_submit':
+                _submit_inner(ctx)
+            else:
+                raise EvaluationError(f'unsupported opcode {op}')
+    except EvaluationError as err:
+        err.pc = pc - 1
+        err.line = ops[pc - 1][2]
+        err.cost = cost
+        raise
+    except IndexError as err:
+        raise EvaluationError(f'stack underflow or bad index: {err}', pc=pc - 1, line=ops[pc - 1][2], cost=cost)
+    finally:
+        ctx.cost = cost
+    if len(stack) != 1:
+        raise EvaluationError('stack must hold exactly one value at the end of the program', cost=cost)
+    return _check_uint(stack[0])
+
+
+def _submit_inner(ctx: _Context):
+    inner = ctx.inner
+    fee = inner.get('Fee', MIN_TXN_FEE)
+    if fee < MIN_TXN_FEE:
+        # fee pooling: the shortfall must be covered by outer transactions that overpaid
+        if ctx.fee_credit[0] < MIN_TXN_FEE - fee:
+            raise EvaluationError('inner transaction fee too small')
+        ctx.fee_credit[0] -= MIN_TXN_FEE - fee
+    _pay_fee(ctx.ledger, inner['Sender'], fee)
+    _apply(ctx.ledger, inner)
+    ctx.inner_count += 1
+    ctx.inner_fees += fee
+    ctx.inner = None
+
+
+def _pay_fee(ledger: Ledger, sender: bytes, fee: int):
+    acct = ledger.account(sender)
+    if acct.amount < fee:
+        raise EvaluationError('overspend: balance too low to pay the fee')
+    acct.amount -= fee
+    ledger.fee_sink += fee
+
+
+def _apply(ledger: Ledger, t: dict):
+    type_enum = t.get('TypeEnum', 0)
+    sender = t['Sender']
+    if type_enum == TYPE_ENUMS['pay']:
+        amount = t.get('Amount', 0)
+        source = ledger.account(sender)
+        if source.amount < amount:
+            raise EvaluationError('overspend')
+        source.amount -= amount
+        ledger.account(t.get('Receiver', ZERO_ADDRESS)).amount += amount
+        close_to = t.get('CloseRemainderTo', ZERO_ADDRESS)
+        if close_to != ZERO_ADDRESS:
+            ledger.account(close_to).amount += source.amount
+            source.amount = 0
+    elif type_enum == TYPE_ENUMS['axfer']:
+        asset_id = t.get('XferAsset', 0)
+        asset = ledger.assets.get(asset_id)
+        if asset is None:
+            raise EvaluationError(f'asset {asset_id} does not exist')
+        receiver = t.get('AssetReceiver', ZERO_ADDRESS)
+        amount = t.get('AssetAmount', 0)
+        source_address = sender
+        if t.get('AssetSender', ZERO_ADDRESS) != ZERO_ADDRESS:
+            if sender != asset.clawback:
+                raise EvaluationError('only the clawback address can revoke assets')
+            source_address = t['AssetSender']
+        if amount == 0 and source_address == receiver:
+            ledger.account(receiver).assets.setdefault(asset_id, 0)
+            return
+        source = ledger.account(source_address)
+        target = ledger.account(receiver)
+        if asset_id not in source.assets or asset_id not in target.assets:
+            raise EvaluationError('asset holding missing: account not opted in')
+        if source.assets[asset_id] < amount:
+            raise EvaluationError('asset underflow')
+        source.assets[asset_id] -= amount
+        target.assets[asset_id] += amount
+    else:
+        raise EvaluationError(f'unsupported transaction type {type_enum}')
+
+
+def _apply_app_call(ledger: Ledger, group: list, index: int, fee_credit: list, budget: int,
+                    approval: Program = None, local_schema: tuple = (0, 0)):
+    t = group[index]
+    app_id = t.get('ApplicationID', 0)
+    created = app_id == 0
+    if created:
+        app_id = ledger._new_index()
+        ledger.apps[app_id] = App(creator=t['Sender'], address=_to_address(get_application_address(app_id)),
+                                  program=approval, local_schema=local_schema)
+    if app_id not in ledger.apps:
+        raise EvaluationError(f'application {app_id} does not exist')
+    on_completion = t.get('OnCompletion', 0)
+    acct = ledger.account(t['Sender'])
+    if on_completion == ON_COMPLETIONS['OptIn']:
+        if app_id in acct.local:
+            raise EvaluationError('account already opted in to the application')
+        acct.local[app_id] = {}
+    ctx = _Context(ledger, group, index, app_id, fee_credit)
+    approved = _run(ledger.apps[app_id].program, ctx, budget)
+    if not approved:
+        raise EvaluationError('transaction rejected by ApprovalProgram', cost=ctx.cost)
+    if on_completion == ON_COMPLETIONS['CloseOut']:
+        acct.local.pop(app_id, None)
+    return app_id, ctx
+
+
+# evaluates an atomic group against `ledger`; on success the ledger is updated in place and a GroupResult
+# returned, on failure EvaluationError is raised (with txn_index, pc, line and cost) and the ledger is untouched
+# `approval`/`local_schema` are only used when the group creates an application
+def evaluate_group(ledger: Ledger, group: list, approval: Program = None, local_schema: tuple = (0, 0)) -> GroupResult:
+    if not 0 < len(group) <= 16:
+        raise EvaluationError('group size must be between 1 and 16')
+    snapshot = copy.deepcopy(ledger)
+    fees = sum(t.get('Fee', 0) for t in group)
+    if fees < MIN_TXN_FEE * len(group):
+        raise EvaluationError('group fees below the minimum')
+    fee_credit = [fees - MIN_TXN_FEE * len(group)]
+    budget = APP_CALL_BUDGET * sum(1 for t in group if t.get('TypeEnum') == TYPE_ENUMS['appl'])
+    cost = 0
+    inner_txns = 0
+    inner_fees = 0
+    index = 0
+    try:
+        for index, t in enumerate(group):
+            if t.get('RekeyTo', ZERO_ADDRESS) != ZERO_ADDRESS:
+                raise EvaluationError('rekeying is not supported by the local evaluator')
+            _pay_fee(ledger, t['Sender'], t.get('Fee', 0))
+            if t.get('TypeEnum') == TYPE_ENUMS['appl']:
+                _, ctx = _apply_app_call(ledger, group, index, fee_credit, budget - cost, approval, local_schema)
+                cost += ctx.cost
+                inner_txns += ctx.inner_count
+                inner_fees += ctx.inner_fees
+            else:
+                _apply(ledger, t)
+        for address, acct in ledger.accounts.items():
+            if acct.amount < ledger.min_balance(address):
+                raise EvaluationError('account balance below the minimum balance', txn_index=index)
+    except EvaluationError as err:
+        if err.txn_index is None:
+            err.txn_index = index
+        err.cost = cost + err.cost
+        ledger.__dict__.update(snapshot.__dict__)
+        raise
+    return GroupResult(cost=cost, inner_txns=inner_txns, fees=fees + inner_fees)
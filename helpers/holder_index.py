@@ -0,0 +1,228 @@
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+
+from algosdk import encoding
+
+# who holds each nft of a collection, in one lookup. built from an indexer-compatible source (an algosdk
+# IndexerClient, or LedgerIndexer below for offline runs): the holders of every asset are fetched with bounded
+# concurrency, then kept current by asking, for each asset of the collection, whether it was transferred in the
+# rounds after the last one indexed (one single-result query per asset, filtered on its id) and refetching only the
+# assets that were.
+#
+# in memory and on disk the index is compact: the sorted asset ids and, for each, the slot of its holder in an
+# address table (u64/u32 arrays), plus the holder -> assets map as offsets into a u32 array of asset positions
+#
+#   file: header | asset ids (u64) | holder slots (u32) | addresses (32 bytes each) | offsets (u32) | positions (u32)
+
+MAGIC = b'HIDX'
+HEADER = struct.Struct('<4sHQIII')  # magic, version, round, assets, addresses, positions
+VERSION = 1
+NO_HOLDER = 0xFFFFFFFF
+
+
+def _little_endian(values: array) -> bytes:
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_little_endian(typecode: str, data: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+# the account holding `asset_id` (largest balance, for an nft the only one), as returned by the source
+def fetch_holder(source, asset_id: int):
+    holder, best, next_page, current_round = None, 0, None, None
+    while True:
+        response = source.asset_balances(asset_id, next_page=next_page, min_balance=0)
+        current_round = current_round or response.get('current-round')
+        for balance in response.get('balances', []):
+            if balance['amount'] > best and not balance.get('deleted'):
+                holder, best = balance['address'], balance['amount']
+        next_page = response.get('next-token')
+        if not next_page or not response.get('balances'):
+            return holder, current_round
+
+
+# (whether `asset_id` was transferred from `min_round` on, current round of the source); a transaction that moved
+# it through an inner transfer (the clawback of a sale) is returned as well
+def was_transferred(source, asset_id: int, min_round: int):
+    response = source.search_transactions(asset_id=asset_id, txn_type='axfer', min_round=min_round, limit=1)
+    return bool(response.get('transactions')), response.get('current-round')
+
+
+class HolderIndex:
+    def __init__(self, asset_ids=(), round: int = 0):
+        self.asset_ids = array('Q', sorted(set(asset_ids)))
+        self.holder_slots = array('I', [NO_HOLDER]) * len(self.asset_ids)
+        self.addresses = []  # slot -> 32 byte address
+        self.slots = {}  # 32 byte address -> slot
+        self.by_holder = {}  # slot -> asset positions
+        self.round = round
+
+    def __len__(self):
+        return len(self.asset_ids)
+
+    def _position(self, asset_id: int) -> int:
+        i = bisect_left(self.asset_ids, asset_id)
+        if i == len(self.asset_ids) or self.asset_ids[i] != asset_id:
+            raise KeyError(f'asset {asset_id} is not in the collection')
+        return i
+
+    def holder(self, asset_id: int):
+        slot = self.holder_slots[self._position(asset_id)]
+        return None if slot == NO_HOLDER else encoding.encode_address(self.addresses[slot])
+
+    def assets_of(self, address: str) -> list:
+        slot = self.slots.get(encoding.decode_address(address))
+        return sorted(self.asset_ids[i] for i in self.by_holder.get(slot, ()))
+
+    def holders(self) -> dict:
+        return {encoding.encode_address(self.addresses[slot]): [self.asset_ids[i] for i in sorted(positions)]
+                for slot, positions in self.by_holder.items() if positions}
+
+    def set_holder(self, asset_id: int, address):
+        i = self._position(asset_id)
+        old = self.holder_slots[i]
+        if old != NO_HOLDER:
+            self.by_holder[old].discard(i)
+        if address is None:
+            self.holder_slots[i] = NO_HOLDER
+            return
+        raw = encoding.decode_address(address)
+        slot = self.slots.get(raw)
+        if slot is None:
+            slot = self.slots[raw] = len(self.addresses)
+            self.addresses.append(raw)
+        self.holder_slots[i] = slot
+        self.by_holder.setdefault(slot, set()).add(i)
+
+    def _refresh(self, source, asset_ids, workers: int):
+        rounds = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for asset_id, (holder, current_round) in zip(asset_ids, executor.map(
+                    lambda a: fetch_holder(source, a), asset_ids)):
+                self.set_holder(asset_id, holder)
+                if current_round:
+                    rounds.append(current_round)
+        return min(rounds) if rounds else self.round
+
+    # fetches the holder of every asset of the collection
+    @classmethod
+    def build(cls, source, asset_ids, workers: int = 8) -> 'HolderIndex':
+        index = cls(asset_ids)
+        index.round = index._refresh(source, list(index.asset_ids), workers)
+        return index
+
+    # applies the rounds after `self.round`: refetches the holders of the assets transferred since, returns them.
+    # the work grows with the size of the collection, not with the transfers of the whole chain
+    def update(self, source, workers: int = 8) -> list:
+        asset_ids = list(self.asset_ids)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            checks = list(executor.map(lambda a: was_transferred(source, a, self.round + 1), asset_ids))
+        touched = [asset_id for asset_id, (transferred, _) in zip(asset_ids, checks) if transferred]
+        rounds = [current_round for _, current_round in checks if current_round]
+        self._refresh(source, touched, workers)
+        # the lowest round every check covered: a later transfer is seen again next time, which is harmless
+        self.round = max(self.round, min(rounds, default=self.round))
+        return touched
+
+    def __contains__(self, asset_id: int) -> bool:
+        i = bisect_left(self.asset_ids, asset_id)
+        return i < len(self.asset_ids) and self.asset_ids[i] == asset_id
+
+    # writes the index, dropping addresses that no longer hold anything
+    def save(self, path: str):
+        slots = sorted(slot for slot, positions in self.by_holder.items() if positions)
+        renumber = {slot: new for new, slot in enumerate(slots)}
+        holder_slots = array('I', (renumber.get(s, NO_HOLDER) for s in self.holder_slots))
+        offsets, positions = array('I', [0]), array('I')
+        for slot in slots:
+            positions.extend(sorted(self.by_holder[slot]))
+            offsets.append(len(positions))
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, self.round, len(self.asset_ids), len(slots), len(positions)))
+            f.write(_little_endian(self.asset_ids))
+            f.write(_little_endian(holder_slots))
+            f.write(b''.join(self.addresses[slot] for slot in slots))
+            f.write(_little_endian(offsets))
+            f.write(_little_endian(positions))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'HolderIndex':
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, version, round, assets, addresses, pairs = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path} is not a holder index')
+        offset = HEADER.size
+        index = cls(round=round)
+
+        def take(size: int):
+            nonlocal offset
+            chunk = data[offset:offset + size]
+            offset += size
+            return chunk
+
+        index.asset_ids = _from_little_endian('Q', take(8 * assets))
+        index.holder_slots = _from_little_endian('I', take(4 * assets))
+        table = take(32 * addresses)
+        index.addresses = [table[i:i + 32] for i in range(0, len(table), 32)]
+        index.slots = {address: slot for slot, address in enumerate(index.addresses)}
+        offsets = _from_little_endian('I', take(4 * (addresses + 1)))
+        positions = _from_little_endian('I', take(4 * pairs))
+        index.by_holder = {slot: set(positions[offsets[slot]:offsets[slot + 1]]) for slot in range(addresses)}
+        return index
+
+
+# indexer stand-in over a helpers.evaluator Ledger, for offline runs: asset balances are read from the ledger and
+# `record()`, called after each evaluated group, logs a transfer for every holding that changed
+class LedgerIndexer:
+    def __init__(self, ledger, page_size: int = 1000):
+        self.ledger = ledger
+        self.page_size = page_size
+        self.transfers = []  # (round, asset id)
+        self.holdings = self._holdings()
+
+    def _holdings(self) -> dict:
+        return {(address, asset_id): amount for address, acct in self.ledger.accounts.items()
+                for asset_id, amount in acct.assets.items()}
+
+    def record(self):
+        holdings = self._holdings()
+        changed = {asset_id for (_, asset_id), _ in holdings.items() ^ self.holdings.items()}
+        self.transfers.extend((self.ledger.round, asset_id) for asset_id in sorted(changed))
+        self.holdings = holdings
+
+    def asset_balances(self, asset_id: int, next_page=None, min_balance=None, **kwargs):
+        balances = [{'address': encoding.encode_address(address), 'amount': amount}
+                    for (address, held), amount in sorted(self.holdings.items())
+                    if held == asset_id and (min_balance is None or amount > min_balance)]
+        start = int(next_page or 0)
+        page = balances[start:start + self.page_size]
+        response = {'balances': page, 'current-round': self.ledger.round}
+        if start + self.page_size < len(balances):
+            response['next-token'] = str(start + self.page_size)
+        return response
+
+    def search_transactions(self, txn_type=None, min_round=0, next_page=None, asset_id=None, limit=None, **kwargs):
+        transfers = [t for t in self.transfers if t[0] >= min_round and asset_id in (None, t[1])]
+        start = int(next_page or 0)
+        size = min(limit or self.page_size, self.page_size)
+        page = [{'tx-type': 'axfer', 'confirmed-round': r, 'asset-transfer-transaction': {'asset-id': transferred}}
+                for r, transferred in transfers[start:start + size]]
+        response = {'transactions': page, 'current-round': self.ledger.round}
+        if start + size < len(transfers):
+            response['next-token'] = str(start + size)
+        return response
@@ -0,0 +1,150 @@
+import heapq
+import itertools
+import threading
+import time
+
+from algosdk.error import AlgodHTTPError
+
+from helpers.client_pool import HEDGED_PATHS, REQUEST_TIMEOUT, TimeoutAlgodClient, is_node_failure
+from helpers.consts import Network
+
+# client side rate limiting for an algod node, shared by every client talking to the same endpoint:
+#   - a token bucket caps the request rate; the rate grows additively while requests succeed and is halved on 429
+#   - an AIMD window caps the requests in flight: +1/window per fast success, halved on 429/5xx/timeouts and cut by
+#     10% when latency climbs well above the best latency seen (the node is queueing)
+#   - waiting requests are served by priority: submissions, then confirmation polling and suggested params, then
+#     bulk reads
+# throttled requests (and failed reads) are retried with backoff, so helpers see fewer 429s instead of crashing
+
+SUBMIT, POLL, READ = 0, 1, 2
+POLL_PATHS = ('/status', '/transactions/pending/', '/transactions/params')
+LONG_POLL_PATHS = HEDGED_PATHS  # held open by the node until a block arrives, not a latency sample
+OK, THROTTLED, FAILED = 'ok', 'throttled', 'failed'
+
+
+def request_priority(method: str, requrl: str) -> int:
+    if method != 'GET':
+        return SUBMIT
+    if requrl.startswith(POLL_PATHS):
+        return POLL
+    return READ
+
+
+class AdaptiveLimiter:
+    def __init__(self, rate: float, burst: int = None, max_rate: float = None, window: float = 4,
+                 min_window: float = 1, max_window: float = 64, latency_factor: float = 2.0,
+                 decrease_interval: float = 1.0):
+        self.rate = rate  # tokens per second
+        self.max_rate = max_rate or 4 * rate
+        self.burst = burst or max(1, int(rate))
+        self.tokens = float(self.burst)
+        self.window = window  # requests allowed in flight
+        self.min_window = min_window
+        self.max_window = max_window
+        self.latency_factor = latency_factor
+        self.decrease_interval = decrease_interval  # one cut per interval, a burst of errors is one congestion event
+        self.baseline = None  # best recent latency, slowly forgetting
+        self.in_flight = 0
+        self.refilled = time.monotonic()
+        self.last_decrease = 0.0
+        self.waiting = []  # heap of (priority, sequence)
+        self.sequence = itertools.count()
+        self.cond = threading.Condition()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+
+    # `windowed` False for long polls: they take a token but do not hold a slot of the window while the node
+    # keeps them open
+    def acquire(self, priority: int = READ, windowed: bool = True):
+        with self.cond:
+            entry = (priority, next(self.sequence))
+            heapq.heappush(self.waiting, entry)
+            while True:
+                if self.waiting[0] == entry and (not windowed or self.in_flight < int(self.window)):
+                    self._refill(time.monotonic())
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        self.in_flight += windowed
+                        heapq.heappop(self.waiting)
+                        self.cond.notify_all()
+                        return
+                    self.cond.wait((1 - self.tokens) / self.rate)
+                else:
+                    self.cond.wait()
+
+    def _decrease(self, now: float, factor: float, rate_factor: float = 1.0):
+        if now - self.last_decrease < self.decrease_interval:
+            return
+        self.last_decrease = now
+        self.window = max(self.min_window, self.window * factor)
+        self.rate = max(1.0, self.rate * rate_factor)
+        if rate_factor < 1:
+            self.tokens = min(self.tokens, 0.0)  # drop the saved up burst as well
+
+    def release(self, elapsed: float, outcome: str = OK, windowed: bool = True):
+        with self.cond:
+            self.in_flight -= windowed
+            now = time.monotonic()
+            if outcome == THROTTLED:
+                self._decrease(now, 0.5, rate_factor=0.5)
+            elif outcome == FAILED:
+                self._decrease(now, 0.5)
+            elif windowed:
+                self.baseline = elapsed if self.baseline is None else \
+                    min(elapsed, self.baseline + 0.01 * (elapsed - self.baseline))
+                if elapsed > self.latency_factor * self.baseline:
+                    self._decrease(now, 0.9)
+                else:
+                    self.window = min(self.max_window, self.window + 1 / self.window)
+                    self.rate = min(self.max_rate, self.rate + 1 / self.rate)
+            self.cond.notify_all()
+
+    def snapshot(self) -> dict:
+        with self.cond:
+            return {'rate': round(self.rate, 2), 'window': round(self.window, 2), 'in_flight': self.in_flight,
+                    'waiting': len(self.waiting), 'baseline_latency': self.baseline}
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+# the limiter of `endpoint`, shared by every client of this process
+def limiter_for(endpoint: str) -> AdaptiveLimiter:
+    with _limiters_lock:
+        if endpoint not in _limiters:
+            _limiters[endpoint] = AdaptiveLimiter(Network.algod_rate)
+        return _limiters[endpoint]
+
+
+class LimitedAlgodClient(TimeoutAlgodClient):
+    def __init__(self, algod_token: str, algod_address: str, headers=None, limiter: AdaptiveLimiter = None,
+                 retries: int = 3, backoff: float = 0.25, timeout: float = REQUEST_TIMEOUT):
+        super().__init__(algod_token, algod_address, headers, timeout=timeout)
+        self.limiter = limiter or limiter_for(algod_address)
+        self.retries = retries
+        self.backoff = backoff
+
+    def algod_request(self, method, requrl, params=None, data=None, headers=None, response_format='json'):
+        priority = request_priority(method, requrl)
+        windowed = not requrl.startswith(LONG_POLL_PATHS)
+        for attempt in range(self.retries + 1):
+            self.limiter.acquire(priority, windowed)
+            start = time.monotonic()
+            try:
+                result = super().algod_request(method, requrl, params, data, headers, response_format)
+            except Exception as err:
+                throttled = isinstance(err, AlgodHTTPError) and err.code == 429
+                failed = is_node_failure(err)
+                # a refused request (4xx) is still an answer from a healthy node
+                self.limiter.release(time.monotonic() - start, THROTTLED if throttled else FAILED if failed else OK,
+                                     windowed)
+                # throttled requests were not processed and are safe to repeat; other failures only for reads
+                if attempt == self.retries or not (throttled or (failed and method == 'GET')):
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
+                continue
+            self.limiter.release(time.monotonic() - start, OK, windowed)
+            return result
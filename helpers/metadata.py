@@ -0,0 +1,122 @@
+import base64
+import hashlib
+import json
+import mimetypes
+import mmap
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+from helpers.utils import metadata_template
+
+# streaming metadata pipeline for a collection directory. every media file is a piece; an optional sidecar
+# `<name>.json` next to it holds its description/properties. pieces are hashed on a thread pool through
+# memory-mapped reads (hashlib releases the gil on large buffers) with a bounded number in flight, so arbitrarily
+# large collections are processed without holding more than `window` pieces in memory.
+#
+# for each piece we build:
+#   - the ARC-3 metadata json (written to `out_dir` for pinning) and its sha256, used as the asset `metadata_hash`
+#   - the ARC-69 note for the asset creation transaction
+
+ASA_URL_MAX_BYTES = 96
+ASA_NAME_MAX_BYTES = 32
+NOTE_MAX_BYTES = 1024
+HASH_CHUNK = 64 * 1024 * 1024
+
+
+@dataclass
+class Piece:
+    name: str
+    media_path: str
+    media_sha256: bytes
+    mime_type: Optional[str]
+    metadata: bytes  # ARC-3 metadata json, exactly the bytes that were hashed
+    metadata_hash: bytes  # sha256 of `metadata`, 32 bytes for the asset `metadata_hash` field
+    url: str  # asset url, pointing at the ARC-3 metadata file
+    note: bytes  # ARC-69 note
+
+
+# sha256 of a file through a memory-mapped read, in slices so that huge files do not need one huge mapping
+def hash_file(path: str) -> bytes:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return digest.digest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+            for start in range(0, size, HASH_CHUNK):
+                digest.update(view[start:start + HASH_CHUNK])
+    return digest.digest()
+
+
+# yields (name, media path, sidecar path or None) for every media file of `directory`, in name order
+def iter_collection(directory: str):
+    names = sorted(entry.name for entry in os.scandir(directory) if entry.is_file())
+    present = set(names)
+    for name in names:
+        stem, ext = os.path.splitext(name)
+        if ext.lower() == '.json':
+            continue
+        sidecar = stem + '.json'
+        yield stem, os.path.join(directory, name), os.path.join(directory, sidecar) if sidecar in present else None
+
+
+def build_piece(name: str, media_path: str, sidecar_path: Optional[str], media_url: str, metadata_url: str,
+                external_url: str = '') -> Piece:
+    extra = {}
+    if sidecar_path:
+        with open(sidecar_path) as f:
+            extra = json.load(f)
+    media_sha256 = hash_file(media_path)
+    mime_type = mimetypes.guess_type(media_path)[0]
+    description = extra.get('description', '')
+    properties = extra.get('properties', extra.get('attributes', {}))
+    arc3 = {
+        'name': extra.get('name', name),
+        'description': description,
+        'image': media_url,
+        'image_integrity': 'sha256-' + base64.b64encode(media_sha256).decode(),
+        'image_mimetype': mime_type,
+        'external_url': extra.get('external_url', external_url),
+        'properties': properties,
+    }
+    metadata = json.dumps({k: v for k, v in arc3.items() if v not in (None, '')}, sort_keys=True,
+                          separators=(',', ':')).encode()
+    url = metadata_url + '#arc3'
+    if len(url.encode()) > ASA_URL_MAX_BYTES:
+        raise ValueError(f'asset url for {name} is longer than {ASA_URL_MAX_BYTES} bytes: {url}')
+    note = metadata_template(description, 'arc69', extra.get('external_url', external_url), properties,
+                             media_url=media_url, mime_type=mime_type)
+    if len(note) > NOTE_MAX_BYTES:
+        raise ValueError(f'ARC-69 note for {name} is longer than {NOTE_MAX_BYTES} bytes')
+    return Piece(name=name, media_path=media_path, media_sha256=media_sha256, mime_type=mime_type,
+                 metadata=metadata, metadata_hash=hashlib.sha256(metadata).digest(), url=url, note=note)
+
+
+# streams the pieces of `directory` in name order; media is expected at `<base_url>/<file name>` and the ARC-3
+# metadata at `<base_url>/<name>.json` (each metadata file is also written to `out_dir` when given)
+def build_collection(directory: str, base_url: str, out_dir: str = None, external_url: str = '',
+                     workers: int = os.cpu_count(), window: int = None):
+    window = window or 4 * workers
+    base_url = base_url.rstrip('/')
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = deque()
+        for name, media_path, sidecar_path in iter_collection(directory):
+            in_flight.append(executor.submit(build_piece, name, media_path, sidecar_path,
+                                             f'{base_url}/{os.path.basename(media_path)}', f'{base_url}/{name}.json',
+                                             external_url))
+            if len(in_flight) >= window:
+                yield _write(in_flight.popleft().result(), out_dir)
+        while in_flight:
+            yield _write(in_flight.popleft().result(), out_dir)
+
+
+def _write(piece: Piece, out_dir: Optional[str]) -> Piece:
+    if out_dir:
+        with open(os.path.join(out_dir, piece.name + '.json'), 'wb') as f:
+            f.write(piece.metadata)
+    return piece
@@ -0,0 +1,138 @@
+from dataclasses import dataclass, field
+
+from algosdk import account
+from algosdk.future import transaction
+
+from helpers.consts import AppSchema, InnerTxns, MinBalance
+from helpers.utils import wait_for_confirmation
+
+# plans the algos every account needs for a batch of operations, so they can all be funded at once instead of
+# failing on a min balance check (or an inner transaction fee) and being topped up one round trip at a time.
+# an account needs its current min balance, plus what the planned opt-ins and app creations add to it, plus a
+# reserve for the fees it pays (outer transactions, and inner ones when the app pays them) and the algos it sends.
+# opt-ins the account already has are not counted twice, so a plan can be rerun after a partial failure.
+#
+#   planner = MinBalancePlanner()
+#   planner.opt_in_asset(buyer, asset_id)
+#   planner.opt_in_app(buyer, app_id)
+#   planner.pay_fees(buyer, 3)
+#   plan_sale_app(planner, app_address, fee_pooling)
+#   fund(client, creator_private_key, planner.shortfalls(client))
+
+MAX_GROUP_SIZE = 16
+
+
+@dataclass
+class AccountPlan:
+    assets: set = field(default_factory=set)  # asset ids to opt in to
+    apps: dict = field(default_factory=dict)  # app id -> local schema (ints, byteslices) to opt in to
+    created_apps: list = field(default_factory=list)  # (global ints, global byteslices, extra pages) of apps to create
+    txns: int = 0  # transactions whose fee the account pays, outer or inner
+    spend: int = 0  # algos sent besides fees
+
+
+def schema_min_balance(ints: int, byte_slices: int) -> int:
+    return MinBalance.schema_int * ints + MinBalance.schema_bytes * byte_slices
+
+
+class MinBalancePlanner:
+    def __init__(self, min_txn_fee: int = MinBalance.txn_fee):
+        self.min_txn_fee = min_txn_fee
+        self.accounts = {}  # address -> AccountPlan
+
+    def plan(self, address: str) -> AccountPlan:
+        if address not in self.accounts:
+            self.accounts[address] = AccountPlan()
+        return self.accounts[address]
+
+    def opt_in_asset(self, address: str, asset_id: int):
+        self.plan(address).assets.add(asset_id)
+
+    def opt_in_app(self, address: str, app_id: int,
+                   local_schema: tuple = (AppSchema.local_ints, AppSchema.local_bytes)):
+        self.plan(address).apps[app_id] = local_schema
+
+    def create_app(self, address: str, global_schema: tuple = (AppSchema.global_ints, AppSchema.global_bytes),
+                   extra_pages: int = 0):
+        self.plan(address).created_apps.append((*global_schema, extra_pages))
+
+    def pay_fees(self, address: str, txns: int):
+        self.plan(address).txns += txns
+
+    def spend(self, address: str, amount: int):
+        self.plan(address).spend += amount
+
+    # balance `address` needs for the plan, given its account info from algod (None for an account not created yet)
+    def required(self, address: str, info: dict = None) -> int:
+        plan = self.plan(address)
+        info = info or {}
+        held = {holding['asset-id'] for holding in info.get('assets', [])}
+        opted_in = {local['id'] for local in info.get('apps-local-state', [])}
+        required = max(info.get('min-balance', 0), MinBalance.account)
+        required += MinBalance.asset_opt_in * len(plan.assets - held)
+        for app_id, local_schema in plan.apps.items():
+            if app_id not in opted_in:
+                required += MinBalance.app_opt_in + schema_min_balance(*local_schema)
+        for ints, byte_slices, extra_pages in plan.created_apps:
+            required += MinBalance.app_page * (1 + extra_pages) + schema_min_balance(ints, byte_slices)
+        return required + plan.txns * self.min_txn_fee + plan.spend
+
+    # {address: microAlgos missing} for every planned account holding less than it needs
+    def shortfalls(self, client) -> dict:
+        missing = {}
+        for address in self.accounts:
+            info = client.account_info(address)
+            shortfall = self.required(address, info) - info.get('amount', 0)
+            if shortfall > 0:
+                missing[address] = shortfall
+        return missing
+
+
+# plans the app account of a sale app: its own min balance, plus the fees of the claim_fees inner payments, which
+# the app pays out of its balance unless they are pooled. execute_transfer and refund fees are taken from the
+# payment the app holds, so they need no reserve
+def plan_sale_app(planner: MinBalancePlanner, app_address: str, fee_pooling: bool = False, claims: int = 1,
+                  payees: int = 0):
+    planner.plan(app_address)
+    if not fee_pooling:
+        planner.pay_fees(app_address, claims * (payees or InnerTxns.claim_fees))
+
+
+# a listing escrow (asc/asset_sale_contract.py) is funded when it is put on sale with its min balance with the nft
+# opted in, plus the fees of the ESCROW_TXNS transactions it sends: its opt-in and the 2 that cancel the sale. the
+# escrow checks the fees against the network's min fee (Global.min_txn_fee), so a fee change needs no new escrow
+ESCROW_TXNS = 3
+
+
+def escrow_min_balance() -> int:
+    return MinBalance.account + MinBalance.asset_opt_in
+
+
+# the funding payment of a listing escrow, for the current `min_txn_fee` of the network
+def escrow_funding(min_txn_fee: int = MinBalance.txn_fee) -> int:
+    return escrow_min_balance() + ESCROW_TXNS * min_txn_fee
+
+
+# pays every shortfall from the account of `private_key`, all in one atomic group (one group per 16 payments)
+def fund(client, private_key, shortfalls: dict):
+    sender = account.address_from_private_key(private_key)
+    payments = [(address, amount) for address, amount in shortfalls.items() if address != sender]
+    if not payments:
+        print('every planned account is funded already')
+        return []
+    params = client.suggested_params()
+    txn_ids = []
+    for start in range(0, len(payments), MAX_GROUP_SIZE):
+        txns = [transaction.PaymentTxn(sender, params, address, amount)
+                for address, amount in payments[start:start + MAX_GROUP_SIZE]]
+        if len(txns) > 1:
+            transaction.assign_group_id(txns)
+        signed_txns = [txn.sign(private_key) for txn in txns]
+        for address, amount in payments[start:start + MAX_GROUP_SIZE]:
+            print(f'funding {address} with {amount} microAlgos')
+        client.send_transactions(signed_txns)
+        txn_ids += [signed_txn.transaction.get_txid() for signed_txn in signed_txns]
+    print('waiting for funding confirmation')
+    for txn_id in txn_ids:
+        wait_for_confirmation(client, txn_id)
+    return txn_ids
@@ -1,9 +1,14 @@
+import copy
+
 from algosdk import account
 from algosdk.future import transaction
-from algosdk.logic import get_application_address
 from algosdk.v2client.algod import AlgodClient
 
-from helpers.utils import wait_for_confirmation
+from helpers.consts import DefaultValues, InnerTxns
+from helpers.preflight import check_group
+from helpers.txn_templates import (buy_now_template, buy_now_values, buy_template, buy_values, cached_template,
+                                   decode_signed, send_signed, setup_sale_template, sign_group)
+from helpers.utils import claim_pages, get_global_state, pooled_fee_params, wait_for_confirmation
 
 
 # create new application
@@ -75,9 +80,31 @@ def opt_in(client: AlgodClient, private_key: str, index: int):
     # display results
     transaction_response = client.pending_transaction_info(txn_id)
     print('opt-in to app with id:', transaction_response['txn']['txn']['apid'])
+    return txn_id
+
+
+# opt-in to asset
+def opt_in_asset(client: AlgodClient, private_key: str, asset_id: int):
+    # declare sender
+    sender = account.address_from_private_key(private_key)
+
+    # get node suggested parameters
+    params = client.suggested_params()
+
+    # use the AssetTransferTxn class to begin accepting an asset
+    txn = transaction.AssetTransferTxn(sender=sender, sp=params, receiver=sender, amt=0, index=asset_id)
+    signed_txn = txn.sign(private_key)
+    txn_id = signed_txn.transaction.get_txid()
+
+    print('sending opt_in_asset transaction')
+    client.send_transactions([signed_txn])
+    print('waiting for opt_in_asset confirmation')
+    wait_for_confirmation(client, txn_id)
+
+    return txn_id
 
 
-def send_funds(client, private_key, receiver):
+def send_funds(client, private_key, receiver, amount: int = DefaultValues.app_funding):
     # declare sender
     sender = account.address_from_private_key(private_key)
 
@@ -85,7 +112,7 @@ def send_funds(client, private_key, receiver):
     params = client.suggested_params()
 
     # create unsigned transaction
-    txn = transaction.PaymentTxn(sender, params, receiver, 200000, None)
+    txn = transaction.PaymentTxn(sender, params, receiver, amount, None)
     signed_txn = txn.sign(private_key)
     txn_id = signed_txn.transaction.get_txid()
 
@@ -94,6 +121,7 @@ def send_funds(client, private_key, receiver):
     print('waiting for send_funds transaction')
     wait_for_confirmation(client, txn_id)
     print(f'transaction id: {txn_id}')
+    return txn_id
 
 
 def set_clawback(client: AlgodClient, private_key: str, asset_id: int, app_address: str):
@@ -126,69 +154,41 @@ def set_clawback(client: AlgodClient, private_key: str, asset_id: int, app_addre
 
 
 # setup sale using the application
-def setup_sale(client: AlgodClient, private_key, app_id, app_args, foreign_assets):
-    # define sender as creator
-    sender = account.address_from_private_key(private_key)
-    on_complete = transaction.OnComplete.NoOpOC
+# with `preflight` the call is evaluated by the node first and a rejection raises PreflightError before sending
+def setup_sale(client: AlgodClient, private_key, app_id, app_args, foreign_assets, preflight: bool = False):
     # get node suggested parameters
     params = client.suggested_params()
 
-    # create unsigned transaction
-    txn = transaction.ApplicationCallTxn(
-        sender=sender,
-        sp=params,
-        index=app_id,
-        on_complete=on_complete,
-        app_args=app_args,
-        foreign_assets=foreign_assets,
-    )
-    signed_txn = txn.sign(private_key)
-    txn_id = signed_txn.transaction.get_txid()
+    # sign from the pre-encoded template of the app (see helpers/txn_templates.py)
+    template = cached_template(setup_sale_template, params, app_id, foreign_assets[0])
+    signed_txns, txn_ids = sign_group(private_key, [(template, [{'apaa': app_args, 'fv': params.first,
+                                                                 'lv': params.last}])])
+    if preflight:
+        check_group(client, decode_signed(signed_txns), 'setup_sale')
 
     print('sending setup_sale transaction')
-    client.send_transactions([signed_txn])
+    send_signed(client, signed_txns)
     print('waiting for setup_sale confirmation')
-    wait_for_confirmation(client, txn_id)
+    wait_for_confirmation(client, txn_ids[0])
 
-    return txn_id
+    return txn_ids[0]
 
 
 # setup sale using the application
-def buy_asset(client: AlgodClient, private_key, app_account, app_id, app_args, foreign_assets, price: int):
-    # define sender as creator
-    buyer = account.address_from_private_key(private_key)
-    app_address = get_application_address(app_id)
-    on_complete = transaction.OnComplete.NoOpOC
-
+def buy_asset(client: AlgodClient, private_key, app_account, app_id, app_args, foreign_assets, price: int,
+              preflight: bool = False):
     # get node suggested parameters
     params = client.suggested_params()
-    # comment out the next two lines to use suggested fees
-    # params.flat_fee = True
-    # params.fee = 1000
-
-    # create unsigned app call transaction
-    app_call_txn = transaction.ApplicationCallTxn(
-        sender=buyer,
-        sp=params,
-        index=app_id,
-        on_complete=on_complete,
-        app_args=app_args,
-        accounts=[app_account],
-        foreign_assets=foreign_assets,
-    )
 
-    # create unsigned payment transaction
-    pay_txn = transaction.PaymentTxn(sender=buyer, receiver=app_address, amt=price, sp=params)
-
-    transaction.assign_group_id([app_call_txn, pay_txn])
-    signed_app_call_txn = app_call_txn.sign(private_key)
-    signed_pay_txn = pay_txn.sign(private_key)
+    # the app call and the payment to the app, signed from the pre-encoded template of the app
+    template = cached_template(buy_template, params, app_id, foreign_assets[0])
+    signed_txns, (app_txn_id, pay_txn_id) = sign_group(
+        private_key, [(template, buy_values(app_args, app_account, price, params.first, params.last))])
+    if preflight:
+        check_group(client, decode_signed(signed_txns), 'buy_asset')
 
     print('sending buy_asset transactions')
-    client.send_transactions([signed_app_call_txn, signed_pay_txn])
-
-    app_txn_id = signed_app_call_txn.transaction.get_txid()
-    pay_txn_id = signed_pay_txn.transaction.get_txid()
+    send_signed(client, signed_txns)
 
     print('waiting for buy_asset confirmation')
     wait_for_confirmation(client, app_txn_id)
@@ -197,20 +197,41 @@ def buy_asset(client: AlgodClient, private_key, app_account, app_id, app_args, f
     return app_txn_id, pay_txn_id
 
 
-# TODO: refund the transaction
+# pays for a listed nft and receives it in one atomic group (payment, then the buy_now call), so the sale
+# completes in a single round: there is no separate execute_transfer and no payment waiting in the app
+# with `fee_pooling` the app call fee also pays for the inner transfer and payout
+def buy_now(client: AlgodClient, private_key, seller_address, app_id, asset_id: int, price: int,
+            fee_pooling: bool = False, preflight: bool = False):
+    # get node suggested parameters
+    params = client.suggested_params()
 
-# execute the transfer
-def buyer_execute_transfer(client: AlgodClient, buyer_private_key, seller_address, app_id, app_args, foreign_assets):
-    # define sender as creator
+    # the payment comes first, so the app holds it when the call pays the seller
+    template = cached_template(buy_now_template, params, app_id, asset_id, InnerTxns.buy_now if fee_pooling else 0)
+    signed_txns, (pay_txn_id, app_txn_id) = sign_group(
+        private_key, [(template, buy_now_values(seller_address, price, params.first, params.last))])
+    if preflight:
+        check_group(client, decode_signed(signed_txns), 'buy_now')
+
+    print('sending buy_now transactions')
+    send_signed(client, signed_txns)
+
+    print('waiting for buy_now confirmation')
+    wait_for_confirmation(client, app_txn_id)
+
+    return app_txn_id, pay_txn_id
+
+
+# refund a payment whose nft has not been transferred yet, called by the buyer
+# without `fee_pooling` the inner payment fee is taken out of the refunded amount
+def buyer_refund(client: AlgodClient, buyer_private_key, seller_address, app_id, app_args, fee_pooling: bool = False):
     buyer = account.address_from_private_key(buyer_private_key)
 
     on_complete = transaction.OnComplete.NoOpOC
 
     # get node suggested parameters
     params = client.suggested_params()
-    # comment out the next two (2) lines to use suggested fees
-    # params.flat_fee = True
-    # params.fee = 1000
+    if fee_pooling:
+        pooled_fee_params(params, InnerTxns.refund)
 
     # create unsigned transaction
     txn = transaction.ApplicationCallTxn(
@@ -220,38 +241,87 @@ def buyer_execute_transfer(client: AlgodClient, buyer_private_key, seller_addres
         on_complete=on_complete,
         app_args=app_args,
         accounts=[seller_address],
-        foreign_assets=foreign_assets,
     )
     signed_txn = txn.sign(buyer_private_key)
     txn_id = signed_txn.transaction.get_txid()
 
-    print('sending buyer execution transaction')
+    print('sending buyer refund transaction')
     client.send_transactions([signed_txn])
-    print('waiting for buyer_execute_transfer confirmation')
+    print('waiting for buyer_refund confirmation')
     wait_for_confirmation(client, txn_id)
 
     return txn_id
 
+# execute the transfer
+# with `fee_pooling` the outer fee also pays for the inner transactions of the app (the contract requires the full
+# 1 + InnerTxns.execute_transfer min fees); with `preflight` the call is evaluated by the node first
+def buyer_execute_transfer(client: AlgodClient, buyer_private_key, seller_address, app_id, app_args, foreign_assets,
+                           fee_pooling: bool = False, preflight: bool = False):
+    # define sender as creator
+    buyer = account.address_from_private_key(buyer_private_key)
 
-# claim royalty fees
-def creator_claim_fees(client: AlgodClient, private_key: str, app_id: int, app_args):
-    creator = account.address_from_private_key(private_key)  # define sender as creator
-    on_complete = transaction.OnComplete.NoOpOC  # get node suggested parameters
+    on_complete = transaction.OnComplete.NoOpOC
+
+    # get node suggested parameters
     params = client.suggested_params()
+    # comment out the next two (2) lines to use suggested fees
+    # params.flat_fee = True
+    # params.fee = 1000
+    if fee_pooling:
+        pooled_fee_params(params, InnerTxns.execute_transfer)
 
     # create unsigned transaction
     txn = transaction.ApplicationCallTxn(
-        sender=creator,
+        sender=buyer,
         sp=params,
         index=app_id,
         on_complete=on_complete,
         app_args=app_args,
+        accounts=[seller_address],
+        foreign_assets=foreign_assets,
     )
-    signed_txn = txn.sign(private_key)
+    signed_txn = txn.sign(buyer_private_key)
+    if preflight:
+        check_group(client, [signed_txn], 'buyer_execute_transfer')
     txn_id = signed_txn.transaction.get_txid()
 
-    print('sending claim_fees transaction')
+    print('sending buyer execution transaction')
     client.send_transactions([signed_txn])
+    print('waiting for buyer_execute_transfer confirmation')
+    wait_for_confirmation(client, txn_id)
+
+    return txn_id
+
+
+# claim royalty fees
+# `payees` are the addresses of the app's royalty split, if it has one: each claim_fees call pays the payees it
+# passes as foreign accounts, so the payees from the app's claim cursor on are paid a page per call, all the calls
+# sent as one group. returns the id of the last call
+def creator_claim_fees(client: AlgodClient, private_key: str, app_id: int, app_args, fee_pooling: bool = False,
+                       payees: list = None):
+    creator = account.address_from_private_key(private_key)  # define sender as creator
+    on_complete = transaction.OnComplete.NoOpOC  # get node suggested parameters
+    params = client.suggested_params()
+    cursor = get_global_state(client, app_id).get(b'claim_cursor', 0) if payees else 0
+
+    # create unsigned transactions, one per page of payees
+    txns = []
+    for page in claim_pages(payees or [], cursor):
+        txns.append(transaction.ApplicationCallTxn(
+            sender=creator,
+            sp=pooled_fee_params(copy.copy(params), len(page) or InnerTxns.claim_fees) if fee_pooling else params,
+            index=app_id,
+            on_complete=on_complete,
+            app_args=app_args,
+            accounts=page or None,
+        ))
+    if len(txns) > 1:
+        transaction.assign_group_id(txns)
+    signed_txns = [txn.sign(private_key) for txn in txns]
+    txn_id = signed_txns[-1].transaction.get_txid()
+
+    print(f'sending claim_fees transactions ({len(signed_txns)})')
+    client.send_transactions(signed_txns)
     print('waiting for claim_fees confirmation')
     wait_for_confirmation(client, txn_id)
 
@@ -0,0 +1,230 @@
+import json
+import os
+from bisect import bisect_left, insort
+from dataclasses import dataclass
+
+# off-chain order book of the nfts currently for sale across sale apps, built from the apps' local state:
+# a seller's `amount_payment` is the listing price, `approve_transfer` == 0 means nobody has paid yet.
+# listings are indexed by price and by (asset, price) so storefront queries (cheapest n, under a price, cheapest
+# listing of an asset) are answered from memory; a json snapshot lets a new process start warm and then only
+# apply the state changes that happened since the snapshot round (catch_up: the app calls made since `round` name
+# the sellers they touched, and only those sellers' local state is fetched again)
+
+CHUNK_SIZE = 512
+
+
+class SortedList:
+    # list of lists kept in order: bisect over the chunk maxima, then inside one chunk of at most 2*CHUNK_SIZE
+    # items, so insert and remove cost O(log n) comparisons plus a bounded memmove
+    def __init__(self, items=()):
+        items = sorted(items)
+        self.chunks = [items[i:i + CHUNK_SIZE] for i in range(0, len(items), CHUNK_SIZE)]
+        self.maxes = [chunk[-1] for chunk in self.chunks]
+        self.size = len(items)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            yield from chunk
+
+    def add(self, item):
+        if not self.chunks:
+            self.chunks.append([item])
+            self.maxes.append(item)
+        else:
+            i = min(bisect_left(self.maxes, item), len(self.chunks) - 1)
+            chunk = self.chunks[i]
+            insort(chunk, item)
+            self.maxes[i] = chunk[-1]
+            if len(chunk) > 2 * CHUNK_SIZE:
+                self.chunks[i:i + 1] = [chunk[:CHUNK_SIZE], chunk[CHUNK_SIZE:]]
+                self.maxes[i:i + 1] = [chunk[CHUNK_SIZE - 1], chunk[-1]]
+        self.size += 1
+
+    def remove(self, item):
+        i = bisect_left(self.maxes, item)
+        if i == len(self.chunks):
+            raise ValueError(f'{item} not in list')
+        chunk = self.chunks[i]
+        j = bisect_left(chunk, item)
+        if j == len(chunk) or chunk[j] != item:
+            raise ValueError(f'{item} not in list')
+        del chunk[j]
+        self.size -= 1
+        if chunk:
+            self.maxes[i] = chunk[-1]
+        else:
+            del self.chunks[i]
+            del self.maxes[i]
+
+    # yields the items `lo` <= item < `hi` in order (None means unbounded)
+    def irange(self, lo=None, hi=None):
+        i = 0 if lo is None else bisect_left(self.maxes, lo)
+        for chunk in self.chunks[i:]:
+            start = 0 if lo is None else bisect_left(chunk, lo)
+            stop = len(chunk) if hi is None else bisect_left(chunk, hi)
+            yield from chunk[start:stop]
+            if stop < len(chunk):
+                return
+
+    def count_below(self, hi) -> int:
+        i = bisect_left(self.maxes, hi)
+        return sum(len(c) for c in self.chunks[:i]) + (bisect_left(self.chunks[i], hi) if i < len(self.chunks) else 0)
+
+
+@dataclass(frozen=True)
+class Listing:
+    app_id: int
+    seller: str
+    asset_id: int
+    price: int  # microAlgos
+
+
+class OrderBook:
+    def __init__(self):
+        self.listings = {}  # (app id, seller) -> Listing
+        self.by_price = SortedList()  # (price, app id, seller)
+        self.by_asset = SortedList()  # (asset id, price, app id, seller)
+        self.round = 0  # last round reflected in the book
+
+    def __len__(self):
+        return len(self.listings)
+
+    def get(self, app_id: int, seller: str):
+        return self.listings.get((app_id, seller))
+
+    def add(self, listing: Listing):
+        self.remove(listing.app_id, listing.seller)
+        self.listings[(listing.app_id, listing.seller)] = listing
+        self.by_price.add((listing.price, listing.app_id, listing.seller))
+        self.by_asset.add((listing.asset_id, listing.price, listing.app_id, listing.seller))
+
+    def remove(self, app_id: int, seller: str):
+        listing = self.listings.pop((app_id, seller), None)
+        if listing is not None:
+            self.by_price.remove((listing.price, app_id, seller))
+            self.by_asset.remove((listing.asset_id, listing.price, app_id, seller))
+        return listing
+
+    # applies a seller's decoded local state in a sale app (see helpers.utils.decode_state); None means the seller
+    # closed out. only listings nobody has paid for yet are kept
+    def apply_local_state(self, app_id: int, asset_id: int, seller: str, local_state):
+        price = (local_state or {}).get(b'amount_payment', 0)
+        if price and (local_state or {}).get(b'approve_transfer', 0) == 0:
+            self.add(Listing(app_id, seller, asset_id, price))
+        else:
+            self.remove(app_id, seller)
+
+    def cheapest(self, n: int, asset_id: int = None) -> list:
+        if asset_id is None:
+            items = self.by_price.irange()
+            keys = ((app_id, seller) for _, app_id, seller in items)
+        else:
+            items = self.by_asset.irange((asset_id,), (asset_id + 1,))
+            keys = ((app_id, seller) for _, _, app_id, seller in items)
+        result = []
+        for key in keys:
+            if len(result) == n:
+                break
+            result.append(self.listings[key])
+        return result
+
+    # listings with min_price <= price < max_price, cheapest first
+    def in_price_range(self, min_price: int = 0, max_price: int = None, asset_id: int = None, limit: int = None):
+        if asset_id is None:
+            items = self.by_price.irange((min_price,), None if max_price is None else (max_price,))
+            keys = [(app_id, seller) for _, app_id, seller in _take(items, limit)]
+        else:
+            items = self.by_asset.irange((asset_id, min_price),
+                                         (asset_id + 1,) if max_price is None else (asset_id, max_price))
+            keys = [(app_id, seller) for _, _, app_id, seller in _take(items, limit)]
+        return [self.listings[key] for key in keys]
+
+    def under(self, max_price: int, asset_id: int = None, limit: int = None):
+        return self.in_price_range(0, max_price, asset_id, limit)
+
+    def save(self, path: str):
+        snapshot = {'round': self.round,
+                    'listings': [[l.app_id, l.seller, l.asset_id, l.price] for l in self.listings.values()]}
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(snapshot, f, separators=(',', ':'))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'OrderBook':
+        book = cls()
+        if not os.path.exists(path):
+            return book
+        with open(path) as f:
+            snapshot = json.load(f)
+        listings = [Listing(*row) for row in snapshot['listings']]
+        book.listings = {(l.app_id, l.seller): l for l in listings}
+        book.by_price = SortedList((l.price, l.app_id, l.seller) for l in listings)
+        book.by_asset = SortedList((l.asset_id, l.price, l.app_id, l.seller) for l in listings)
+        book.round = snapshot['round']
+        return book
+
+    # full scan of the sellers of `app_ids` through an indexer (algosdk.v2client.indexer.IndexerClient)
+    def load_from_indexer(self, indexer_client, app_ids):
+        from helpers.utils import decode_state
+
+        for app_id in app_ids:
+            app = indexer_client.applications(app_id)
+            self.round = max(self.round, app.get('current-round', 0))
+            global_state = decode_state(app['application']['params'].get('global-state'))
+            asset_id = global_state.get(b'asset_id', 0)
+            next_page = ''
+            while True:
+                response = indexer_client.accounts(application_id=app_id, next_page=next_page)
+                for acct in response.get('accounts', []):
+                    for local in acct.get('apps-local-state', []):
+                        if local['id'] == app_id:
+                            self.apply_local_state(app_id, asset_id, acct['address'],
+                                                   decode_state(local.get('key-value')))
+                next_page = response.get('next-token')
+                if not next_page:
+                    break
+        return self
+
+    # applies the rounds after `self.round` for `app_ids`: scans their app calls through an indexer and refetches the
+    # local state of the sellers they touched (the sender, and the seller passed as first account). returns the
+    # (app id, seller) pairs refreshed
+    def catch_up(self, indexer_client, app_ids) -> list:
+        from helpers.utils import decode_state
+
+        refreshed, rounds = [], []
+        for app_id in app_ids:
+            touched, next_page = set(), ''
+            while True:
+                response = indexer_client.search_transactions(application_id=app_id, txn_type='appl',
+                                                              min_round=self.round + 1, next_page=next_page)
+                rounds.append(response.get('current-round', self.round))
+                for txn in response.get('transactions', []):
+                    touched.add(txn['sender'])
+                    touched.update(txn.get('application-transaction', {}).get('accounts', [])[:1])
+                next_page = response.get('next-token')
+                if not next_page or not response.get('transactions'):
+                    break
+            if not touched:
+                continue
+            app = indexer_client.applications(app_id)
+            asset_id = decode_state(app['application']['params'].get('global-state')).get(b'asset_id', 0)
+            for seller in sorted(touched):
+                account = indexer_client.account_info(seller).get('account', {})
+                local = next((local for local in account.get('apps-local-state', []) if local['id'] == app_id), None)
+                self.apply_local_state(app_id, asset_id, seller,
+                                       None if local is None else decode_state(local.get('key-value')))
+                refreshed.append((app_id, seller))
+        # the lowest round every scan covered: later changes are scanned again next time, which is harmless
+        self.round = max(self.round, min(rounds, default=self.round))
+        return refreshed
+
+
+def _take(items, limit):
+    for i, item in enumerate(items):
+        if limit is not None and i >= limit:
+            return
+        yield item
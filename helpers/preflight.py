@@ -0,0 +1,144 @@
+import base64
+import copy
+import re
+from dataclasses import dataclass
+
+import msgpack
+from algosdk import encoding
+from algosdk.error import AlgodHTTPError
+from algosdk.future import transaction
+
+from helpers.evaluator import EvaluationError, Ledger, evaluate_group, txn
+
+# evaluates a signed group before it is sent, so a call the app would reject (wrong price, missing opt-in, missing
+# clawback) fails at once with the failing assertion and its opcode cost instead of after a confirmation wait.
+#   - preflight(client, ...) asks the node: the simulate endpoint, or /teal/dryrun on nodes without it (the
+#     developer api must be enabled for dryrun)
+#   - preflight_local(ledger, ...) runs the group against a helpers.evaluator Ledger, for offline runs
+# both are a pass/fail check: they return the cost and the inner transactions issued, and leave the fees alone (the
+# contract asserts the pooled fee covers the InnerTxns count, so there is nothing to lower)
+
+
+class PreflightError(Exception):
+    def __init__(self, msg, txn_index=None, pc=None, line=None, cost=0):
+        super().__init__(msg)
+        self.txn_index = txn_index
+        self.pc = pc
+        self.line = line  # teal source line, when known
+        self.cost = cost
+
+
+@dataclass
+class PreflightResult:
+    cost: int  # opcodes executed across all app calls
+    inner_txns: int = None  # None when the node does not report them (dryrun)
+
+    def __str__(self):
+        inner = f', {self.inner_txns} inner txn(s)' if self.inner_txns is not None else ''
+        return f'cost {self.cost}{inner}'
+
+
+def _count_inner(result: dict) -> int:
+    return sum(1 + _count_inner(inner) for inner in result.get('inner-txns', []))
+
+
+def _pc(message: str):
+    match = re.search(r'pc=(\d+)', message or '')
+    return int(match.group(1)) if match else None
+
+
+def _simulate(client, signed_txns: list) -> PreflightResult:
+    # canonical encodings of the signed transactions, as sent to /transactions
+    txns = [msgpack.unpackb(base64.b64decode(encoding.msgpack_encode(stxn))) for stxn in signed_txns]
+    request = {'txn-groups': [{'txns': txns}]}
+    response = client.algod_request('POST', '/transactions/simulate', params={'format': 'json'},
+                                    data=msgpack.packb(request, use_bin_type=True),
+                                    headers={'Content-Type': 'application/msgpack'})
+    group = response['txn-groups'][0]
+    cost = group.get('app-budget-consumed', 0)
+    if group.get('failure-message'):
+        failed_at = group.get('failed-at') or [None]
+        raise PreflightError(group['failure-message'], txn_index=failed_at[0], pc=_pc(group['failure-message']),
+                             cost=cost)
+    inner_txns = sum(_count_inner(r.get('txn-result', {})) for r in group.get('txn-results', []))
+    return PreflightResult(cost, inner_txns)
+
+
+def _dryrun(client, signed_txns: list) -> PreflightResult:
+    response = client.dryrun(transaction.create_dryrun(client, signed_txns))
+    if response.get('error'):
+        raise PreflightError(response['error'])
+    cost = 0
+    for index, result in enumerate(response.get('txns', [])):
+        txn_cost = result.get('budget-consumed', result.get('cost')) or 0
+        cost += txn_cost
+        for kind in ('logic-sig', 'app-call'):
+            messages = result.get(f'{kind}-messages') or []
+            if 'REJECT' in messages:
+                trace = result.get(f'{kind}-trace') or [{}]
+                detail = '; '.join(m for m in messages if m not in ('ApprovalProgram', 'REJECT'))
+                raise PreflightError(f'{kind} rejected: {detail or "program returned false"}', txn_index=index,
+                                     pc=trace[-1].get('pc'), line=trace[-1].get('line'), cost=cost)
+    # dryrun does not report inner transactions
+    return PreflightResult(cost)
+
+
+# evaluates `signed_txns` (one atomic group) against the current state of the node
+def preflight(client, signed_txns: list) -> PreflightResult:
+    try:
+        return _simulate(client, signed_txns)
+    except AlgodHTTPError as err:
+        if err.code not in (404, 405):
+            raise PreflightError(f'simulate refused the group: {err}')
+    try:
+        return _dryrun(client, signed_txns)
+    except AlgodHTTPError as err:
+        raise PreflightError(f'the node supports neither simulate nor dryrun: {err}')
+
+
+def _address(address) -> bytes:
+    return encoding.decode_address(address) if address else None
+
+
+# converts an algosdk transaction into the txn dict of helpers.evaluator
+def to_evaluator_txn(t: transaction.Transaction) -> dict:
+    fields = {'Sender': _address(t.sender), 'Fee': t.fee, 'FirstValid': t.first_valid_round,
+              'LastValid': t.last_valid_round, 'Note': t.note or b'', 'Lease': t.lease,
+              'RekeyTo': _address(t.rekey_to)}
+    if isinstance(t, transaction.PaymentTxn):
+        type_name = 'pay'
+        fields.update(Receiver=_address(t.receiver), Amount=t.amt, CloseRemainderTo=_address(t.close_remainder_to))
+    elif isinstance(t, transaction.AssetTransferTxn):
+        type_name = 'axfer'
+        fields.update(XferAsset=t.index, AssetAmount=t.amount, AssetReceiver=_address(t.receiver),
+                      AssetSender=_address(t.revocation_target), AssetCloseTo=_address(t.close_assets_to))
+    elif isinstance(t, transaction.ApplicationCallTxn):
+        type_name = 'appl'
+        fields.update(ApplicationID=t.index, OnCompletion=int(t.on_complete),
+                      ApplicationArgs=list(t.app_args or []), Accounts=[_address(a) for a in t.accounts or []],
+                      Assets=list(t.foreign_assets or []))
+    else:
+        raise PreflightError(f'{type(t).__name__} is not supported by the local evaluator')
+    return txn(type_name, **{name: value for name, value in fields.items() if value is not None})
+
+
+# evaluates `signed_txns` against a copy of `ledger`, which is left untouched
+def preflight_local(ledger: Ledger, signed_txns: list) -> PreflightResult:
+    group = [to_evaluator_txn(stxn.transaction) for stxn in signed_txns]
+    try:
+        result = evaluate_group(copy.deepcopy(ledger), group)
+    except EvaluationError as err:
+        raise PreflightError(str(err), txn_index=err.txn_index, pc=err.pc, line=err.line, cost=err.cost)
+    return PreflightResult(result.cost, result.inner_txns)
+
+
+# runs the node preflight of a group about to be sent by `operation`, printing the outcome
+def check_group(client, signed_txns: list, operation: str) -> PreflightResult:
+    try:
+        result = preflight(client, signed_txns)
+    except PreflightError as err:
+        where = f' (txn {err.txn_index}, pc {err.pc}, line {err.line}, cost {err.cost})'
+        print(f'{operation} preflight failed: {err}{where}')
+        raise
+    print(f'{operation} preflight passed: {result}')
+    return result
@@ -34,6 +34,50 @@ def check_self(group_size: Expr = Int(1), group_index: Expr = Int(0)):
     )
 
 
+# stores a * b / divisor in `quotient` and a * b % divisor in `remainder`: the product is taken on 128 bits (mulw)
+# and divided in the same pass (divmodw), so it cannot overflow. the high words of the results are dropped, callers
+# must make sure the quotient fits in 64 bits (the remainder always does, it is below `divisor`)
+class MulDivMod(Expr):
+    def __init__(self, a: Expr, b: Expr, divisor: Expr, quotient: ScratchVar, remainder: ScratchVar):
+        super().__init__()
+        self.a = a
+        self.b = b
+        self.divisor = divisor
+        self.quotient = quotient
+        self.remainder = remainder
+
+    def __teal__(self, options):
+        from pyteal.ir import Op, TealOp, TealSimpleBlock
+
+        a_start, a_end = self.a.__teal__(options)
+        b_start, b_end = self.b.__teal__(options)
+        divisor_start, divisor_end = self.divisor.__teal__(options)
+        # stack: a, b -> product high, product low, 0 (divisor high word), divisor
+        multiply = TealSimpleBlock([TealOp(self, Op.mulw), TealOp(self, Op.int, 0)])
+        # stack: quotient high, quotient low, remainder high, remainder low
+        divide = TealSimpleBlock([
+            TealOp(self, Op.divmodw),
+            TealOp(self, Op.store, self.remainder.slot),
+            TealOp(self, Op.pop),
+            TealOp(self, Op.store, self.quotient.slot),
+            TealOp(self, Op.pop),
+        ])
+        a_end.setNextBlock(b_start)
+        b_end.setNextBlock(multiply)
+        multiply.setNextBlock(divisor_start)
+        divisor_end.setNextBlock(divide)
+        return a_start, divide
+
+    def __str__(self):
+        return f'(MulDivMod {self.a} {self.b} {self.divisor})'
+
+    def type_of(self):
+        return TealType.none
+
+    def has_return(self):
+        return False
+
+
 def application(pyteal: Expr) -> str:
     return compileTeal(pyteal, mode=Mode.Application, version=MAX_TEAL_VERSION)
 
@@ -0,0 +1,164 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, fields
+from typing import Optional
+
+# registry of minted assets and deployed sale apps, replacing the ASSET_ID/APP_ID/APP_ADDRESS lines appended to
+# .env: every mint and deploy is recorded here and scripts resolve their targets by asset, app or creator through
+# indexed lookups. sqlite in wal mode lets several processes (parallel mints, the daemon, the cli) read while one
+# writes; writers wait on a busy timeout instead of failing, and each thread uses its own connection
+#
+# the database lives next to .env unless REGISTRY_PATH says otherwise
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'registry.db')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS assets (
+    asset_id INTEGER PRIMARY KEY,
+    creator TEXT NOT NULL,
+    name TEXT,
+    url TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS assets_by_creator ON assets (creator, asset_id);
+CREATE TABLE IF NOT EXISTS deployments (
+    app_id INTEGER PRIMARY KEY,
+    app_address TEXT NOT NULL UNIQUE,
+    asset_id INTEGER NOT NULL,
+    creator TEXT NOT NULL,
+    program_hash TEXT,
+    royalty_fee INTEGER,
+    waiting_time INTEGER,
+    fee_pooling INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS deployments_by_asset ON deployments (asset_id, app_id);
+CREATE INDEX IF NOT EXISTS deployments_by_creator ON deployments (creator, app_id);
+'''
+
+
+@dataclass
+class Asset:
+    asset_id: int
+    creator: str
+    name: Optional[str] = None
+    url: Optional[str] = None
+
+
+@dataclass
+class Deployment:
+    app_id: int
+    app_address: str
+    asset_id: int
+    creator: str
+    program_hash: Optional[str] = None  # sha256 of the approval program bytecode
+    royalty_fee: Optional[int] = None
+    waiting_time: Optional[int] = None
+    fee_pooling: bool = False
+
+    def __post_init__(self):
+        self.fee_pooling = bool(self.fee_pooling)  # stored as an integer
+
+
+def program_hash(program: bytes) -> str:
+    return hashlib.sha256(program).hexdigest()
+
+
+def _columns(cls) -> str:
+    return ', '.join(f.name for f in fields(cls))
+
+
+class Registry:
+    # `path` defaults to REGISTRY_PATH, read when the registry is opened so that a .env loaded later applies
+    def __init__(self, path: str = None, timeout: float = 30.0):
+        self.path = path or os.getenv('REGISTRY_PATH', DEFAULT_PATH)
+        self.timeout = timeout
+        self.local = threading.local()
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+        return connection
+
+    def close(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self.local.connection = None
+
+    def _one(self, cls, query: str, params: tuple):
+        row = self._connection().execute(query, params).fetchone()
+        return cls(*row) if row else None
+
+    def _all(self, cls, query: str, params: tuple) -> list:
+        return [cls(*row) for row in self._connection().execute(query, params)]
+
+    # writes run in their own transaction; BEGIN IMMEDIATE takes the write lock up front so concurrent writers
+    # queue on the busy timeout instead of failing halfway
+    def _write(self, query: str, params: tuple):
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute(query, params)
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def add_asset(self, asset: Asset):
+        self._write(f'INSERT INTO assets ({_columns(Asset)}, created_at) VALUES (?, ?, ?, ?, ?) '
+                    'ON CONFLICT (asset_id) DO UPDATE SET creator = excluded.creator, name = excluded.name, '
+                    'url = excluded.url',
+                    (asset.asset_id, asset.creator, asset.name, asset.url, time.time()))
+
+    def add_deployment(self, deployment: Deployment):
+        values = tuple(getattr(deployment, f.name) for f in fields(Deployment))
+        self._write(f'INSERT OR REPLACE INTO deployments ({_columns(Deployment)}, created_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', values[:-1] + (int(deployment.fee_pooling), time.time()))
+
+    def asset(self, asset_id: int) -> Optional[Asset]:
+        return self._one(Asset, f'SELECT {_columns(Asset)} FROM assets WHERE asset_id = ?', (asset_id,))
+
+    def assets_of(self, creator: str) -> list:
+        return self._all(Asset, f'SELECT {_columns(Asset)} FROM assets WHERE creator = ? ORDER BY asset_id',
+                         (creator,))
+
+    def deployment(self, app_id: int) -> Optional[Deployment]:
+        return self._one(Deployment, f'SELECT {_columns(Deployment)} FROM deployments WHERE app_id = ?', (app_id,))
+
+    # the latest app deployed for `asset_id`
+    def deployment_for_asset(self, asset_id: int) -> Optional[Deployment]:
+        return self._one(Deployment, f'SELECT {_columns(Deployment)} FROM deployments WHERE asset_id = ? '
+                                     'ORDER BY app_id DESC LIMIT 1', (asset_id,))
+
+    def deployments_of(self, creator: str) -> list:
+        return self._all(Deployment, f'SELECT {_columns(Deployment)} FROM deployments WHERE creator = ? '
+                                     'ORDER BY app_id', (creator,))
+
+    def all_deployments(self) -> list:
+        return self._all(Deployment, f'SELECT {_columns(Deployment)} FROM deployments ORDER BY app_id', ())
+
+    # the most recently minted asset (asset ids only grow), of `creator` if given
+    def latest_asset(self, creator: str = None) -> Optional[Asset]:
+        if creator is None:
+            return self._one(Asset, f'SELECT {_columns(Asset)} FROM assets ORDER BY asset_id DESC LIMIT 1', ())
+        return self._one(Asset, f'SELECT {_columns(Asset)} FROM assets WHERE creator = ? '
+                                'ORDER BY asset_id DESC LIMIT 1', (creator,))
+
+    # records the ASSET_ID/APP_ID/APP_ADDRESS lines of an existing .env, for setups made before the registry
+    def import_env(self, path: str, creator: str):
+        from dotenv import dotenv_values
+        values = dotenv_values(path)
+        if values.get('ASSET_ID'):
+            self.add_asset(Asset(int(values['ASSET_ID']), creator))
+        if values.get('APP_ID') and values.get('APP_ADDRESS') and values.get('ASSET_ID'):
+            self.add_deployment(Deployment(int(values['APP_ID']), values['APP_ADDRESS'], int(values['ASSET_ID']),
+                                           creator))
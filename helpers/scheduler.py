@@ -0,0 +1,150 @@
+import copy
+import heapq
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from algosdk import account
+from algosdk.future import transaction
+
+from helpers.consts import AppArgs, InnerTxns
+from helpers.utils import get_asset_amount, get_global_state, get_local_state, pooled_fee_params, \
+    wait_for_confirmation
+
+# settles paid sales once their waiting time is over, so payments do not stay locked in the app.
+# pending sales sit in a heap ordered by deadline round; the scheduler sleeps on status_after_block and, at each
+# new block, pops every sale whose deadline has passed and settles them as one batch: the transactions are signed
+# against one set of suggested params, submitted concurrently and then awaited together.
+#
+# for each due sale, with the keys the scheduler holds:
+#   - buyer key, seller still holds the nft: execute_transfer as the buyer (the sale completes)
+#   - buyer key, seller no longer holds the nft: refund as the buyer
+#   - seller key only: execute_transfer as the seller naming the buyer, which the contract allows once
+#     round > round_sale_began + waiting_time (the nft still goes to the buyer who paid)
+# sales settled by somebody else in the meantime are dropped
+
+
+@dataclass(order=True)
+class PendingSale:
+    deadline: int  # last round at which the sale cannot be forced yet
+    seller: str = field(compare=False)
+    buyer: str = field(compare=False)
+    attempts: int = field(default=0, compare=False)
+
+
+class DeadlineScheduler:
+    def __init__(self, client, app_id: int, asset_id: int, keys: dict, fee_pooling: bool = False,
+                 max_attempts: int = 3, workers: int = 8):
+        self.client = client
+        self.app_id = app_id
+        self.asset_id = asset_id
+        self.keys = keys  # address -> private key of the accounts the scheduler may sign for
+        self.fee_pooling = fee_pooling
+        self.max_attempts = max_attempts
+        self.waiting_time = get_global_state(client, app_id).get(b'waiting_time', 0)
+        self.heap = []
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='scheduler')
+
+    def __len__(self):
+        return len(self.heap)
+
+    def track(self, seller: str, buyer: str, round_sale_began: int = None):
+        if round_sale_began is None:
+            round_sale_began = (get_local_state(self.client, seller, self.app_id) or {}).get(b'round_sale_began', 0)
+        with self.lock:
+            heapq.heappush(self.heap, PendingSale(round_sale_began + self.waiting_time, seller, buyer))
+
+    # tracks the sale started by a confirmed buy group, given the txn id of its app call
+    def track_buy(self, app_txn_id: str):
+        info = self.client.pending_transaction_info(app_txn_id)
+        self.track(info['txn']['txn']['apat'][0], info['txn']['txn']['snd'], info['confirmed-round'])
+
+    def pop_due(self, last_round: int) -> list:
+        due = []
+        with self.lock:
+            while self.heap and self.heap[0].deadline <= last_round:
+                due.append(heapq.heappop(self.heap))
+        return due
+
+    # decides how to settle `sale`: (signing address, app args) or None when it is settled already or
+    # nobody we hold a key for can settle it
+    def plan(self, sale: PendingSale):
+        seller_state = get_local_state(self.client, sale.seller, self.app_id) or {}
+        buyer_state = get_local_state(self.client, sale.buyer, self.app_id) or {}
+        if seller_state.get(b'approve_transfer') != 1 or buyer_state.get(b'approve_transfer') != 1:
+            return None
+        seller_holds = get_asset_amount(self.client, sale.seller, self.asset_id) == 1
+        if sale.buyer in self.keys:
+            return sale.buyer, AppArgs.execute_transfer if seller_holds else AppArgs.refund
+        if sale.seller in self.keys and seller_holds:
+            return sale.seller, AppArgs.execute_transfer
+        return None
+
+    def _signed_call(self, params, sender: str, app_arg: bytes, seller: str, buyer: str):
+        params = copy.copy(params)
+        if self.fee_pooling:
+            inner_txns = InnerTxns.execute_transfer if app_arg == AppArgs.execute_transfer else InnerTxns.refund
+            pooled_fee_params(params, inner_txns)
+        txn = transaction.ApplicationCallTxn(
+            sender=sender,
+            sp=params,
+            index=self.app_id,
+            on_complete=transaction.OnComplete.NoOpOC,
+            app_args=[app_arg],
+            accounts=[seller] if sender == buyer else [seller, buyer],
+            foreign_assets=[self.asset_id] if app_arg == AppArgs.execute_transfer else None,
+        )
+        return txn.sign(self.keys[sender])
+
+    # settles a batch of due sales, returns {(seller, buyer): txn id}; failed sales are retried at the next block
+    def settle(self, sales: list, last_round: int) -> dict:
+        plans = list(self.executor.map(self.plan, sales))
+        params = self.client.suggested_params()
+        batch = []
+        for sale, planned in zip(sales, plans):
+            if planned is None:
+                print(f'sale {sale.seller} -> {sale.buyer} already settled or not ours to settle, dropping it')
+                continue
+            sender, app_arg = planned
+            batch.append((sale, self._signed_call(params, sender, app_arg, sale.seller, sale.buyer)))
+
+        def submit(signed_txn):
+            self.client.send_transaction(signed_txn)
+            return wait_for_confirmation(self.client, signed_txn.transaction.get_txid())
+
+        futures = [(sale, signed, self.executor.submit(submit, signed)) for sale, signed in batch]
+        settled = {}
+        for sale, signed, future in futures:
+            try:
+                future.result()
+                settled[(sale.seller, sale.buyer)] = signed.transaction.get_txid()
+            except Exception as err:
+                sale.attempts += 1
+                print(f'settling sale {sale.seller} -> {sale.buyer} failed ({sale.attempts}): {err}')
+                if sale.attempts < self.max_attempts:
+                    sale.deadline = last_round + 1
+                    with self.lock:
+                        heapq.heappush(self.heap, sale)
+        return settled
+
+    # wakes at every new block and settles the sales that became due, until `stop` is set or, with
+    # `until_empty`, no sale is pending anymore
+    def run(self, stop: threading.Event = None, until_empty: bool = False) -> dict:
+        stop = stop or threading.Event()
+        settled = {}
+        last_round = self.client.status()['last-round']
+        while not stop.is_set() and not (until_empty and not self.heap):
+            due = self.pop_due(last_round)
+            if due:
+                print(f'round {last_round}: settling {len(due)} sale(s)')
+                settled.update(self.settle(due, last_round))
+            last_round = self.client.status_after_block(last_round)['last-round']
+        return settled
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+def addresses_to_keys(private_keys: list) -> dict:
+    return {account.address_from_private_key(key): key for key in private_keys}
@@ -0,0 +1,217 @@
+import base64
+import copy
+import threading
+from functools import lru_cache
+
+import msgpack
+from algosdk import constants, encoding
+from algosdk.future import transaction
+from algosdk.logic import get_application_address
+from nacl.signing import SigningKey
+
+from helpers.consts import AppArgs
+from helpers.utils import int_to_bytes, pooled_fee_params
+
+# pre-encoded transactions for bulk listing and buying. a template is the canonical msgpack encoding of a
+# transaction (sorted keys, zero values omitted) cut into static byte segments around the fields that change
+# between calls (sender, app args, validity rounds, amount, group). encoding a transaction is then joining the
+# static segments with the few packed variable values, and the txid, group id and signature are computed straight
+# from those bytes, without building and re-serializing transaction objects.
+#
+# variable fields are keyed by their msgpack names: snd, fv, lv, amt, apaa, apat, grp. they must be non-zero in
+# every call (a zero value would be omitted from the canonical encoding and change the layout).
+# helpers/operations.py (setup_sale, buy_asset, buy_now, and so the daemon) and helpers/bulk_listing.py sign through
+# cached templates
+
+
+def _pack(value) -> bytes:
+    return msgpack.packb(value, use_bin_type=True)
+
+
+# sorted keys, zero values dropped (same rules as algosdk.encoding.msgpack_encode)
+def _canonical(fields: dict) -> dict:
+    return {k: _canonical(v) if isinstance(v, dict) else v for k, v in sorted(fields.items())
+            if isinstance(v, dict) or v}
+
+
+class TxnTemplate:
+    def __init__(self, txn: transaction.Transaction, variable: tuple):
+        fields = _canonical(txn.dictify())
+        keys = sorted(set(fields) | ({'grp'} & set(variable)))
+        self.variable = tuple(k for k in keys if k in variable)
+        self.segments = []
+        static = bytearray(_map_header(len(keys)))
+        for key in keys:
+            static += _pack(key)
+            if key in variable:
+                self.segments.append(bytes(static))
+                static = bytearray()
+            else:
+                static += _pack(fields[key])
+        self.segments.append(bytes(static))
+
+    # canonical msgpack of the transaction with `values` ({msgpack name: value}) in the variable fields
+    def encode(self, values: dict) -> bytes:
+        parts = [self.segments[0]]
+        for key, segment in zip(self.variable, self.segments[1:]):
+            if not values[key]:
+                raise ValueError(f'template field {key} must be non-zero')
+            parts.append(_pack(values[key]))
+            parts.append(segment)
+        return b''.join(parts)
+
+
+def _map_header(n: int) -> bytes:
+    if n < 16:
+        return bytes([0x80 | n])
+    return b'\xde' + n.to_bytes(2, 'big')
+
+
+def txid(encoded_txn: bytes) -> bytes:
+    return encoding.checksum(constants.txid_prefix + encoded_txn)
+
+
+def group_id(raw_txids: list) -> bytes:
+    return encoding.checksum(constants.tgid_prefix + _pack({'txlist': raw_txids}))
+
+
+# canonical msgpack of a signed transaction: {"sig": ..., "txn": ...}
+def signed_bytes(signing_key: SigningKey, encoded_txn: bytes) -> bytes:
+    signature = signing_key.sign(constants.txid_prefix + encoded_txn).signature
+    return b'\x82\xa3sig\xc4\x40' + signature + b'\xa3txn' + encoded_txn
+
+
+# deriving the signing key from the seed costs as much as a signature, keep them around for bulk signing
+@lru_cache(maxsize=64)
+def _keys(private_key: str):
+    key = base64.b64decode(private_key)
+    return SigningKey(key[:constants.key_len_bytes]), key[constants.key_len_bytes:]
+
+
+class GroupTemplate:
+    # `txns` are example transactions giving the static fields. every template has a grouped variant with the group
+    # id patched in on every sign, so several templates can be signed together as one group (see sign_group)
+    def __init__(self, txns: list, variable: tuple):
+        self.templates = [TxnTemplate(txn, tuple(variable) + ('grp',)) for txn in txns]
+        self.ungrouped = [TxnTemplate(txn, tuple(variable)) for txn in txns]
+
+    # signs the transactions of the template with `private_key` and returns (signed transaction bytes of the group,
+    # txids); `values` holds the variable fields of each transaction
+    def sign(self, private_key: str, values: list):
+        signed, txids = sign_group(private_key, [(self, values)])
+        return b''.join(signed), txids
+
+
+# signs the transactions of `parts`, (GroupTemplate, values) pairs, as one group with `private_key` (every
+# transaction sent by the same account; snd is filled in from the key). a single transaction is left ungrouped.
+# returns (signed bytes of each transaction, txids)
+def sign_group(private_key: str, parts: list):
+    signing_key, sender = _keys(private_key)
+    pairs = [(template, dict(v, snd=sender)) for group, values in parts
+             for template, v in zip(group.ungrouped, values)]
+    encoded = [template.encode(v) for template, v in pairs]
+    raw_txids = [txid(e) for e in encoded]
+    if len(pairs) > 1:
+        gid = group_id(raw_txids)
+        grouped = [template for group, _ in parts for template in group.templates]
+        encoded = [template.encode(dict(v, grp=gid)) for template, (_, v) in zip(grouped, pairs)]
+        raw_txids = [txid(e) for e in encoded]
+    txids = [base64.b32encode(t).decode().strip('=') for t in raw_txids]
+    return [signed_bytes(signing_key, e) for e in encoded], txids
+
+
+def send_signed(client, signed_txns: list) -> str:
+    return client.send_raw_transaction(base64.b64encode(b''.join(signed_txns)).decode())
+
+
+# SignedTransaction objects of signed transaction bytes, for the preflight checks
+def decode_signed(signed_txns: list) -> list:
+    return [encoding.future_msgpack_decode(base64.b64encode(s).decode()) for s in signed_txns]
+
+
+# templates only depend on the suggested params (fees, genesis) and the app and asset, so they are built once per
+# (builder, params, args) and reused across calls
+_TEMPLATE_CACHE_SIZE = 1024
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def cached_template(builder, params, *args) -> GroupTemplate:
+    key = (builder, params.fee, params.flat_fee, params.min_fee, params.gh, params.gen) + args
+    with _templates_lock:
+        template = _templates.get(key)
+    if template is None:
+        template = builder(params, *args)
+        with _templates_lock:
+            if len(_templates) >= _TEMPLATE_CACHE_SIZE:
+                _templates.clear()
+            _templates[key] = template
+    return template
+
+
+_PLACEHOLDER_ADDRESS = encoding.encode_address(b'\x01' * 32)
+
+
+# setup_sale calls for one app: variable sender, price argument and validity rounds
+def setup_sale_template(params, app_id: int, asset_id: int) -> GroupTemplate:
+    txn = transaction.ApplicationCallTxn(
+        sender=_PLACEHOLDER_ADDRESS,
+        sp=params,
+        index=app_id,
+        on_complete=transaction.OnComplete.NoOpOC,
+        app_args=[AppArgs.setup_sale, int_to_bytes(1)],
+        foreign_assets=[asset_id],
+    )
+    return GroupTemplate([txn], ('snd', 'apaa', 'fv', 'lv'))
+
+
+def setup_sale_values(price: int, first_valid: int, last_valid: int) -> list:
+    return [{'apaa': [AppArgs.setup_sale, int_to_bytes(price)], 'fv': first_valid, 'lv': last_valid}]
+
+
+# buy groups (app call + payment to the app) for one app: variable buyer, app args, seller account, price and
+# validity rounds
+def buy_template(params, app_id: int, asset_id: int) -> GroupTemplate:
+    app_call_txn = transaction.ApplicationCallTxn(
+        sender=_PLACEHOLDER_ADDRESS,
+        sp=params,
+        index=app_id,
+        on_complete=transaction.OnComplete.NoOpOC,
+        app_args=[AppArgs.buy, int_to_bytes(asset_id)],
+        accounts=[_PLACEHOLDER_ADDRESS],
+        foreign_assets=[asset_id],
+    )
+    pay_txn = transaction.PaymentTxn(sender=_PLACEHOLDER_ADDRESS, receiver=get_application_address(app_id), amt=1,
+                                     sp=params)
+    return GroupTemplate([app_call_txn, pay_txn], ('snd', 'apaa', 'apat', 'amt', 'fv', 'lv'))
+
+
+def buy_values(app_args: list, seller: str, price: int, first_valid: int, last_valid: int) -> list:
+    return [
+        {'apaa': app_args, 'apat': [encoding.decode_address(seller)], 'fv': first_valid, 'lv': last_valid},
+        {'amt': price, 'fv': first_valid, 'lv': last_valid},
+    ]
+
+
+# buy_now groups (payment to the app + app call) for one app: variable buyer, price, seller account and validity
+# rounds. with `inner_txns` the app call fee is pooled for that many inner transactions
+def buy_now_template(params, app_id: int, asset_id: int, inner_txns: int = 0) -> GroupTemplate:
+    pay_txn = transaction.PaymentTxn(sender=_PLACEHOLDER_ADDRESS, receiver=get_application_address(app_id), amt=1,
+                                     sp=params)
+    app_call_txn = transaction.ApplicationCallTxn(
+        sender=_PLACEHOLDER_ADDRESS,
+        sp=pooled_fee_params(copy.copy(params), inner_txns) if inner_txns else params,
+        index=app_id,
+        on_complete=transaction.OnComplete.NoOpOC,
+        app_args=[AppArgs.buy_now, int_to_bytes(asset_id)],
+        accounts=[_PLACEHOLDER_ADDRESS],
+        foreign_assets=[asset_id],
+    )
+    return GroupTemplate([pay_txn, app_call_txn], ('snd', 'amt', 'apat', 'fv', 'lv'))
+
+
+def buy_now_values(seller: str, price: int, first_valid: int, last_valid: int) -> list:
+    return [
+        {'amt': price, 'fv': first_valid, 'lv': last_valid},
+        {'apat': [encoding.decode_address(seller)], 'fv': first_valid, 'lv': last_valid},
+    ]
@@ -1,16 +1,42 @@
 import base64
 import json
 
-from algosdk import encoding, mnemonic, account, v2client
+from algosdk import encoding, mnemonic, account
 from algosdk.v2client.algod import AlgodClient
 
+from helpers.consts import Network, RoyaltySplit
 
+
+# every client goes through the per-node rate limiter of helpers/limiter.py, shared by all the clients of the process
+# with ALGOD_CASSETTE set, the traffic is recorded to or replayed from a cassette (helpers/cassette.py)
 def get_algod_client():
-    token = ''
+    from functools import partial
+    from helpers.limiter import LimitedAlgodClient
+
+    if Network.cassette and Network.cassette_mode == 'replay':
+        from helpers.cassette import replay_client
+        return replay_client(Network.cassette, Network.time_warp)
+
+    token = Network.algod_token
     # endpoint = 'https://node.algoexplorerapi.io'
-    endpoint = 'https://node.testnet.algoexplorerapi.io'
+    endpoint = Network.algod_endpoint
     headers = ''
-    return v2client.algod.AlgodClient(token, endpoint, headers)
+    if len(Network.algod_endpoints) > 1:
+        from helpers.client_pool import AlgodClientPool
+        # no retries on a node: the pool fails over to another one instead
+        client = AlgodClientPool(token, Network.algod_endpoints, headers,
+                                 client_class=partial(LimitedAlgodClient, retries=0))
+    else:
+        client = LimitedAlgodClient(token, endpoint, headers)
+    if Network.cassette and Network.cassette_mode == 'record':
+        from helpers.cassette import cassette_for, record
+        return record(client, cassette_for(Network.cassette))
+    return client
+
+
+def get_indexer_client():
+    from algosdk.v2client.indexer import IndexerClient
+    return IndexerClient(Network.indexer_token, Network.indexer_endpoint, '')
 
 
 # wait until the transaction is confirmed before proceeding
@@ -25,6 +51,13 @@ def wait_for_confirmation(algod_client: AlgodClient, txn_id: str):
     return txn_info
 
 
+# switches `params` to a flat fee that also pays for `inner_txns` inner transactions (fee pooling)
+def pooled_fee_params(params, inner_txns: int):
+    params.flat_fee = True
+    params.fee = (1 + inner_txns) * params.min_fee
+    return params
+
+
 # prints created asset for account and asset_id
 def print_created_asset(algod_client: AlgodClient, account: str, asset_id: int):
     account_info = algod_client.account_info(account)
@@ -54,10 +87,59 @@ def print_asset_holding(algod_client: AlgodClient, account: str, asset_id: int):
             break
 
 
+# returns the amount of `asset_id` held by `account`, or None if the account has not opted in
+def get_asset_amount(algod_client: AlgodClient, account: str, asset_id: int):
+    for holding in algod_client.account_info(account).get('assets', []):
+        if holding['asset-id'] == asset_id:
+            return holding['amount']
+    return None
+
+
+# decodes a teal key-value store as returned by algod into {key: uint or bytes}
+def decode_state(key_values):
+    state = {}
+    for kv in key_values or []:
+        value = kv['value']
+        state[base64.b64decode(kv['key'])] = value['uint'] if value['type'] == 2 else base64.b64decode(value['bytes'])
+    return state
+
+
+# returns the local state of `account` in `app_id`, or None if the account has not opted in
+def get_local_state(algod_client: AlgodClient, account: str, app_id: int):
+    for local in algod_client.account_info(account).get('apps-local-state', []):
+        if local['id'] == app_id:
+            return decode_state(local.get('key-value'))
+    return None
+
+
+# returns the global state of `app_id`
+def get_global_state(algod_client: AlgodClient, app_id: int):
+    return decode_state(algod_client.application_info(app_id)['params'].get('global-state'))
+
+
+# royalty split of a sale app as [(address, basis points)], empty when the creator receives all the fees
+def get_royalty_split(algod_client: AlgodClient, app_id: int):
+    state = get_global_state(algod_client, app_id)
+    return [(encoding.encode_address(state[f'payee_{i}'.encode()]), state[f'share_{i}'.encode()])
+            for i in range(state.get(b'split_count', 0))]
+
+
+# the foreign accounts of each claim_fees call of a claim: the payees from the claim cursor on,
+# `RoyaltySplit.payees_per_call` per call, or one call without accounts when the creator receives all the fees
+def claim_pages(payees: list, cursor: int = 0) -> list:
+    remaining, per_call = payees[cursor:], RoyaltySplit.payees_per_call
+    pages = [remaining[i:i + per_call] for i in range(0, len(remaining), per_call)]
+    return pages or [[]]
+
+
 # creates asa metadata
-def metadata_template(description, standard, external_url, attributes):
+def metadata_template(description, standard, external_url, attributes, media_url=None, mime_type=None):
     metadata = {'description': description, 'standard': standard, 'external_url': external_url,
                 'attributes': attributes}
+    if media_url:
+        metadata['media_url'] = media_url
+    if mime_type:
+        metadata['mime_type'] = mime_type
     metadata_note = json.dumps(metadata).encode()
     return metadata_note
 
@@ -0,0 +1,104 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+# runs a workflow expressed as a graph of steps, recording every outcome in an append-only journal so that a
+# rerun skips what already happened: a step is skipped when the journal has it as done, or when its on-chain
+# check says its effect is already there (e.g. the transaction confirmed but the process died before journaling)
+# steps whose dependencies are satisfied run concurrently
+
+
+@dataclass
+class Step:
+    name: str
+    run: Callable[[], Any]  # performs the step and returns its result (usually the txn id), must be json-serializable
+    depends_on: tuple = ()
+    is_done: Optional[Callable[[], bool]] = None  # on-chain check, True when the step's effect is already there
+
+
+class Journal:
+    # one json object per line: {"step": ..., "status": "done" | "skipped" | "failed", "result": ..., "time": ...}
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def entries(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def completed(self) -> dict:
+        return {e['step']: e.get('result') for e in self.entries() if e['status'] in ('done', 'skipped')}
+
+    def append(self, step: str, status: str, result=None):
+        entry = json.dumps({'step': step, 'status': status, 'result': result, 'time': time.time()})
+        with self.lock, open(self.path, 'a') as f:
+            f.write(entry + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class WorkflowError(Exception):
+    def __init__(self, step: str, cause: Exception):
+        super().__init__(f'step {step} failed: {cause}')
+        self.step = step
+        self.cause = cause
+
+
+def _check_graph(steps: list):
+    names = {s.name for s in steps}
+    if len(names) != len(steps):
+        raise ValueError('step names must be unique')
+    for s in steps:
+        missing = set(s.depends_on) - names
+        if missing:
+            raise ValueError(f'step {s.name} depends on unknown steps: {sorted(missing)}')
+
+
+# runs `steps` against `journal`, returns {step name: result} for every step
+def run_workflow(steps: list, journal: Journal, max_workers: int = 4) -> dict:
+    _check_graph(steps)
+    journaled = journal.completed()
+    results = {s.name: journaled[s.name] for s in steps if s.name in journaled}
+    pending = {s.name: s for s in steps if s.name not in results}
+    for name, result in results.items():
+        print(f'[journal] {name} already done: {result}')
+
+    def execute(step: Step):
+        if step.is_done is not None and step.is_done():
+            journal.append(step.name, 'skipped', 'already on chain')
+            print(f'[chain] {step.name} already done on chain, skipping')
+            return 'already on chain'
+        result = step.run()
+        journal.append(step.name, 'done', result)
+        return result
+
+    running = {}
+    failure = None
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            if failure is None:
+                for name, step in list(pending.items()):
+                    if all(d in results for d in step.depends_on):
+                        running[executor.submit(execute, step)] = name
+                        del pending[name]
+            if not running:
+                if failure is None and pending:
+                    raise ValueError(f'dependency cycle between steps: {sorted(pending)}')
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as err:
+                    journal.append(name, 'failed', str(err))
+                    failure = failure or WorkflowError(name, err)
+    if failure is not None:
+        raise failure
+    return results
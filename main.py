@@ -1,16 +1,398 @@
-# This is a sample Python script.
+import argparse
+import contextlib
+import json
+import os
+import sys
 
-# Press ⌃R to execute it or replace it with your code.
-# Press Double ⇧ to search everywhere for classes, files, tool windows, actions, and settings.
+from helpers.consts import AppArgs, DefaultValues, InnerTxns, Network
 
+# command line entry point for the sale workflow:
+#   python main.py compile | deploy | mint | fund | list | bulk-list | buy | execute | buy-now | claim | settle |
+#                  escrow | holders | registry | serve | cassette | status
+# heavy modules (pyteal, algosdk, dotenv) are imported inside the commands that need them, so read-only
+# commands such as `status` start without paying for them; `status` talks to algod over plain http.client.
+# every command prints its result as json on stdout, progress goes to stderr
 
-def print_hi(name):
-    # Use a breakpoint in the code line below to debug your script.
-    print(f'Hi, {name}')  # Press ⌘F8 to toggle the breakpoint.
 
+def load_env():
+    from dotenv import load_dotenv
+    load_dotenv()
 
-# Press the green button in the gutter to run the script.
-if __name__ == '__main__':
-    print_hi('PyCharm')
 
-# See PyCharm help at https://www.jetbrains.com/help/pycharm/
+def get_client():
+    from helpers.utils import get_algod_client
+    return get_algod_client()
+
+
+def private_key(env_name: str):
+    from helpers.utils import get_private_key_from_mnemonic
+    mn = os.getenv(env_name)
+    if not mn:
+        sys.exit(f'{env_name} is not set')
+    return get_private_key_from_mnemonic(mn)
+
+
+# --app-id when given, otherwise the latest app deployed for --asset-id in the registry
+def resolve_app_id(args) -> int:
+    if args.app_id:
+        return args.app_id
+    if not args.asset_id:
+        sys.exit('pass --app-id or --asset-id')
+    from helpers.registry import Registry
+    deployment = Registry().deployment_for_asset(args.asset_id)
+    if deployment is None:
+        sys.exit(f'no app deployed for asset {args.asset_id} in the registry, pass --app-id')
+    return deployment.app_id
+
+
+def algod_get(endpoint: str, path: str):
+    from http.client import HTTPConnection, HTTPSConnection
+    from urllib.parse import urlsplit
+
+    url = urlsplit(endpoint)
+    connection = (HTTPSConnection if url.scheme == 'https' else HTTPConnection)(url.netloc, timeout=10)
+    headers = {'X-Algo-API-Token': Network.algod_token} if Network.algod_token else {}
+    connection.request('GET', url.path.rstrip('/') + path, headers=headers)
+    response = connection.getresponse()
+    body = json.loads(response.read() or b'{}')
+    if response.status != 200:
+        sys.exit(f'algod error {response.status}: {body.get("message", body)}')
+    return body
+
+
+def cmd_compile(args):
+    from asc.create_app import compile_teal
+    approval_teal, clear_teal = compile_teal(args.fee_pooling)
+    return {'approval_lines': len(approval_teal.splitlines()), 'clear_lines': len(clear_teal.splitlines())}
+
+
+def cmd_deploy(args):
+    load_env()
+    from algosdk import mnemonic
+    from asc.create_app import deploy
+    split = [(payee, int(share)) for payee, share in (entry.split(':') for entry in args.split)]
+    creator_mnemonic = mnemonic.from_private_key(private_key(args.key))
+    app_id, app_address = deploy(get_client(), creator_mnemonic, args.asset_id, args.royalty_fee,
+                                 args.waiting_time, args.fee_pooling, split)
+    return {'app_id': app_id, 'app_address': app_address}
+
+
+def cmd_mint(args):
+    load_env()
+    from services.mint_nft import create_asa
+    asset_id = create_asa(private_key(args.key))
+    return {'asset_id': asset_id}
+
+
+def cmd_fund(args):
+    load_env()
+    from algosdk.logic import get_application_address
+    from helpers.min_balance import MinBalancePlanner, fund, plan_sale_app
+    from helpers.utils import get_royalty_split
+    client = get_client()
+    app_id = resolve_app_id(args)
+    planner = MinBalancePlanner()
+    plan_sale_app(planner, get_application_address(app_id), args.fee_pooling, args.claims,
+                  len(get_royalty_split(client, app_id)))
+    for buyer in args.buyer:
+        planner.opt_in_asset(buyer, args.asset_id)
+        planner.opt_in_app(buyer, app_id)
+        planner.pay_fees(buyer, 5 + (InnerTxns.execute_transfer if args.fee_pooling else 0))
+        planner.spend(buyer, args.price)
+    shortfalls = planner.shortfalls(client)
+    txn_ids = [] if args.dry_run else fund(client, private_key(args.key), shortfalls)
+    return {'shortfalls': shortfalls, 'txn_ids': txn_ids}
+
+
+def cmd_list(args):
+    load_env()
+    from helpers.operations import setup_sale
+    from helpers.utils import int_to_bytes
+    txn_id = setup_sale(get_client(), private_key(args.key), resolve_app_id(args),
+                        [AppArgs.setup_sale, int_to_bytes(args.price)], [args.asset_id], preflight=args.preflight)
+    return {'txn_id': txn_id}
+
+
+def cmd_bulk_list(args):
+    load_env()
+    from collections import Counter
+    from helpers.bulk_listing import BulkLister, read_listings
+    from helpers.scheduler import addresses_to_keys
+    lister = BulkLister(get_client(), addresses_to_keys([private_key(name) for name in args.key]),
+                        workers=args.workers)
+    counts = Counter()
+    with open(args.out, 'w') if args.out else open(os.devnull, 'w') as out:
+        for result in lister.run(read_listings(args.file)):
+            counts[result.status] += 1
+            out.write(json.dumps({'seller': result.listing.seller, 'asset_id': result.listing.asset_id,
+                                  'price': result.listing.price, 'app_id': result.listing.app_id,
+                                  'status': result.status, 'detail': result.detail}) + '\n')
+    return counts
+
+
+def cmd_buy(args):
+    load_env()
+    from helpers.operations import buy_asset
+    from helpers.utils import int_to_bytes
+    app_txn_id, pay_txn_id = buy_asset(get_client(), private_key(args.key), args.seller, resolve_app_id(args),
+                                       [AppArgs.buy, int_to_bytes(args.asset_id)], [args.asset_id], args.price,
+                                       preflight=args.preflight)
+    return {'app_txn_id': app_txn_id, 'pay_txn_id': pay_txn_id}
+
+
+def cmd_execute(args):
+    load_env()
+    from helpers.operations import buyer_execute_transfer
+    txn_id = buyer_execute_transfer(get_client(), private_key(args.key), args.seller, resolve_app_id(args),
+                                    [AppArgs.execute_transfer], [args.asset_id], args.fee_pooling,
+                                    preflight=args.preflight)
+    return {'txn_id': txn_id}
+
+
+def cmd_buy_now(args):
+    load_env()
+    from helpers.operations import buy_now
+    app_txn_id, pay_txn_id = buy_now(get_client(), private_key(args.key), args.seller, resolve_app_id(args),
+                                     args.asset_id, args.price, args.fee_pooling, preflight=args.preflight)
+    return {'app_txn_id': app_txn_id, 'pay_txn_id': pay_txn_id}
+
+
+def cmd_claim(args):
+    load_env()
+    from helpers.operations import creator_claim_fees
+    from helpers.utils import get_royalty_split
+    client = get_client()
+    app_id = resolve_app_id(args)
+    payees = [payee for payee, _ in get_royalty_split(client, app_id)]
+    txn_id = creator_claim_fees(client, private_key(args.key), app_id, [AppArgs.claim_fees], args.fee_pooling, payees)
+    return {'txn_id': txn_id}
+
+
+def cmd_settle(args):
+    load_env()
+    from helpers.scheduler import DeadlineScheduler, addresses_to_keys
+    keys = addresses_to_keys([private_key(name) for name in args.key])
+    scheduler = DeadlineScheduler(get_client(), resolve_app_id(args), args.asset_id, keys, args.fee_pooling)
+    for txn_id in args.buy_txn:
+        scheduler.track_buy(txn_id)
+    settled = scheduler.run(until_empty=True)
+    scheduler.close()
+    return {f'{seller}:{buyer}': txn_id for (seller, buyer), txn_id in settled.items()}
+
+
+def cmd_escrow(args):
+    load_env()
+    from helpers.escrow_template import listing_signature
+    signature = listing_signature(args.seller, args.asset_id, args.price)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(signature.teal)
+    return {'address': signature.address, 'program': signature.bytecode_b64}
+
+
+def cmd_holders(args):
+    load_env()
+    from helpers.holder_index import HolderIndex
+    from helpers.utils import get_indexer_client
+    source = get_indexer_client()
+    if os.path.exists(args.index):
+        index = HolderIndex.load(args.index)
+        touched = index.update(source)
+        print(f'updated {len(touched)} asset(s) up to round {index.round}')
+    else:
+        asset_ids = list(args.asset_id)
+        if args.assets_file:
+            with open(args.assets_file) as f:
+                asset_ids += [int(line) for line in f if line.strip()]
+        index = HolderIndex.build(source, asset_ids)
+        print(f'indexed {len(index)} asset(s) at round {index.round}')
+    index.save(args.index)
+    return {'asset_id': args.lookup, 'holder': index.holder(args.lookup)} if args.lookup else None
+
+
+def cmd_registry(args):
+    from dataclasses import asdict
+    from helpers.registry import Registry
+    registry = Registry()
+    if args.import_env:
+        load_env()
+        from helpers.utils import get_public_key_from_mnemonic
+        registry.import_env(args.import_env, get_public_key_from_mnemonic(os.getenv('CREATOR_MNEMONIC')))
+    if args.app_id:
+        deployments = [registry.deployment(args.app_id)]
+    elif args.asset_id:
+        deployments = [registry.deployment_for_asset(args.asset_id)]
+    else:
+        deployments = registry.deployments_of(args.creator) if args.creator else []
+    result = {'deployments': [asdict(d) for d in deployments if d]}
+    if args.creator:
+        result['assets'] = [asdict(a) for a in registry.assets_of(args.creator)]
+    return result
+
+
+def cmd_serve(args):
+    load_env()
+    if not os.getenv('DAEMON_TOKEN'):
+        sys.exit('DAEMON_TOKEN is not set: the daemon only serves clients sending it in X-Daemon-Token')
+    from services.daemon import Daemon, serve
+    daemon = Daemon(workers=args.workers)
+    daemon.warm()
+    serve(daemon, args.host, args.port, args.socket)
+
+
+def cmd_cassette(args):
+    from helpers.cassette import describe
+    return describe(args.file)
+
+
+def cmd_status(args):
+    load_env()
+    endpoint = args.endpoint or Network.algod_endpoint
+    status = algod_get(endpoint, '/v2/status')
+    result = {'last_round': status['last-round'], 'catchup_time': status.get('catchup-time')}
+    if args.app_id:
+        app = algod_get(endpoint, f'/v2/applications/{args.app_id}')
+        result['global_state'] = {
+            _decode_key(kv['key']): kv['value']['uint'] if kv['value']['type'] == 2 else kv['value']['bytes']
+            for kv in app['params'].get('global-state', [])
+        }
+    if args.account:
+        acct = algod_get(endpoint, f'/v2/accounts/{args.account}')
+        result['account'] = {'amount': acct['amount'], 'min_balance': acct.get('min-balance'),
+                             'assets': len(acct.get('assets', []))}
+    return result
+
+
+def _decode_key(key: str):
+    from base64 import b64decode
+    return b64decode(key).decode(errors='replace')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='epoch_cryosphere_nft', description='nft sale contract tooling')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def command(name, handler, help_text, key=None):
+        sub = commands.add_parser(name, help=help_text)
+        sub.set_defaults(handler=handler, indent=None)
+        if key:
+            sub.add_argument('--key', default=key, help=f'environment variable holding the mnemonic (default {key})')
+        return sub
+
+    sub = command('compile', cmd_compile, 'compile the approval and clear programs to teal/')
+    sub.add_argument('--fee-pooling', action='store_true')
+
+    sub = command('deploy', cmd_deploy, 'create the sale application', key='CREATOR_MNEMONIC')
+    sub.add_argument('--asset-id', type=int, required=True)
+    sub.add_argument('--royalty-fee', type=int, default=DefaultValues.royalty_fee, help='in thousands')
+    sub.add_argument('--waiting-time', type=int, default=DefaultValues.waiting_time, help='in rounds')
+    sub.add_argument('--fee-pooling', action='store_true')
+    sub.add_argument('--split', action='append', default=[], metavar='ADDRESS:BPS',
+                     help='royalty split payee and share in basis points, repeat for each payee (up to 8)')
+
+    command('mint', cmd_mint, 'mint the nft', key='CREATOR_MNEMONIC')
+
+    sub = command('fund', cmd_fund, 'fund the app and buyers with what they need, in one group', key='CREATOR_MNEMONIC')
+    sub.add_argument('--app-id', type=int, help='default: the latest app deployed for --asset-id')
+    sub.add_argument('--asset-id', type=int, required=True)
+    sub.add_argument('--buyer', action='append', default=[], help='address of a buyer to fund, repeatable')
+    sub.add_argument('--price', type=int, default=DefaultValues.nft_price, help='in microAlgos')
+    sub.add_argument('--claims', type=int, default=1, help='claim_fees calls the app pays the inner fees of')
+    sub.add_argument('--fee-pooling', action='store_true')
+    sub.add_argument('--dry-run', action='store_true', help='only print the shortfalls')
+
+    sub = command('list', cmd_list, 'put the nft on sale (setup_sale)', key='CREATOR_MNEMONIC')
+    sub.add_argument('--app-id', type=int, help='default: the latest app deployed for --asset-id')
+    sub.add_argument('--asset-id', type=int, required=True)
+    sub.add_argument('--price', type=int, default=DefaultValues.nft_price, help='in microAlgos')
+    sub.add_argument('--preflight', action='store_true', help='evaluate the call on the node before sending it')
+
+    sub = command('bulk-list', cmd_bulk_list, 'put every row of a price file on sale, in groups')
+    sub.add_argument('--file', required=True, help='.csv (seller,asset_id,price[,app_id]) or .jsonl price file')
+    sub.add_argument('--key', action='append', required=True,
+                     help='environment variable holding a seller mnemonic, repeatable')
+    sub.add_argument('--workers', type=int, default=8, help='groups sent and confirmed in parallel')
+    sub.add_argument('--out', help='write the result of every row to this jsonl file')
+
+    sub = command('buy', cmd_buy, 'pay for a listed nft', key='BUYER_1_MNEMONIC')
+    sub.add_argument('--app-id', type=int, help='default: the latest app deployed for --asset-id')
+    sub.add_argument('--asset-id', type=int, required=True)
+    sub.add_argument('--seller', required=True)
+    sub.add_argument('--price', type=int, default=DefaultValues.nft_price, help='in microAlgos')
+    sub.add_argument('--preflight', action='store_true', help='evaluate the call on the node before sending it')
+
+    sub = command('execute', cmd_execute, 'transfer a paid nft (execute_transfer)', key='BUYER_1_MNEMONIC')
+    sub.add_argument('--app-id', type=int, help='default: the latest app deployed for --asset-id')
+    sub.add_argument('--asset-id', type=int, required=True)
+    sub.add_argument('--seller', required=True)
+    sub.add_argument('--fee-pooling', action='store_true')
+    sub.add_argument('--preflight', action='store_true', help='evaluate the call on the node before sending it')
+
+    sub = command('buy-now', cmd_buy_now, 'pay for a listed nft and receive it in one group', key='BUYER_1_MNEMONIC')
+    sub.add_argument('--app-id', type=int, help='default: the latest app deployed for --asset-id')
+    sub.add_argument('--asset-id', type=int, required=True)
+    sub.add_argument('--seller', required=True)
+    sub.add_argument('--price', type=int, default=DefaultValues.nft_price, help='in microAlgos')
+    sub.add_argument('--fee-pooling', action='store_true')
+    sub.add_argument('--preflight', action='store_true', help='evaluate the group on the node before sending it')
+
+    sub = command('claim', cmd_claim, 'claim the collected royalty fees', key='CREATOR_MNEMONIC')
+    sub.add_argument('--app-id', type=int, help='default: the latest app deployed for --asset-id')
+    sub.add_argument('--asset-id', type=int)
+    sub.add_argument('--fee-pooling', action='store_true')
+
+    sub = command('settle', cmd_settle, 'execute or refund paid sales once their waiting time is over')
+    sub.add_argument('--app-id', type=int, help='default: the latest app deployed for --asset-id')
+    sub.add_argument('--asset-id', type=int, required=True)
+    sub.add_argument('--buy-txn', action='append', required=True, help='app call txn id of a buy, repeatable')
+    sub.add_argument('--key', action='append', required=True,
+                     help='environment variable holding a buyer or seller mnemonic, repeatable')
+    sub.add_argument('--fee-pooling', action='store_true')
+
+    sub = command('escrow', cmd_escrow, 'print the address and program of a listing escrow (asset_sale_contract)')
+    sub.add_argument('--seller', required=True)
+    sub.add_argument('--asset-id', type=int, required=True)
+    sub.add_argument('--price', type=int, default=DefaultValues.nft_price, help='in microAlgos')
+    sub.add_argument('--out', help='also write the teal of the escrow to this file')
+
+    sub = command('holders', cmd_holders, 'build or update the holder index of a collection')
+    sub.add_argument('--index', default='../holders.idx', help='index file, updated when it exists')
+    sub.add_argument('--asset-id', type=int, action='append', default=[], help='asset of the collection, repeatable')
+    sub.add_argument('--assets-file', help='file with one asset id per line')
+    sub.add_argument('--lookup', type=int, help='print the holder of this asset')
+
+    sub = command('registry', cmd_registry, 'look up minted assets and deployed apps in the registry')
+    sub.add_argument('--app-id', type=int)
+    sub.add_argument('--asset-id', type=int, help='the latest app deployed for this asset')
+    sub.add_argument('--creator', help='every asset and app of this creator')
+    sub.add_argument('--import-env', metavar='PATH', help='record the ASSET_ID/APP_ID/APP_ADDRESS of a .env first')
+    sub.set_defaults(indent=2)
+
+    sub = command('serve', cmd_serve, 'run the sale operations as a local http service with warm clients and keys')
+    sub.add_argument('--host', default='127.0.0.1')
+    sub.add_argument('--port', type=int, default=8710)
+    sub.add_argument('--socket', help='serve on this unix socket instead of host:port')
+    sub.add_argument('--workers', type=int, default=16, help='operations of a batch run concurrently')
+
+    sub = command('cassette', cmd_cassette, 'summarize the algod traffic recorded in a cassette')
+    sub.add_argument('file')
+    sub.set_defaults(indent=2)
+
+    sub = command('status', cmd_status, 'print node, app and account status as json')
+    sub.add_argument('--endpoint', help='algod endpoint (default ALGOD_ENDPOINT)')
+    sub.add_argument('--app-id', type=int)
+    sub.add_argument('--account')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    # progress messages (the operations print theirs) go to stderr, stdout only gets the json result of the command
+    with contextlib.redirect_stdout(sys.stderr):
+        result = args.handler(args)
+    if result is not None:
+        print(json.dumps(result, indent=args.indent))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+import argparse
+import base64
+import time
+
+from algosdk import account, encoding
+from algosdk.future import transaction
+from algosdk.logic import get_application_address
+
+from helpers.consts import AppArgs
+from helpers.txn_templates import buy_template, buy_values, setup_sale_template, setup_sale_values
+from helpers.utils import int_to_bytes
+
+# compares building, grouping and signing bulk buy and setup_sale transactions with algosdk objects (what
+# helpers/operations.py does) against the pre-encoded templates of helpers/txn_templates.py, offline.
+# both paths must produce byte-identical signed groups
+#
+#   PYTHONPATH=. python services/bench_txn_templates.py --count 5000
+
+APP_ID = 1234567
+ASSET_ID = 7654321
+
+
+def suggested_params():
+    return transaction.SuggestedParams(fee=1000, first=20000000, last=20001000, flat_fee=True, min_fee=1000,
+                                       gh='SGO1GKSzyE7IEPItTxCByw9x8FmnrCDexi9/cOUJOiI=', gen='testnet-v1.0')
+
+
+def objects_buy(private_key, buyer, seller, price, first, last, params):
+    params.first, params.last = first, last
+    app_call_txn = transaction.ApplicationCallTxn(
+        sender=buyer,
+        sp=params,
+        index=APP_ID,
+        on_complete=transaction.OnComplete.NoOpOC,
+        app_args=[AppArgs.buy, int_to_bytes(ASSET_ID)],
+        accounts=[seller],
+        foreign_assets=[ASSET_ID],
+    )
+    pay_txn = transaction.PaymentTxn(sender=buyer, receiver=get_application_address(APP_ID), amt=price, sp=params)
+    transaction.assign_group_id([app_call_txn, pay_txn])
+    signed = [app_call_txn.sign(private_key), pay_txn.sign(private_key)]
+    return b''.join(base64.b64decode(encoding.msgpack_encode(s)) for s in signed)
+
+
+def objects_setup_sale(private_key, seller, price, first, last, params):
+    params.first, params.last = first, last
+    txn = transaction.ApplicationCallTxn(
+        sender=seller,
+        sp=params,
+        index=APP_ID,
+        on_complete=transaction.OnComplete.NoOpOC,
+        app_args=[AppArgs.setup_sale, int_to_bytes(price)],
+        foreign_assets=[ASSET_ID],
+    )
+    return base64.b64decode(encoding.msgpack_encode(txn.sign(private_key)))
+
+
+def bench(name, count, txns_per_call, run):
+    start = time.perf_counter()
+    outputs = [run(i) for i in range(count)]
+    elapsed = time.perf_counter() - start
+    print(f'{name:<28} {count * txns_per_call / elapsed:>12,.0f} txns/s')
+    return outputs, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark pre-encoded transaction templates')
+    parser.add_argument('--count', type=int, default=2000, help='number of groups per path')
+    args = parser.parse_args()
+
+    private_key, buyer = account.generate_account()
+    seller_key, seller = account.generate_account()
+    params = suggested_params()
+    first = params.first
+
+    def price(i):
+        return 1000000 + i
+
+    buy_args = [AppArgs.buy, int_to_bytes(ASSET_ID)]
+    buy = buy_template(suggested_params(), APP_ID, ASSET_ID)
+    setup = setup_sale_template(suggested_params(), APP_ID, ASSET_ID)
+
+    print(f'{args.count} groups per path')
+    buy_objects, buy_objects_time = bench('buy (objects)', args.count, 2, lambda i: objects_buy(
+        private_key, buyer, seller, price(i), first + i, first + i + 1000, params))
+    buy_templates, buy_templates_time = bench('buy (templates)', args.count, 2, lambda i: buy.sign(
+        private_key, buy_values(buy_args, seller, price(i), first + i, first + i + 1000))[0])
+    setup_objects, setup_objects_time = bench('setup_sale (objects)', args.count, 1, lambda i: objects_setup_sale(
+        seller_key, seller, price(i), first + i, first + i + 1000, params))
+    setup_templates, setup_templates_time = bench('setup_sale (templates)', args.count, 1, lambda i: setup.sign(
+        seller_key, setup_sale_values(price(i), first + i, first + i + 1000))[0])
+
+    assert buy_objects == buy_templates, 'buy templates differ from the algosdk encoding'
+    assert setup_objects == setup_templates, 'setup_sale templates differ from the algosdk encoding'
+    print('signed bytes identical on both paths')
+    print(f'speedup: buy {buy_objects_time / buy_templates_time:.1f}x, '
+          f'setup_sale {setup_objects_time / setup_templates_time:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
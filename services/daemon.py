@@ -0,0 +1,372 @@
+import copy
+import hmac
+import json
+import os
+import socketserver
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from algosdk import account, mnemonic
+from algosdk.error import AlgodHTTPError
+from dotenv import load_dotenv
+
+from asc.create_app import compile_programs, deploy
+from helpers.consts import AppArgs, DefaultValues
+from helpers.operations import (buy_asset, buy_now, buyer_execute_transfer, buyer_refund, creator_claim_fees,
+                               setup_sale)
+from helpers.order_book import OrderBook
+from helpers.registry import Registry
+from helpers.utils import (get_algod_client, get_indexer_client, get_private_key_from_mnemonic, get_royalty_split,
+                           int_to_bytes)
+from services.mint_nft import IPFS_URL, create_asa
+
+# long running service for a backend issuing sales: pyteal, algosdk and the contract are imported once, and the
+# algod client (with its node pool and rate limiter), the compiled sale programs, the keys and the suggested params
+# stay in memory between requests, so an operation costs its algod round trips and nothing else.
+#
+# the api is json over http, on a local port or a unix socket:
+#   POST /<op>     one operation, the body holds its fields: {"key": "buyer_1", "asset_id": 1, "seller": "..."}
+#   POST /batch    a list of operations ({"op": "buy", ...}), run concurrently; results come back in order
+#   GET  /health   keys, warm programs and params age
+# ops: mint, deploy, list, buy, execute, buy_now, refund, claim. keys are named after the *_MNEMONIC variables of the
+# environment (BUYER_1_MNEMONIC is "buyer_1") and never leave the process; a "seller" may be an address or a key
+# name. app_id defaults to the latest app deployed for asset_id in the registry, fee_pooling to its mode
+#
+# the listings op is the storefront query: what is for sale across the registry's apps, cheapest first
+# ({"asset_id", "min_price", "max_price", "limit"}, all optional), answered from an in-memory
+# helpers.order_book.OrderBook. the book starts from its ORDER_BOOK_PATH snapshot, catches up through the indexer
+# when it is more than BOOK_TTL seconds old, and is saved again when the daemon stops
+#
+# the daemon signs with real keys, so every request must carry the DAEMON_TOKEN of the environment in an
+# X-Daemon-Token header, and posts must be sent as application/json (a browser cannot send that cross-origin
+# without a preflight the daemon never answers). the unix socket is only accessible to its owner
+#
+#   DAEMON_TOKEN=... python services/daemon.py [port | unix socket path]
+
+PARAMS_TTL = 10.0  # seconds suggested params are reused, a couple of rounds; they stay valid for 1000
+TOKEN_HEADER = 'X-Daemon-Token'
+BOOK_TTL = 4.0  # seconds the order book answers without catching up, about a round
+DEFAULT_BOOK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'order_book.json')
+
+
+class RequestError(Exception):
+    pass
+
+
+# the algod client with suggested params cached for `params_ttl` seconds; every caller gets its own copy since
+# operations adjust the fee of theirs
+class WarmClient:
+    def __init__(self, client, params_ttl: float = PARAMS_TTL):
+        self.client = client
+        self.params_ttl = params_ttl
+        self.params = None
+        self.fetched = 0.0
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def suggested_params(self):
+        with self.lock:
+            if self.params is None or time.monotonic() - self.fetched > self.params_ttl:
+                self.params = self.client.suggested_params()
+                self.fetched = time.monotonic()
+            return copy.copy(self.params)
+
+    def params_age(self):
+        return None if self.params is None else round(time.monotonic() - self.fetched, 1)
+
+
+# {key name: private key} of every *_MNEMONIC variable of the environment
+def load_keystore(environ=os.environ) -> dict:
+    return {name[:-len('_MNEMONIC')].lower(): get_private_key_from_mnemonic(value)
+            for name, value in environ.items() if name.endswith('_MNEMONIC') and value}
+
+
+class Daemon:
+    def __init__(self, client=None, keys: dict = None, registry: Registry = None, workers: int = 16, indexer=None,
+                 book_path: str = None):
+        self.client = WarmClient(client or get_algod_client())
+        self.keys = load_keystore() if keys is None else keys
+        self.registry = registry or Registry()
+        self.indexer = indexer
+        self.book_path = book_path or os.getenv('ORDER_BOOK_PATH', DEFAULT_BOOK_PATH)
+        self.book = None
+        self.book_refreshed = 0.0
+        self.book_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(workers)
+        self.programs = {}  # fee pooling -> compiled (approval, clear)
+        self.payees = {}  # app id -> royalty split payees, fixed when the app is created
+        self.lock = threading.Lock()
+        self.operations = {'mint': self.mint, 'deploy': self.deploy, 'list': self.list, 'buy': self.buy,
+                           'execute': self.execute, 'buy_now': self.buy_now, 'refund': self.refund,
+                           'claim': self.claim, 'listings': self.listings}
+
+    # compiles both program variants and fetches params up front, so the first requests do not pay for them
+    def warm(self):
+        try:
+            self.client.suggested_params()
+            for fee_pooling in (False, True):
+                self.program(fee_pooling)
+        except Exception as err:
+            print(f'warm up failed, compiling on first use: {err}')
+
+    # the order book, caught up with the chain when older than BOOK_TTL: a book without a snapshot is built with a
+    # full scan of the registry's apps, later refreshes only fetch the sellers touched since the book's round
+    def order_book(self) -> OrderBook:
+        with self.book_lock:
+            if self.book is None:
+                self.book = OrderBook.load(self.book_path)
+            if time.monotonic() - self.book_refreshed > BOOK_TTL:
+                if self.indexer is None:
+                    self.indexer = get_indexer_client()
+                app_ids = [deployment.app_id for deployment in self.registry.all_deployments()]
+                if self.book.round:
+                    self.book.catch_up(self.indexer, app_ids)
+                else:
+                    self.book.load_from_indexer(self.indexer, app_ids)
+                    self.book.save(self.book_path)
+                self.book_refreshed = time.monotonic()
+            return self.book
+
+    def program(self, fee_pooling: bool) -> tuple:
+        with self.lock:
+            if fee_pooling not in self.programs:
+                self.programs[fee_pooling] = compile_programs(self.client, fee_pooling)
+            return self.programs[fee_pooling]
+
+    def royalty_payees(self, app_id: int) -> list:
+        if app_id not in self.payees:
+            self.payees[app_id] = [payee for payee, _ in get_royalty_split(self.client, app_id)]
+        return self.payees[app_id]
+
+    def key(self, req: dict, default: str):
+        name = req.get('key', default)
+        if name not in self.keys:
+            raise RequestError(f'unknown key {name!r}')
+        return self.keys[name]
+
+    def address(self, value: str) -> str:
+        return account.address_from_private_key(self.keys[value]) if value in self.keys else value
+
+    # (app id, fee pooling) of the request: its app_id, or the latest app deployed for its asset_id
+    def app(self, req: dict) -> tuple:
+        deployment = self.registry.deployment(req['app_id']) if req.get('app_id') else \
+            self.registry.deployment_for_asset(req['asset_id'])
+        if deployment is None and not req.get('app_id'):
+            raise RequestError(f'no app deployed for asset {req["asset_id"]} in the registry, pass app_id')
+        app_id = req.get('app_id') or deployment.app_id
+        return app_id, bool(req.get('fee_pooling', deployment.fee_pooling if deployment else False))
+
+    def mint(self, req: dict):
+        asset_id = create_asa(self.key(req, 'creator'), req.get('name', 'nancy baker mushroom cloud'),
+                              req.get('url', IPFS_URL), algod_client=self.client, registry=self.registry)
+        return {'asset_id': asset_id}
+
+    def deploy(self, req: dict):
+        fee_pooling = bool(req.get('fee_pooling', False))
+        app_id, app_address = deploy(self.client, mnemonic.from_private_key(self.key(req, 'creator')),
+                                     req['asset_id'], req.get('royalty_fee', DefaultValues.royalty_fee),
+                                     req.get('waiting_time', DefaultValues.waiting_time), fee_pooling,
+                                     [tuple(entry) for entry in req.get('split', [])], self.registry,
+                                     self.program(fee_pooling))
+        return {'app_id': app_id, 'app_address': app_address}
+
+    def list(self, req: dict):
+        app_id, _ = self.app(req)
+        txn_id = setup_sale(self.client, self.key(req, 'creator'), app_id,
+                            [AppArgs.setup_sale, int_to_bytes(req.get('price', DefaultValues.nft_price))],
+                            [req['asset_id']], preflight=req.get('preflight', False))
+        return {'txn_id': txn_id}
+
+    def buy(self, req: dict):
+        app_id, _ = self.app(req)
+        app_txn_id, pay_txn_id = buy_asset(self.client, self.key(req, 'buyer_1'), self.address(req['seller']), app_id,
+                                           [AppArgs.buy, int_to_bytes(req['asset_id'])], [req['asset_id']],
+                                           req.get('price', DefaultValues.nft_price),
+                                           preflight=req.get('preflight', False))
+        return {'app_txn_id': app_txn_id, 'pay_txn_id': pay_txn_id}
+
+    def execute(self, req: dict):
+        app_id, fee_pooling = self.app(req)
+        txn_id = buyer_execute_transfer(self.client, self.key(req, 'buyer_1'), self.address(req['seller']), app_id,
+                                        [AppArgs.execute_transfer], [req['asset_id']], fee_pooling,
+                                        preflight=req.get('preflight', False))
+        return {'txn_id': txn_id}
+
+    # pays for the listing and receives the nft in one group, see operations.buy_now
+    def buy_now(self, req: dict):
+        app_id, fee_pooling = self.app(req)
+        app_txn_id, pay_txn_id = buy_now(self.client, self.key(req, 'buyer_1'), self.address(req['seller']), app_id,
+                                         req['asset_id'], req.get('price', DefaultValues.nft_price), fee_pooling,
+                                         preflight=req.get('preflight', False))
+        return {'app_txn_id': app_txn_id, 'pay_txn_id': pay_txn_id}
+
+    def refund(self, req: dict):
+        app_id, fee_pooling = self.app(req)
+        txn_id = buyer_refund(self.client, self.key(req, 'buyer_1'), self.address(req['seller']), app_id,
+                              [AppArgs.refund], fee_pooling)
+        return {'txn_id': txn_id}
+
+    def claim(self, req: dict):
+        app_id, fee_pooling = self.app(req)
+        txn_id = creator_claim_fees(self.client, self.key(req, 'creator'), app_id, [AppArgs.claim_fees], fee_pooling,
+                                    self.royalty_payees(app_id))
+        return {'txn_id': txn_id}
+
+    def listings(self, req: dict):
+        book = self.order_book()
+        listings = book.in_price_range(req.get('min_price', 0), req.get('max_price'), req.get('asset_id'),
+                                       req.get('limit', 20))
+        return {'round': book.round, 'listings': [asdict(listing) for listing in listings]}
+
+    # runs one operation, returns (http status, response body)
+    def handle(self, op: str, req: dict) -> tuple:
+        if op not in self.operations:
+            return 404, {'error': f'unknown operation {op!r}'}
+        if not isinstance(req, dict):
+            return 400, {'error': 'the request body must be a json object'}
+        try:
+            return 200, self.operations[op](req)
+        except (RequestError, KeyError, TypeError, ValueError) as err:
+            return 400, {'error': f'missing field {err}' if isinstance(err, KeyError) else str(err)}
+        except AlgodHTTPError as err:
+            return 502, {'error': str(err), 'algod_status': err.code}
+        except Exception as err:
+            return 500, {'error': f'{type(err).__name__}: {err}'}
+
+    # runs a list of operations concurrently, each result carrying its own status
+    def handle_batch(self, reqs: list) -> list:
+        def run(req):
+            status, body = self.handle(req.get('op') if isinstance(req, dict) else None, req)
+            return {'status': status, **body}
+        return list(self.executor.map(run, reqs))
+
+    def health(self) -> dict:
+        return {'keys': {name: account.address_from_private_key(key) for name, key in self.keys.items()},
+                'programs': sorted('fee_pooling' if mode else 'default' for mode in self.programs),
+                'params_age': self.client.params_age(),
+                'order_book': None if self.book is None else {'listings': len(self.book), 'round': self.book.round}}
+
+    def close(self):
+        self.executor.shutdown()
+        with self.book_lock:
+            if self.book is not None:
+                self.book.save(self.book_path)
+        self.registry.close()
+
+
+# the shared secret clients must send, from the environment
+def daemon_token() -> str:
+    token = os.getenv('DAEMON_TOKEN', '')
+    if not token:
+        raise ValueError('DAEMON_TOKEN is not set')
+    return token
+
+
+def make_handler(daemon: Daemon, token: str):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive, so a backend can reuse its connection
+
+        # unix socket peers have no (host, port)
+        def address_string(self):
+            return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+        def respond(self, status: int, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        # answers 401 (or 415 for a post that is not json) and closes the connection, the body is left unread
+        def refused(self) -> bool:
+            if not hmac.compare_digest(self.headers.get(TOKEN_HEADER, '').encode(), token.encode()):
+                status, error = 401, f'missing or invalid {TOKEN_HEADER} header'
+            elif self.command == 'POST' and self.headers.get_content_type() != 'application/json':
+                status, error = 415, 'the request body must be sent as application/json'
+            else:
+                return False
+            self.close_connection = True
+            self.respond(status, {'error': error})
+            return True
+
+        def do_GET(self):
+            if self.refused():
+                return
+            if self.path == '/health':
+                self.respond(200, daemon.health())
+            else:
+                self.respond(404, {'error': f'unknown path {self.path}'})
+
+        def do_POST(self):
+            if self.refused():
+                return
+            try:
+                req = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            except ValueError as err:
+                self.respond(400, {'error': f'invalid json: {err}'})
+                return
+            op = self.path.strip('/')
+            if op == 'batch':
+                if not isinstance(req, list):
+                    self.respond(400, {'error': 'a batch is a json list of operations'})
+                else:
+                    self.respond(200, daemon.handle_batch(req))
+            else:
+                self.respond(*daemon.handle(op, req))
+
+    return Handler
+
+
+class UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        umask = os.umask(0o177)  # the socket is created 0600
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+        self.server_name, self.server_port = 'localhost', 0
+
+
+# serves `daemon` on `socket_path` when given, otherwise on host:port, until interrupted; clients must send
+# `token` (DAEMON_TOKEN by default)
+def serve(daemon: Daemon, host: str = '127.0.0.1', port: int = 8710, socket_path: str = None, token: str = None):
+    handler = make_handler(daemon, token or daemon_token())
+    if socket_path:
+        server = UnixHTTPServer(socket_path, handler)
+        print(f'serving on unix socket {socket_path}')
+    else:
+        server = ThreadingHTTPServer((host, port), handler)
+        print(f'serving on http://{host}:{server.server_port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        daemon.close()
+        if socket_path and os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+if __name__ == '__main__':
+    load_dotenv()
+    if not os.getenv('DAEMON_TOKEN'):
+        sys.exit('DAEMON_TOKEN is not set')
+    daemon = Daemon()
+    daemon.warm()
+    target = sys.argv[1] if len(sys.argv) > 1 else '8710'
+    if target.isdigit():
+        serve(daemon, port=int(target))
+    else:
+        serve(daemon, socket_path=target)
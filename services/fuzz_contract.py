@@ -0,0 +1,362 @@
+import argparse
+import os
+import random
+from multiprocessing import Pool
+
+from pyteal import compileTeal, Mode
+
+from asc.contract import approval
+from helpers.consts import AppArgs, AppSchema, DefaultValues, InnerTxns, RoyaltySplit
+from helpers.evaluator import (Ledger, Program, EvaluationError, evaluate_group, txn, MIN_TXN_FEE, MAX_UINT64,
+                               ON_COMPLETIONS)
+from helpers.utils import claim_pages, int_to_bytes
+
+# property-based fuzzing of the approval program: random sequences of setup_sale (alone or grouped)/buy/
+# execute_transfer (by the buyer or forced by the seller)/buy_now/refund/claim_fees calls are run against the local
+# evaluator, sharded over worker processes, and the ledger is checked against the invariants below after every call.
+# failing cases are shrunk to a minimal sequence.
+#
+# usage (from the repository root): PYTHONPATH=. python services/fuzz_contract.py --cases 20000
+
+ACTORS = 4  # actor 0 is the creator, the others are collectors
+ACTOR_BALANCE = 10 ** 16  # roughly the whole algo supply, so no price is unaffordable by construction
+EDGE_PRICES = [0, 1, MIN_TXN_FEE, 2 * MIN_TXN_FEE, 2 * MIN_TXN_FEE + 1, 999, 1000, 1001, DefaultValues.nft_price,
+               2 ** 32, 2 ** 63, MAX_UINT64 // 1000, MAX_UINT64 // 1000 + 1, MAX_UINT64]
+EDGE_ROYALTIES = [0, 1, 499, 500, 501, 999, 1000, 1001]
+EDGE_WAITS = [0, 1, DefaultValues.waiting_time, MAX_UINT64]
+
+_programs = {}
+
+
+def address(actor: int) -> bytes:
+    return bytes([actor + 1]) * 32
+
+
+def compile_programs():
+    return {pooling: compileTeal(approval(pooling), mode=Mode.Application, version=5) for pooling in (False, True)}
+
+
+def _init_worker(teals: dict):
+    for pooling, teal in teals.items():
+        _programs[pooling] = Program(teal)
+
+
+# royalty split as (actor, basis points) pairs: often none, sometimes not adding up to 100% on purpose
+def random_split(rng: random.Random):
+    payees = rng.randint(0, RoyaltySplit.max_payees)
+    if payees == 0 or rng.random() < 0.5:
+        return []
+    cuts = sorted(rng.sample(range(1, RoyaltySplit.total_bps), payees - 1))
+    shares = [b - a for a, b in zip([0] + cuts, cuts + [RoyaltySplit.total_bps])]
+    if rng.random() < 0.1:
+        shares[-1] += rng.choice([-1, 1])
+    return [(rng.randrange(ACTORS), share) for share in shares]
+
+
+# a case is (config, ops): config holds the app creation parameters, ops the calls made afterwards
+def generate_case(seed: int, max_length: int):
+    rng = random.Random(seed)
+    config = {
+        'royalty_fee': rng.choice(EDGE_ROYALTIES + [rng.randint(1, 1000)]),
+        'waiting_time': rng.choice(EDGE_WAITS),
+        'fee_pooling': rng.random() < 0.5,
+        'split': random_split(rng),
+    }
+    # a small per-case pool of prices, so buys often match the listed price
+    prices = rng.sample(EDGE_PRICES, 3) + [rng.randint(1, 10 ** 12)]
+    ops = []
+    # calls mostly follow up on the previous listing and purchase, so that sales actually go through
+    listing = (0, rng.choice(prices))
+    purchase = (1, 0)
+    for _ in range(rng.randint(1, max_length)):
+        actor = rng.randrange(ACTORS)
+        seller = rng.randrange(ACTORS)
+        follow_up = rng.random() < 0.75
+        kind = rng.choices(['setup_sale', 'setup_sales', 'buy', 'execute_transfer', 'force_transfer', 'buy_now',
+                            'refund', 'claim_fees', 'wait'], weights=[4, 1, 4, 4, 1, 2, 2, 1, 1])[0]
+        if kind == 'setup_sale':
+            listing = (actor, rng.choice(prices))
+            ops.append((kind,) + listing)
+        elif kind == 'setup_sales':
+            # two setup_sale calls in one group, as bulk listing sends them (the case has a single app, so this is
+            # one seller listing twice and the second price wins)
+            listing = (actor, rng.choice(prices))
+            ops.append((kind, actor, rng.choice(prices), listing[1]))
+        elif kind in ('buy', 'buy_now'):
+            if follow_up:
+                seller, price = listing
+                purchase = (actor, seller)
+            else:
+                price = rng.choice(prices)
+            ops.append((kind, actor, seller, price))
+        elif kind in ('execute_transfer', 'refund'):
+            ops.append((kind,) + (purchase if follow_up else (actor, seller)))
+        elif kind == 'force_transfer':
+            # execute_transfer sent by the seller, naming the buyer
+            buyer, seller = purchase if follow_up else (rng.randrange(ACTORS), seller)
+            ops.append((kind, seller if follow_up else actor, seller, buyer))
+        elif kind == 'claim_fees':
+            # the whole claim (a group of one call per page), or a single call paying up to that many payees
+            ops.append((kind, 0 if follow_up else actor, rng.choice([None, None, 1, 2, RoyaltySplit.payees_per_call])))
+        else:
+            ops.append((kind, rng.choice([1, DefaultValues.waiting_time + 1, 1000])))
+    return config, ops
+
+
+# builds the ledger every case starts from: funded actors, the NFT held by the creator, the app created with
+# the case parameters and clawback over the NFT, everybody opted in to the asset and the app
+def initial_ledger(config: dict):
+    program = _programs[config['fee_pooling']]
+    ledger = Ledger()
+    creator = address(0)
+    for actor in range(ACTORS):
+        ledger.account(address(actor)).amount = ACTOR_BALANCE
+    asset_id = ledger.create_asset(creator, manager=creator)
+    split_args = [b''.join(address(actor) + int_to_bytes(share) for actor, share in config['split'])]
+    create = txn('appl', Sender=creator, ApplicationID=0, Assets=[asset_id], ApplicationArgs=[
+        creator, int_to_bytes(asset_id), int_to_bytes(config['royalty_fee']), int_to_bytes(config['waiting_time'])]
+        + (split_args if config['split'] else []))
+    evaluate_group(ledger, [create], program, (AppSchema.local_ints, AppSchema.local_bytes))
+    app_id = max(ledger.apps)
+    app_address = ledger.apps[app_id].address
+    ledger.assets[asset_id].clawback = app_address
+    funding = DefaultValues.app_min_balance if config['fee_pooling'] else DefaultValues.app_funding
+    evaluate_group(ledger, [txn('pay', Sender=creator, Receiver=app_address, Amount=funding)])
+    for actor in range(ACTORS):
+        sender = address(actor)
+        if actor:
+            evaluate_group(ledger, [txn('axfer', Sender=sender, AssetReceiver=sender, XferAsset=asset_id)])
+        evaluate_group(ledger, [txn('appl', Sender=sender, ApplicationID=app_id,
+                                    OnCompletion=ON_COMPLETIONS['OptIn'])])
+    return ledger, app_id, asset_id
+
+
+# `cursor` is the claim cursor of the app, where a claim_fees op starts paying the royalty split
+def build_group(op: tuple, config: dict, app_id: int, asset_id: int, app_address: bytes, cursor: int = 0):
+    kind = op[0]
+    sender = address(op[1]) if kind != 'wait' else None
+    pooled_fee = MIN_TXN_FEE
+    if config['fee_pooling'] and kind in ('execute_transfer', 'force_transfer', 'buy_now', 'refund'):
+        pooled_fee = MIN_TXN_FEE * (1 + getattr(InnerTxns, kind.replace('force', 'execute')))
+    if kind == 'setup_sale':
+        return [txn('appl', Sender=sender, ApplicationID=app_id, Assets=[asset_id],
+                    ApplicationArgs=[AppArgs.setup_sale, int_to_bytes(op[2])])]
+    if kind == 'setup_sales':
+        return [txn('appl', Sender=sender, ApplicationID=app_id, Assets=[asset_id],
+                    ApplicationArgs=[AppArgs.setup_sale, int_to_bytes(price)]) for price in op[2:4]]
+    if kind == 'buy':
+        return [txn('appl', Sender=sender, ApplicationID=app_id, Assets=[asset_id], Accounts=[address(op[2])],
+                    ApplicationArgs=[AppArgs.buy, int_to_bytes(asset_id)]),
+                txn('pay', Sender=sender, Receiver=app_address, Amount=op[3])]
+    if kind == 'buy_now':
+        return [txn('pay', Sender=sender, Receiver=app_address, Amount=op[3]),
+                txn('appl', Sender=sender, ApplicationID=app_id, Assets=[asset_id], Accounts=[address(op[2])],
+                    ApplicationArgs=[AppArgs.buy_now, int_to_bytes(asset_id)], Fee=pooled_fee)]
+    if kind in ('execute_transfer', 'refund'):
+        return [txn('appl', Sender=sender, ApplicationID=app_id, Assets=[asset_id], Accounts=[address(op[2])],
+                    ApplicationArgs=[getattr(AppArgs, kind)], Fee=pooled_fee)]
+    if kind == 'force_transfer':
+        return [txn('appl', Sender=sender, ApplicationID=app_id, Assets=[asset_id],
+                    Accounts=[address(op[2]), address(op[3])], ApplicationArgs=[AppArgs.execute_transfer],
+                    Fee=pooled_fee)]
+    payees = [address(actor) for actor, _ in config['split']]
+    pages = claim_pages(payees, cursor) if op[2] is None else [payees[cursor:cursor + op[2]]]
+    return [txn('appl', Sender=sender, ApplicationID=app_id, ApplicationArgs=[AppArgs.claim_fees], Accounts=page,
+                Fee=MIN_TXN_FEE * (1 + (len(page) or InnerTxns.claim_fees)) if config['fee_pooling'] else MIN_TXN_FEE)
+            for page in pages]
+
+
+# returns a description of the first broken invariant, or None
+def check_invariants(ledger: Ledger, app_id: int, asset_id: int, total: int):
+    if ledger.total_algos() != total:
+        return f'conservation of funds: {ledger.total_algos() - total:+d} microAlgos'
+    holders = [a for a in ledger.accounts.values() if a.assets.get(asset_id, 0) > 0]
+    if len(holders) != 1 or holders[0].assets[asset_id] != 1:
+        return f'nft ownership: {len(holders)} holders'
+    app = ledger.apps[app_id]
+    escrowed = sum(state.get(b'amount_payment', 0) for acct in ledger.accounts.values()
+                   for state in [acct.local.get(app_id, {})] if state.get(b'approve_transfer', 0) == 1)
+    owed = unclaimed_fees(app.global_state) + escrowed
+    if ledger.accounts[app.address].amount < owed:
+        return f'solvency: app holds {ledger.accounts[app.address].amount}, owes {owed}'
+    # every buyer who paid must still have a pending sale to execute or refund: one listed seller with an approved
+    # transfer per approved buyer
+    approved = [state for acct in ledger.accounts.values() for state in [acct.local.get(app_id, {})]
+                if state.get(b'approve_transfer', 0) == 1]
+    sellers = sum(1 for state in approved if b'amount_payment' in state)
+    if len(approved) - sellers != sellers:
+        return f'stranded payment: {len(approved) - sellers} paid buyer(s) for {sellers} pending sale(s)'
+    return None
+
+
+# royalty fees the app still owes: the collected fees, and the rest of a claim paid over several calls
+def unclaimed_fees(global_state: dict) -> int:
+    return global_state.get(b'collected_fees', 0) + global_state.get(b'claim_amount', 0) - \
+        global_state.get(b'claim_paid', 0)
+
+
+# per-actor accounting of one call: what each actor gained or lost (the fees of the transactions it sent aside) must
+# be something the call was allowed to do. a buyer only pays the listed price, with a buy (escrowed) or a buy_now
+# that delivers the nft; the nft only moves to a buyer whose payment was accepted; a seller is only paid, at most the
+# price, when the nft leaves it; a buyer only gets back at most its escrow with a refund, and the royalty payees at
+# most the collected fees with a claim. `escrow` (buyer -> price paid, not yet settled) is updated as calls go
+def check_actors(op: tuple, group: list, before: dict, after: dict, escrow: dict, collected: int, config: dict):
+    kind = op[0]
+    fees = {actor: sum(t['Fee'] for t in group if t['Sender'] == address(actor)) for actor in range(ACTORS)}
+    delta = {actor: after['amounts'][actor] - before['amounts'][actor] + fees[actor] for actor in range(ACTORS)}
+    seller, buyer = before['holder'], after['holder']
+    paid = None
+    if seller != buyer:
+        if kind == 'buy_now' and op[1] == buyer and delta[buyer] == -op[3]:
+            paid = op[3]
+        else:
+            paid = escrow.pop(buyer, None)
+        if paid is None:
+            return f'unpaid transfer: actor {buyer} received the nft from actor {seller} without paying'
+    recipients = {0} | {actor for actor, _ in config['split']}
+    claimed = sum(delta[actor] for actor in recipients if delta[actor] > 0)
+    for actor in range(ACTORS):
+        if delta[actor] < 0:
+            if kind not in ('buy', 'buy_now') or op[1] != actor or delta[actor] != -op[3]:
+                return f'buyer loss: actor {actor} lost {-delta[actor]} microAlgos in {kind}'
+            if kind == 'buy_now' and buyer != actor:
+                return f'buyer loss: actor {actor} paid {op[3]} in buy_now without receiving the nft'
+            if kind == 'buy':
+                escrow[actor] = escrow.get(actor, 0) + op[3]
+        elif delta[actor] > 0:
+            if actor == seller != buyer and delta[actor] <= paid:
+                continue  # paid for the nft it delivered
+            if kind == 'refund' and op[1] == actor and delta[actor] <= escrow.get(actor, 0):
+                del escrow[actor]
+                continue
+            if kind == 'claim_fees' and actor in recipients and claimed <= collected:
+                continue
+            return f'unearned payment: actor {actor} gained {delta[actor]} microAlgos in {kind}'
+    return None
+
+
+# what check_actors compares before and after each call: the balance of every actor and the actor holding the nft
+def actor_state(ledger: Ledger, asset_id: int) -> dict:
+    accounts = [ledger.accounts[address(actor)] for actor in range(ACTORS)]
+    return {'amounts': [acct.amount for acct in accounts],
+            'holder': next((actor for actor, acct in enumerate(accounts) if acct.assets.get(asset_id)), None)}
+
+
+# runs a case and returns (op index, violation) for the first broken invariant, or None
+def run_case(case):
+    config, ops = case
+    try:
+        ledger, app_id, asset_id = initial_ledger(config)
+    except EvaluationError:
+        return None  # creation parameters rejected by the contract, nothing to check
+    app_address = ledger.apps[app_id].address
+    total = ledger.total_algos()
+    escrow = {}
+    for index, op in enumerate(ops):
+        if op[0] == 'wait':
+            ledger.round += op[1]
+            continue
+        before = actor_state(ledger, asset_id)
+        global_state = ledger.apps[app_id].global_state
+        collected = unclaimed_fees(global_state)
+        group = build_group(op, config, app_id, asset_id, app_address, global_state.get(b'claim_cursor', 0))
+        try:
+            evaluate_group(ledger, group)
+        except EvaluationError:
+            group = []  # rejected calls must leave the ledger untouched, which the invariants verify as well
+        violation = check_actors(op, group, before, actor_state(ledger, asset_id), escrow, collected, config) or \
+            check_invariants(ledger, app_id, asset_id, total)
+        if not violation and any(ledger.accounts[address(actor)].local[app_id].get(b'approve_transfer') != 1
+                                 for actor in escrow):
+            violation = 'lost escrow: a buyer who paid can no longer execute or refund'
+        if violation:
+            return index, violation
+    return None
+
+
+def run_seed(args):
+    seed, max_length = args
+    case = generate_case(seed, max_length)
+    failure = run_case(case)
+    return (seed, case, failure) if failure else None
+
+
+def _same_failure(case, kind: str):
+    failure = run_case(case)
+    return failure is not None and failure[1].split(':')[0] == kind
+
+
+# delta-debugging style shrinking: drop chunks of calls, then move numbers towards simpler edge values
+def shrink(case):
+    config, ops = case
+    kind = run_case(case)[1].split(':')[0]
+    ops = ops[:run_case(case)[0] + 1]
+    changed = True
+    while changed:
+        changed = False
+        chunk = max(len(ops) // 2, 1)
+        while chunk >= 1:
+            i = 0
+            while i < len(ops):
+                candidate = ops[:i] + ops[i + chunk:]
+                if candidate and _same_failure((config, candidate), kind):
+                    ops = candidate
+                    changed = True
+                else:
+                    i += chunk
+            chunk //= 2
+        for i, op in enumerate(ops):
+            if op[0] in ('setup_sale', 'setup_sales', 'buy', 'buy_now', 'wait'):
+                for value in sorted(set(EDGE_PRICES + [1, DefaultValues.waiting_time + 1])):
+                    if value >= op[-1]:
+                        break
+                    candidate = ops[:i] + [op[:-1] + (value,)] + ops[i + 1:]
+                    if _same_failure((config, candidate), kind):
+                        ops = candidate
+                        changed = True
+                        break
+        for key, simpler in (('royalty_fee', DefaultValues.royalty_fee), ('waiting_time', 0),
+                             ('fee_pooling', False), ('split', [])):
+            if config[key] != simpler and _same_failure(({**config, key: simpler}, ops), kind):
+                config = {**config, key: simpler}
+                changed = True
+    return config, ops
+
+
+def main():
+    parser = argparse.ArgumentParser(description='fuzz the asset sale approval program against the local evaluator')
+    parser.add_argument('--cases', type=int, default=10000)
+    parser.add_argument('--length', type=int, default=25, help='maximum number of calls per case')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--keep-going', action='store_true', help='report every failing seed instead of the first')
+    args = parser.parse_args()
+
+    teals = compile_programs()
+    _init_worker(teals)
+    failures = []
+    with Pool(args.workers, initializer=_init_worker, initargs=(teals,)) as pool:
+        seeds = ((seed, args.length) for seed in range(args.seed, args.seed + args.cases))
+        for result in pool.imap_unordered(run_seed, seeds, chunksize=64):
+            if result is None:
+                continue
+            failures.append(result)
+            print(f'seed {result[0]} broke an invariant: {result[2][1]}')
+            if not args.keep_going:
+                pool.terminate()
+                break
+
+    print(f'{args.cases if not failures or args.keep_going else "stopped after some"} cases, '
+          f'{len(failures)} failing')
+    for seed, case, failure in failures[:1] if not args.keep_going else failures:
+        config, ops = shrink(case)
+        print(f'---------------------------------- minimal case for seed {seed} ----------------------------------')
+        print(f'config: {config}')
+        for op in ops:
+            print(f'  {op}')
+        print(f'violation: {run_case((config, ops))[1]}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -1,25 +1,25 @@
 import os
+import sys
 
 from algosdk import account
 from algosdk.future import transaction
 from dotenv import load_dotenv
 
+from helpers.metadata import build_collection, ASA_NAME_MAX_BYTES
+from helpers.registry import Asset, Registry
 from helpers.utils import get_algod_client
 
 CID = 'QmRm2AFpxXTAoQ1wXXc8WmxvP8vXMJtNqgHrtU5vhvLQ8k'
 IPFS_URL = 'ipfs://' + CID
-print(f'ipfs url: {IPFS_URL}')
 
-json_metadata_raw = open('../assets/mock_metadata.json')
-json_metadata = json_metadata_raw.read()
 
-
-def create_asa():
-    private_key = os.getenv('CREATOR_SECRET')
+def create_asa(private_key: str = None, asset_name: str = 'nancy baker mushroom cloud', url: str = IPFS_URL,
+               metadata_hash: bytes = None, note: bytes = None, algod_client=None, registry: Registry = None):
+    private_key = private_key or os.getenv('CREATOR_SECRET')
     address = account.address_from_private_key(private_key)
 
     # create purestake algod_client to send requests
-    algod_client = get_algod_client()
+    algod_client = algod_client or get_algod_client()
     params = algod_client.suggested_params()
 
     txn = transaction.AssetConfigTxn(
@@ -28,43 +28,65 @@ def create_asa():
         total=1,
         default_frozen=False,
         unit_name='nft',
-        asset_name='nancy baker mushroom cloud',
+        asset_name=asset_name,
         manager=address,
         reserve='',
         freeze='',
         clawback='',
-        url=IPFS_URL,
-        # metadata_hash=json_metadata_hash,
+        url=url,
+        metadata_hash=metadata_hash,  # ARC-3: sha256 of the metadata json behind `url`
         strict_empty_address_check=False,
         decimals=0,
-        # TODO: add ARC69 metadata
-        # note=json_metadata.encode(),
+        note=note,  # ARC-69 metadata
     )
 
     # sign transaction with our private key to confirm authorization
     signed_txn = txn.sign(private_key)
     print('signing transaction to create asa...')
 
-    try:
-        # send transaction to the network using purestake
-        txn_id = algod_client.send_transaction(signed_txn)
-        resp = transaction.wait_for_confirmation(algod_client, txn_id, 5)
-        asset_id = resp['asset-index']
+    # send transaction to the network using purestake; errors are raised to the caller
+    txn_id = algod_client.send_transaction(signed_txn)
+    resp = transaction.wait_for_confirmation(algod_client, txn_id, 5)
+    asset_id = resp['asset-index']
+
+    # record the asset in the deployment registry
+    (registry or Registry()).add_asset(Asset(asset_id, address, asset_name, url))
 
-        with open('../.env', 'a') as f:
-            f.write(f'ASSET_ID={asset_id}\n')
-            f.flush()
+    print(f'successfully sent transaction with id: {txn_id}')
+    print(f'response: {resp}')
+    print(f'asset ID: {asset_id}')
+    print(f'asset url: {url}')
+    print(f'algoexplorer: https://testnet.algoexplorer.io/asset/{resp["asset-index"]}')
+    return asset_id
 
-        print(f'successfully sent transaction with id: {txn_id}')
-        print(f'response: {resp}')
-        print(f'asset ID: {asset_id}')
-        print(f'ipfs url: https://ipfs.io/ipfs/{CID}')
-        print(f'algoexplorer: https://testnet.algoexplorer.io/asset/{resp["asset-index"]}')
 
-    except Exception as err:
-        print(err)
+# mints every piece of a collection directory as it is hashed, see helpers/metadata.py for the layout
+# returns ({piece name: asset id}, {piece name: error}): a failed piece does not stop the others
+def mint_collection(directory: str, base_url: str, out_dir: str = None, private_key: str = None,
+                    algod_client=None, registry: Registry = None):
+    algod_client = algod_client or get_algod_client()
+    registry = registry or Registry()
+    minted, failed = {}, {}
+    for piece in build_collection(directory, base_url, out_dir):
+        asset_name = piece.name.encode()[:ASA_NAME_MAX_BYTES].decode(errors='ignore')
+        try:
+            minted[piece.name] = create_asa(private_key, asset_name, piece.url, piece.metadata_hash, piece.note,
+                                            algod_client, registry)
+        except Exception as err:
+            print(f'minting {piece.name} failed: {err}')
+            failed[piece.name] = str(err)
+    print(f'{len(minted)} piece(s) minted, {len(failed)} failed')
+    return minted, failed
 
 
 if __name__ == '__main__':
     load_dotenv()
-    create_asa()
+    if len(sys.argv) > 2:
+        # python mint_nft.py <collection dir> <base url> [metadata out dir]
+        _, failed = mint_collection(sys.argv[1], sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+        for name, error in failed.items():
+            print(f'failed: {name}: {error}')
+        sys.exit(1 if failed else 0)
+    else:
+        print(f'ipfs url: {IPFS_URL}')
+        create_asa()
@@ -1,130 +1,183 @@
+import base64
 import os
 
-from algosdk.future import transaction
 from dotenv import load_dotenv
 
-from helpers.consts import DefaultValues, AppArgs
-from helpers.operations import (send_funds, setup_sale, buy_asset, buyer_execute_transfer, opt_in, set_clawback,
+from helpers.consts import DefaultValues, AppArgs, InnerTxns
+from helpers.min_balance import MinBalancePlanner, fund, plan_sale_app
+from helpers.operations import (setup_sale, buy_asset, buyer_execute_transfer, opt_in, opt_in_asset, set_clawback,
                                 creator_claim_fees)
+from helpers.registry import Registry
 from helpers.utils import (get_public_key_from_mnemonic, get_private_key_from_mnemonic, int_to_bytes,
-                           print_asset_holding,
-                           wait_for_confirmation, get_algod_client)
+                           print_asset_holding, get_asset_amount, get_local_state,
+                           get_algod_client, get_indexer_client, get_royalty_split)
+from helpers.workflow_engine import Step, Journal, run_workflow
 
-load_dotenv()
-cwd = os.getcwd()
-
-mnemonics = [
-    os.getenv('CREATOR_MNEMONIC'),
-    os.getenv('BUYER_1_MNEMONIC'),
-    os.getenv('BUYER_2_MNEMONIC'),
-]
+# the sale workflow as a graph of steps: the app and the buyers are funded in one group, then opt-ins and clawback
+# run concurrently, then two sales (creator -> buyer 1 -> buyer 2) and the fee claim. progress is journaled, so a
+# rerun after a failure resumes where it stopped instead of repeating funding, clawback and opt-ins. the on-chain
+# checks of the sale steps stay true once later steps ran: they look at how far the nft went along
+# creator -> buyer_1 -> buyer_2, and the claim looks for a confirmed claim_fees call after the last sale
 
-asset_id = int(os.getenv('ASSET_ID'))
-app_id = int(os.getenv('APP_ID'))
-app_address = os.getenv('APP_ADDRESS')
+load_dotenv()
 
 # for ease of reference, add account public and private keys to an accounts dict
 accounts = {}
-counter = 1
-for i, m in enumerate(mnemonics):
-    accounts[i] = {}
-    accounts[i]['pk'] = get_public_key_from_mnemonic(m)
-    accounts[i]['sk'] = get_private_key_from_mnemonic(m)
-
-creator_private_key = get_private_key_from_mnemonic(os.getenv('CREATOR_MNEMONIC'))
-buyer_1_private_key = get_private_key_from_mnemonic(os.getenv('BUYER_1_MNEMONIC'))
-buyer_2_private_key = get_private_key_from_mnemonic(os.getenv('BUYER_2_MNEMONIC'))
-
-creator_public_key = get_public_key_from_mnemonic(os.getenv('CREATOR_MNEMONIC'))
-buyer_1_public_key = get_public_key_from_mnemonic(os.getenv('BUYER_1_MNEMONIC'))
-buyer_2_public_key = get_public_key_from_mnemonic(os.getenv('BUYER_2_MNEMONIC'))
+for name in ('creator', 'buyer_1', 'buyer_2'):
+    mn = os.getenv(f'{name.upper()}_MNEMONIC')
+    accounts[name] = {'pk': get_public_key_from_mnemonic(mn), 'sk': get_private_key_from_mnemonic(mn)}
+
+# targets come from the deployment registry: ASSET_ID (or the creator's latest asset) and APP_ID (or the latest
+# app deployed for that asset). apps deployed before the registry fall back to APP_ADDRESS and FEE_POOLING
+registry = Registry()
+asset_id = int(os.getenv('ASSET_ID') or registry.latest_asset(accounts['creator']['pk']).asset_id)
+deployment = registry.deployment(int(os.getenv('APP_ID'))) if os.getenv('APP_ID') else \
+    registry.deployment_for_asset(asset_id)
+if deployment is not None:
+    app_id, app_address, fee_pooling = deployment.app_id, deployment.app_address, deployment.fee_pooling
+else:
+    app_id = int(os.getenv('APP_ID'))
+    app_address = os.getenv('APP_ADDRESS')
+    # must match the mode the app was compiled with (see asc/create_app.py)
+    fee_pooling = os.getenv('FEE_POOLING', '').lower() in ('1', 'true', 'yes')
+journal_path = os.getenv('WORKFLOW_JOURNAL', f'../workflow_{app_id}.journal')
 
 # create purestake algod_client
 algod_client = get_algod_client()
-params = algod_client.suggested_params()
-
-# asset opt in
-for wallet, value in accounts.items():
-    # check if asset_id is in account 2 and 3's asset holdings prior to opt-in
-    account_info = algod_client.account_info(accounts[wallet]['pk'])
-    holding = None
-    for index, my_account_info in enumerate(account_info['assets']):
-        scrutinized_asset = account_info['assets'][index]
-        if scrutinized_asset['asset-id'] == asset_id:
-            holding = True
-            break
-
-    if holding:
-        print(f'confirming asset is already in account for address: {accounts[wallet]["pk"]}')
-    else:
-        # use the AssetTransferTxn class to begin accepting an asset
-        txn = transaction.AssetTransferTxn(
-            sender=accounts[wallet]['pk'],
-            sp=params,
-            receiver=accounts[wallet]['pk'],
-            amt=0,
-            index=asset_id,
-        )
-        signed_txn = txn.sign(accounts[wallet]['sk'])
-        txn_id = algod_client.send_transaction(signed_txn)
-        print('txn_id:', txn_id)
-        wait_for_confirmation(algod_client, txn_id)
-        # check the asset holding for that account (should now show a holding with a balance of 0)
-        print(f'asset opt-in for address: {accounts[wallet]["pk"]}')
-        print_asset_holding(algod_client, accounts[wallet]['pk'], asset_id)
-
-# fund application
-send_funds(algod_client, creator_private_key, app_address)
-
-# setting clawback to app
-set_clawback(algod_client, creator_private_key, asset_id, app_address)
-print(f'set clawback address to: {app_address}')
-
-# opt into application
-opt_in(algod_client, creator_private_key, app_id)
-opt_in(algod_client, buyer_1_private_key, app_id)
-opt_in(algod_client, buyer_2_private_key, app_id)
+indexer_client = get_indexer_client()
+# royalty split payees, fixed when the app was created: claim_fees pays each of them and must reference them
+payees = [payee for payee, _ in get_royalty_split(algod_client, app_id)]
 
 foreign_assets = [asset_id]
-
-# create list of bytes for sale setup app args
-sale_args = [AppArgs.setup_sale, int_to_bytes(DefaultValues.nft_price)]
-
-print('---------------------------------- initiate purchase by buyer 1 ----------------------------------')
-setup_txn_id = setup_sale(algod_client, creator_private_key, app_id, sale_args, foreign_assets)
-print(f'setup sale transaction id: {setup_txn_id}')
+price = DefaultValues.nft_price
+# create list of bytes for the app args
+sale_args = [AppArgs.setup_sale, int_to_bytes(price)]
 buy_args = [AppArgs.buy, int_to_bytes(asset_id)]
-# buyer posting buy transactions
-buy_asset(algod_client, buyer_1_private_key, creator_public_key, app_id, buy_args, foreign_assets,
-          DefaultValues.nft_price)
 buyer_execute_args = [AppArgs.execute_transfer]
-
-# buyer executing transfer
-buyer_execute_transfer(algod_client, buyer_1_private_key, creator_public_key, app_id, buyer_execute_args,
-                       foreign_assets)
-print('---------------------------------- sale from creator to buyer 1 completed ----------------------------------')
-print('creator:')
-print_asset_holding(algod_client, creator_public_key, asset_id)
-print('buyer 1:')
-print_asset_holding(algod_client, buyer_1_public_key, asset_id)
-
-print('---------------------------------- initiate purchase by buyer 2 ----------------------------------')
-setup_txn_id_b = setup_sale(algod_client, buyer_1_private_key, app_id, sale_args, foreign_assets)
-print(f'setup sale transaction ID: {setup_txn_id_b}')
-# buyer posting buy transactions
-buy_asset(algod_client, buyer_2_private_key, buyer_1_public_key, app_id, buy_args, foreign_assets,
-          DefaultValues.nft_price)
-# buyer executing transfer
-buyer_execute_transfer(algod_client, buyer_2_private_key, buyer_1_public_key, app_id, buyer_execute_args,
-                       foreign_assets)
-
-print('---------------------------------- sale from buyer 1 to buyer 2 completed ----------------------------------')
-print_asset_holding(algod_client, buyer_1_public_key, asset_id)
-print_asset_holding(algod_client, buyer_2_public_key, asset_id)
 creator_claim_args = [AppArgs.claim_fees]
-creator_account_before = algod_client.account_info(creator_public_key).get('amount')
-print(f'creator account balance before claiming fees: {creator_account_before} microAlgos.')
-creator_claim_fees(algod_client, creator_private_key, app_id, creator_claim_args)
-creator_account_after = algod_client.account_info(creator_public_key).get('amount')
-print(f'creator account balance after claiming fees: {creator_account_after} microAlgos.')
-print(f'total fees claimed: {creator_account_after - creator_account_before} microAlgos')
+
+
+def local_value(account: str, key: bytes):
+    return (get_local_state(algod_client, account, app_id) or {}).get(key)
+
+
+# the owners of the nft in sale order: sale n is complete once the nft reached owners[n]
+owners = ('creator', 'buyer_1', 'buyer_2')
+
+
+def holder_position() -> int:
+    for position in reversed(range(len(owners))):
+        if get_asset_amount(algod_client, accounts[owners[position]]['pk'], asset_id) == 1:
+            return position
+    return -1
+
+
+# confirmed rounds of the calls `sender` made to the app with `arg` as first argument, through the indexer
+def app_call_rounds(sender: str, arg: bytes) -> list:
+    encoded_arg = base64.b64encode(arg).decode()
+    rounds, next_page = [], ''
+    while True:
+        response = indexer_client.search_transactions(address=sender, address_role='sender', application_id=app_id,
+                                                      txn_type='appl', next_page=next_page)
+        rounds += [txn['confirmed-round'] for txn in response.get('transactions', [])
+                   if txn['application-transaction'].get('application-args', [None])[:1] == [encoded_arg]]
+        next_page = response.get('next-token')
+        if not next_page or not response.get('transactions'):
+            return rounds
+
+
+# a claim_fees call confirmed after the execute_transfer of the last sale
+def fees_claimed() -> bool:
+    last_sale = max(app_call_rounds(accounts[owners[-1]]['pk'], AppArgs.execute_transfer), default=0)
+    return max(app_call_rounds(accounts['creator']['pk'], AppArgs.claim_fees), default=0) > last_sale
+
+
+def claim_fees():
+    creator = accounts['creator']['pk']
+    creator_account_before = algod_client.account_info(creator).get('amount')
+    print(f'creator account balance before claiming fees: {creator_account_before} microAlgos.')
+    txn_id = creator_claim_fees(algod_client, accounts['creator']['sk'], app_id, creator_claim_args, fee_pooling,
+                                payees)
+    creator_account_after = algod_client.account_info(creator).get('amount')
+    print(f'creator account balance after claiming fees: {creator_account_after} microAlgos.')
+    print(f'total fees claimed: {creator_account_after - creator_account_before} microAlgos')
+    return txn_id
+
+
+# sale n, from owners[n - 1] to owners[n]: each step is done once the nft moved on, or, while the seller still
+# holds it, once the listing (or the payment) is in the local state
+def sale_steps(n: int, depends_on: tuple):
+    seller, buyer = owners[n - 1], owners[n]
+    seller_pk = accounts[seller]['pk']
+    buyer_pk = accounts[buyer]['pk']
+
+    def sold():
+        return holder_position() >= n
+
+    def pending(key: bytes, value: int):
+        return holder_position() == n - 1 and local_value(seller_pk, key) == value
+
+    return [
+        Step(f'setup_sale_{n}',
+             lambda: setup_sale(algod_client, accounts[seller]['sk'], app_id, sale_args, foreign_assets),
+             depends_on=depends_on,
+             is_done=lambda: sold() or pending(b'amount_payment', price)),
+        Step(f'buy_{n}',
+             lambda: buy_asset(algod_client, accounts[buyer]['sk'], seller_pk, app_id, buy_args, foreign_assets,
+                               price),
+             depends_on=(f'setup_sale_{n}',),
+             is_done=lambda: sold() or (pending(b'approve_transfer', 1)
+                                        and local_value(buyer_pk, b'approve_transfer') == 1)),
+        Step(f'execute_transfer_{n}',
+             lambda: buyer_execute_transfer(algod_client, accounts[buyer]['sk'], seller_pk, app_id,
+                                            buyer_execute_args, foreign_assets, fee_pooling),
+             depends_on=(f'buy_{n}',),
+             is_done=sold),
+    ]
+
+
+# what the app and the buyers need for the workflow: opt-ins, the fees they pay and, for buyers, the price
+def funding_plan():
+    planner = MinBalancePlanner()
+    plan_sale_app(planner, app_address, fee_pooling, payees=len(payees))
+    execute_fees = 1 + (InnerTxns.execute_transfer if fee_pooling else 0)
+    for name in ('buyer_1', 'buyer_2'):
+        buyer = accounts[name]['pk']
+        planner.opt_in_asset(buyer, asset_id)
+        planner.opt_in_app(buyer, app_id)
+        planner.pay_fees(buyer, 2 + 2 + execute_fees)  # opt-ins, buy group, execute_transfer
+        planner.spend(buyer, price)
+    planner.pay_fees(accounts['buyer_1']['pk'], 1)  # setup_sale of the second sale
+    return planner
+
+
+def build_steps():
+    # fund the app and whichever buyer is short, from the creator, in one group
+    steps = [Step('fund',
+                  lambda: fund(algod_client, accounts['creator']['sk'], funding_plan().shortfalls(algod_client)),
+                  is_done=lambda: not funding_plan().shortfalls(algod_client))]
+    for name, acct in accounts.items():
+        steps.append(Step(f'opt_in_asset_{name}', lambda acct=acct: opt_in_asset(algod_client, acct['sk'], asset_id),
+                          depends_on=('fund',),
+                          is_done=lambda acct=acct: get_asset_amount(algod_client, acct['pk'], asset_id) is not None))
+        steps.append(Step(f'opt_in_app_{name}', lambda acct=acct: opt_in(algod_client, acct['sk'], app_id),
+                          depends_on=('fund',),
+                          is_done=lambda acct=acct: get_local_state(algod_client, acct['pk'], app_id) is not None))
+    # setting clawback to app
+    steps.append(Step('set_clawback',
+                      lambda: set_clawback(algod_client, accounts['creator']['sk'], asset_id, app_address),
+                      is_done=lambda: algod_client.asset_info(asset_id)['params'].get('clawback') == app_address))
+    setup = tuple(s.name for s in steps)
+    steps += sale_steps(1, setup)
+    steps += sale_steps(2, ('execute_transfer_1',))
+    steps.append(Step('claim_fees', claim_fees, depends_on=('execute_transfer_2',), is_done=fees_claimed))
+    return steps
+
+
+if __name__ == '__main__':
+    results = run_workflow(build_steps(), Journal(journal_path))
+    print('---------------------------------- sales completed ----------------------------------')
+    for name, acct in accounts.items():
+        print(f'{name}:')
+        print_asset_holding(algod_client, acct['pk'], asset_id)
+    print(f'journal: {journal_path}')
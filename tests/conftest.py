@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the tests import the repository packages (asc, helpers, services) the way the scripts do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
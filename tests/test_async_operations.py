@@ -0,0 +1,70 @@
+import asyncio
+
+from algosdk.error import AlgodHTTPError
+
+from helpers.async_operations import AsyncAlgodClient
+
+# the shared block watcher of the async client, with the node's long poll replaced by a script of answers
+
+
+class ScriptedClient(AsyncAlgodClient):
+    def __init__(self, answers: list):
+        super().__init__('', 'http://node.invalid')
+        self.answers = answers  # status dicts, or exceptions to raise
+        self.polls = 0
+
+    async def status_after_block(self, block_num: int) -> dict:
+        self.polls += 1
+        await asyncio.sleep(0.01)
+        answer = self.answers.pop(0) if self.answers else {'last-round': block_num + 1}
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+
+def run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine, timeout=5))
+
+
+def test_waiters_share_one_long_poll():
+    async def main():
+        client = ScriptedClient([{'last-round': 11}])
+        rounds = await asyncio.gather(*(client.wait_for_block_after(10) for _ in range(50)))
+        await client.close()
+        return rounds, client.polls
+
+    rounds, polls = run(main())
+    assert rounds == [11] * 50
+    assert polls <= 2  # the watcher may start the next poll before the waiters have left
+
+
+def test_malformed_status_is_raised_to_every_waiter():
+    async def main():
+        client = ScriptedClient([{'round': 11}])  # no last-round
+        results = await asyncio.gather(*(client.wait_for_block_after(10) for _ in range(3)), return_exceptions=True)
+        # the next wait starts a new watcher
+        after = await client.wait_for_block_after(10)
+        await client.close()
+        return results, after
+
+    results, after = run(main())
+    assert all(isinstance(result, KeyError) for result in results)
+    assert after == 11
+
+
+def test_refused_poll_is_raised_and_throttling_retried():
+    async def main():
+        client = ScriptedClient([AlgodHTTPError('invalid api token', 401)])
+        client.backoff = 0
+        refused = await asyncio.gather(*(client.wait_for_block_after(10) for _ in range(3)), return_exceptions=True)
+        polls = client.polls
+        client.answers = [AlgodHTTPError('too many requests', 429), AlgodHTTPError('node busy', 503),
+                          asyncio.TimeoutError(), {'last-round': 11}]
+        after = await client.wait_for_block_after(10)
+        await client.close()
+        return refused, polls, after, client.polls
+
+    refused, polls, after, total_polls = run(main())
+    assert all(isinstance(result, AlgodHTTPError) and result.code == 401 for result in refused)
+    assert polls == 1  # not retried
+    assert after == 11 and total_polls - polls >= 4  # three retries, then the new block
@@ -0,0 +1,163 @@
+import base64
+
+import msgpack
+import pytest
+from algosdk import account, encoding
+from algosdk.error import AlgodHTTPError
+from algosdk.future import transaction
+from algosdk.logic import get_application_address
+
+import helpers.bulk_listing
+from helpers.bulk_listing import BulkLister, Listing, read_listings
+from helpers.consts import InnerTxns
+from helpers.registry import Deployment, Registry
+
+# the checks bulk listing makes before sending setup_sale calls, against account info shaped like algod's
+
+APP_ID, ASSET_ID, PRICE, MIN_FEE = 77, 10, 2000000, 1000
+
+
+def seller_info(state: dict = None, holds: bool = True, opted_in: bool = True) -> dict:
+    local = [{'id': APP_ID, 'key-value': [{'key': base64.b64encode(k).decode(), 'value': {'type': 2, 'uint': v}}
+                                          for k, v in (state or {}).items()]}]
+    return {'assets': [{'asset-id': ASSET_ID, 'amount': 1 if holds else 0}],
+            'apps-local-state': local if opted_in else []}
+
+
+@pytest.fixture
+def lister(tmp_path):
+    key, seller = account.generate_account()
+    lister = BulkLister(None, {seller: key}, Registry(str(tmp_path / 'registry.db')))
+    lister.clawbacks[ASSET_ID] = get_application_address(APP_ID)
+    lister.seller = seller
+    yield lister
+    lister.registry.close()
+
+
+def problem(lister, info, price=PRICE):
+    return lister.problem(Listing(lister.seller, ASSET_ID, price, APP_ID), info, MIN_FEE)
+
+
+def test_listable(lister):
+    assert problem(lister, seller_info()) is None
+    assert problem(lister, seller_info({b'amount_payment': PRICE - 1, b'approve_transfer': 0})) is None
+
+
+def test_pending_sale_is_skipped(lister):
+    # a buyer has paid: relisting would reset the approval while the payment sits in the app
+    assert problem(lister, seller_info({b'amount_payment': PRICE, b'approve_transfer': 1})) == 'a sale is pending'
+    assert problem(lister, seller_info({b'amount_payment': 5, b'approve_transfer': 1})) == 'a sale is pending'
+
+
+def test_other_problems(lister):
+    assert problem(lister, seller_info({b'amount_payment': PRICE, b'approve_transfer': 0})) == \
+        'already listed at this price'
+    assert problem(lister, seller_info(holds=False)) == 'the seller does not hold the nft'
+    assert problem(lister, seller_info(opted_in=False)) == 'the seller has not opted in to the app'
+    assert problem(lister, seller_info(), price=MIN_FEE) == f'price must be above {2 * MIN_FEE}'
+    lister.clawbacks[ASSET_ID] = None
+    assert problem(lister, seller_info()) == 'the app is not the clawback of the asset'
+
+
+def test_service_cost_follows_the_listed_app(lister):
+    # the latest deployment for the asset pools fees, the listed app does not
+    lister.registry.add_deployment(Deployment(APP_ID, get_application_address(APP_ID), ASSET_ID, 'A'))
+    lister.registry.add_deployment(Deployment(APP_ID + 1, get_application_address(APP_ID + 1), ASSET_ID, 'A',
+                                              fee_pooling=True))
+    price = InnerTxns.execute_transfer * MIN_FEE
+    assert problem(lister, seller_info(), price=price) == f'price must be above {price}'
+    lister.clawbacks[ASSET_ID] = get_application_address(APP_ID + 1)
+    listing = Listing(lister.seller, ASSET_ID, price, APP_ID + 1)
+    assert lister.problem(listing, seller_info() | {'apps-local-state': [{'id': APP_ID + 1}]}, MIN_FEE) is None
+
+
+PARAMS = transaction.SuggestedParams(fee=1000, first=1, last=1000, flat_fee=True, min_fee=MIN_FEE,
+                                     gh='SGO1GKSzyE7IEPItTxCByw9x8FmnrCDexi9/cOUJOiI=')
+
+
+class StubClient:
+    # `confirm` decides whether a sent group confirms; the confirmation wait itself always fails (a timeout)
+    def __init__(self, confirm=lambda group: True, pending_rounds=0):
+        self.confirm = confirm
+        self.pending_rounds = pending_rounds  # rounds a confirming group stays in the pool
+        self.sent = []
+        self.txns = {}  # txid -> pending transaction info
+        self.round = 10
+
+    def send_raw_transaction(self, txn):
+        unpacker = msgpack.Unpacker(raw=False)
+        unpacker.feed(base64.b64decode(txn))
+        self.send_transactions([encoding.future_msgpack_decode(base64.b64encode(msgpack.packb(stxn, use_bin_type=True))
+                                                        .decode()) for stxn in unpacker])
+
+    def send_transactions(self, signed_txns):
+        self.sent.append([stxn.transaction.get_txid() for stxn in signed_txns])
+        confirmed = self.confirm(signed_txns)
+        for stxn in signed_txns:
+            self.txns[stxn.transaction.get_txid()] = {'confirmed-round': self.round + self.pending_rounds} \
+                if confirmed else {'pool-error': 'rejected'}
+
+    def pending_transaction_info(self, txn_id):
+        if txn_id not in self.txns:
+            raise AlgodHTTPError('txn not found', 404)
+        info = self.txns[txn_id]
+        return info if info.get('confirmed-round', 0) <= self.round else {}
+
+    def status(self):
+        return {'last-round': self.round}
+
+    def status_after_block(self, round_num):
+        self.round = round_num
+
+
+@pytest.fixture
+def timeouts(monkeypatch):
+    def wait_for_confirmation(client, txn_id):
+        raise TimeoutError('confirmation wait timed out')
+    monkeypatch.setattr(helpers.bulk_listing, 'wait_for_confirmation', wait_for_confirmation)
+
+
+def listings(lister, count=3):
+    return [Listing(lister.seller, ASSET_ID + i, PRICE, APP_ID) for i in range(count)]
+
+
+@pytest.mark.parametrize('pending_rounds', [0, 2])
+def test_confirmed_group_is_not_resent(lister, timeouts, pending_rounds):
+    lister.client = StubClient(pending_rounds=pending_rounds)
+    results = lister.send_group(listings(lister), PARAMS)
+    assert [r.status for r in results] == ['listed'] * 3
+    assert [r.detail for r in results] == lister.client.sent[0]
+    assert len(lister.client.sent) == 1
+
+
+def test_rejected_group_is_retried_row_by_row(lister, timeouts):
+    bad = ASSET_ID + 1
+    lister.client = StubClient(confirm=lambda group: all(stxn.transaction.foreign_assets != [bad] for stxn in group))
+    results = lister.send_group(listings(lister), PARAMS)
+    assert [r.status for r in results] == ['listed', 'failed', 'listed']
+    assert [len(group) for group in lister.client.sent] == [3, 1, 1, 1]
+
+
+def test_unsent_group_is_retried(lister, timeouts):
+    client = StubClient()
+    sent = client.send_transactions
+
+    def send_transactions(signed_txns):
+        if len(signed_txns) > 1:
+            raise AlgodHTTPError('connection reset', 503)  # the group never reached the node
+        sent(signed_txns)
+    client.send_transactions = send_transactions
+    lister.client = client
+    results = lister.send_group(listings(lister, 2), PARAMS)
+    assert [r.status for r in results] == ['listed', 'listed']
+    assert [len(group) for group in client.sent] == [1, 1]
+
+
+def test_read_listings(tmp_path):
+    csv_path, jsonl_path = tmp_path / 'drop.csv', tmp_path / 'drop.jsonl'
+    csv_path.write_text('seller,asset_id,price,app_id\nA,1,100,\nB,2,200,9\n')
+    jsonl_path.write_text('{"seller": "A", "asset_id": 1, "price": 100}\n\n{"seller": "B", "asset_id": 2, '
+                          '"price": 200, "app_id": 9}\n')
+    expected = [Listing('A', 1, 100), Listing('B', 2, 200, 9)]
+    assert list(read_listings(str(csv_path))) == expected
+    assert list(read_listings(str(jsonl_path))) == expected
@@ -0,0 +1,75 @@
+import threading
+
+import pytest
+from algosdk.error import AlgodHTTPError
+
+from helpers.cassette import Cassette, CassetteMiss, ReplayAlgodClient, describe, record
+from helpers.client_pool import TimeoutAlgodClient
+
+# record a client's traffic against a stub transport, then replay it offline
+
+
+class StubTransport(TimeoutAlgodClient):
+    def __init__(self):
+        super().__init__('', 'http://node.invalid')
+        self.round = 10
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def algod_request(self, method, requrl, params=None, data=None, headers=None, response_format='json'):
+        with self.lock:
+            self.calls += 1
+            if requrl == '/status':
+                self.round += 1
+                return {'last-round': self.round}
+            if requrl == '/transactions' and method == 'POST':
+                return {'txId': 'TX' + data.hex()}
+            if requrl.startswith('/assets/'):
+                raise AlgodHTTPError('asset does not exist', 404)
+            return {'path': requrl, 'params': params or {}}
+
+
+@pytest.fixture
+def recorded(tmp_path):
+    path = str(tmp_path / 'run.cassette')
+    cassette = Cassette(path)
+    client = record(StubTransport(), cassette)
+    responses = [client.status(), client.status(), client.send_raw_transaction('AQI='),
+                 client.account_info('ADDR')]
+    with pytest.raises(AlgodHTTPError):
+        client.asset_info(5)
+    cassette.save()
+    return path, responses
+
+
+def test_replay_answers_in_recorded_order(recorded):
+    path, responses = recorded
+    replay = ReplayAlgodClient(path)
+    assert [replay.status(), replay.status(), replay.send_raw_transaction('AQI='), replay.account_info('ADDR')] \
+        == responses
+    with pytest.raises(AlgodHTTPError) as err:
+        replay.asset_info(5)
+    assert err.value.code == 404
+    # one poll more than recorded gets the last answer again
+    assert replay.status() == responses[1]
+
+
+def test_replay_misses(recorded):
+    path, _ = recorded
+    replay = ReplayAlgodClient(path)
+    with pytest.raises(CassetteMiss):
+        replay.account_info('OTHER')
+    with pytest.raises(CassetteMiss):
+        replay.send_raw_transaction('AwQ=')  # different body
+    replay.send_raw_transaction('AQI=')
+    with pytest.raises(CassetteMiss):
+        replay.send_raw_transaction('AQI=')  # a submission is never repeated
+
+
+def test_describe(recorded):
+    path, _ = recorded
+    summary = describe(path)
+    assert summary['requests'] == 5
+    assert summary['rounds'] == [11, 12]
+    assert summary['endpoints']['GET /status']['count'] == 2
+    assert summary['endpoints']['GET /assets']['errors'] == 1
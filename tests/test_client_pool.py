@@ -0,0 +1,112 @@
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from algosdk.error import AlgodHTTPError
+
+from helpers.client_pool import AlgodClientPool
+
+# the pool against local stub nodes: a node answering with canned json, and one accepting connections without ever
+# answering
+
+
+class StubNode:
+    def __init__(self, routes: dict):
+        self.routes = routes  # (method, path) -> (status, body)
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def answer(self):
+                path = self.path.split('?')[0]
+                stub.requests.append((self.command, path))
+                status, body = stub.routes.get((self.command, path), (404, {'message': 'not found'}))
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = answer
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.address = f'http://127.0.0.1:{self.server.server_port}'
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class HangingNode:
+    def __init__(self):
+        self.socket = socket.socket()
+        self.socket.bind(('127.0.0.1', 0))
+        self.socket.listen(16)  # connections complete in the backlog and are never read from
+        self.address = f'http://127.0.0.1:{self.socket.getsockname()[1]}'
+
+    def close(self):
+        self.socket.close()
+
+
+@pytest.fixture
+def nodes():
+    started = []
+
+    def start(node):
+        started.append(node)
+        return node
+
+    yield start
+    for node in started:
+        node.close()
+
+
+def test_submit_fails_over_from_a_hanging_primary(nodes):
+    primary = nodes(HangingNode())
+    secondary = nodes(StubNode({('POST', '/v2/transactions'): (200, {'txId': 'TXID'})}))
+    pool = AlgodClientPool('', [primary.address, secondary.address], timeout=0.5)
+    start = time.monotonic()
+    assert pool.send_raw_transaction('AAAA') == 'TXID'
+    assert time.monotonic() - start < 5
+    assert not pool.nodes[0].healthy(time.monotonic())
+    pool.close()
+
+
+def test_pending_lookup_asks_the_next_node_on_404(nodes):
+    pending = {'confirmed-round': 7, 'pool-error': ''}
+    primary = nodes(StubNode({}))
+    secondary = nodes(StubNode({('GET', '/v2/transactions/pending/TXID'): (200, pending)}))
+    pool = AlgodClientPool('', [primary.address, secondary.address], timeout=2)
+    assert pool.pending_transaction_info('TXID') == pending
+    assert primary.requests == [('GET', '/v2/transactions/pending/TXID')]
+    # a 404 is an answer: neither node is put in a cooldown
+    assert all(node.healthy(time.monotonic()) for node in pool.nodes)
+    pool.close()
+
+
+def test_pending_lookup_unknown_everywhere_raises_404(nodes):
+    pool = AlgodClientPool('', [nodes(StubNode({})).address, nodes(StubNode({})).address], timeout=2)
+    with pytest.raises(AlgodHTTPError) as err:
+        pool.pending_transaction_info('TXID')
+    assert err.value.code == 404
+    pool.close()
+
+
+def test_other_reads_do_not_retry_a_404(nodes):
+    primary = nodes(StubNode({}))
+    secondary = nodes(StubNode({('GET', '/v2/assets/5'): (200, {'index': 5})}))
+    pool = AlgodClientPool('', [primary.address, secondary.address], timeout=2, failover_after=5)
+    pool.nodes[1].latency = 1.0  # ranked after the primary
+    pool.nodes[0].latency = 0.1
+    with pytest.raises(AlgodHTTPError):
+        pool.asset_info(5)
+    assert secondary.requests == []
+    pool.close()
@@ -0,0 +1,279 @@
+import pytest
+
+from helpers.consts import AppArgs, DefaultValues
+from helpers.evaluator import EvaluationError, evaluate_group, txn
+from services.fuzz_contract import address, build_group, compile_programs, initial_ledger, _init_worker
+
+# regression tests of the approval program against the local evaluator, on the ledger the fuzzer starts from:
+# actor 0 is the creator and holds the nft, actors 1 to 3 are collectors
+
+PRICE = DefaultValues.nft_price
+CREATOR, BUYER, OTHER = 0, 1, 2
+
+
+@pytest.fixture(scope='module', autouse=True)
+def programs():
+    _init_worker(compile_programs())
+
+
+def make_sale(fee_pooling=False, waiting_time=10, split=()):
+    config = {'royalty_fee': DefaultValues.royalty_fee, 'waiting_time': waiting_time, 'fee_pooling': fee_pooling,
+              'split': list(split)}
+    ledger, app_id, asset_id = initial_ledger(config)
+    app_address = ledger.apps[app_id].address
+
+    def run(*op):
+        cursor = ledger.apps[app_id].global_state.get(b'claim_cursor', 0)
+        return evaluate_group(ledger, build_group(op, config, app_id, asset_id, app_address, cursor))
+
+    return ledger, app_id, asset_id, run
+
+
+def paid_sale(**kwargs):
+    ledger, app_id, asset_id, run = make_sale(**kwargs)
+    run('setup_sale', CREATOR, PRICE)
+    run('buy', BUYER, CREATOR, PRICE)
+    return ledger, app_id, asset_id, run
+
+
+def local(ledger, actor, app_id):
+    return ledger.accounts[address(actor)].local[app_id]
+
+
+def test_buyer_executes_transfer():
+    ledger, app_id, asset_id, run = paid_sale()
+    run('execute_transfer', BUYER, CREATOR)
+    assert ledger.accounts[address(BUYER)].assets[asset_id] == 1
+    assert b'approve_transfer' not in local(ledger, BUYER, app_id)
+
+
+@pytest.mark.parametrize('fee_pooling', [False, True])
+def test_seller_only_execute_is_rejected(fee_pooling):
+    # the seller calling execute_transfer without naming the buyer would be its own buyer, paid out of the escrow
+    ledger, app_id, asset_id, run = paid_sale(fee_pooling=fee_pooling)
+    ledger.round += 100
+    seller_balance = ledger.accounts[address(CREATOR)].amount
+    with pytest.raises(EvaluationError):
+        run('execute_transfer', CREATOR, CREATOR)
+    assert ledger.accounts[address(CREATOR)].amount == seller_balance
+    assert local(ledger, CREATOR, app_id)[b'approve_transfer'] == 1
+    # the buyer can still get a refund
+    run('refund', BUYER, CREATOR)
+    assert b'approve_transfer' not in local(ledger, BUYER, app_id)
+
+
+def test_seller_forces_transfer_to_the_buyer_after_waiting_time():
+    ledger, app_id, asset_id, run = paid_sale()
+    with pytest.raises(EvaluationError):
+        run('force_transfer', CREATOR, CREATOR, BUYER)
+    ledger.round += 100
+    run('force_transfer', CREATOR, CREATOR, BUYER)
+    assert ledger.accounts[address(BUYER)].assets[asset_id] == 1
+    assert ledger.accounts[address(CREATOR)].assets[asset_id] == 0
+    assert b'approve_transfer' not in local(ledger, BUYER, app_id)
+
+
+def test_force_transfer_requires_the_paying_buyer():
+    ledger, app_id, asset_id, run = paid_sale()
+    ledger.round += 100
+    # a buyer that did not pay, and a third party forcing the sale, are both rejected
+    with pytest.raises(EvaluationError):
+        run('force_transfer', CREATOR, CREATOR, OTHER)
+    with pytest.raises(EvaluationError):
+        run('force_transfer', OTHER, CREATOR, BUYER)
+    with pytest.raises(EvaluationError):
+        run('execute_transfer', OTHER, CREATOR)
+    assert ledger.accounts[address(CREATOR)].assets[asset_id] == 1
+
+
+def test_execute_transfer_cannot_name_the_seller_as_buyer():
+    ledger, app_id, asset_id, run = paid_sale()
+    ledger.round += 100
+    with pytest.raises(EvaluationError):
+        run('force_transfer', CREATOR, CREATOR, CREATOR)
+    with pytest.raises(EvaluationError):
+        evaluate_group(ledger, [txn('appl', Sender=address(BUYER), ApplicationID=app_id, Assets=[asset_id],
+                                    Accounts=[address(CREATOR), address(CREATOR)],
+                                    ApplicationArgs=[AppArgs.execute_transfer])])
+
+
+def sold_twice(**kwargs):
+    # creator -> buyer -> other: the resale collects royalty fees
+    ledger, app_id, asset_id, run = paid_sale(**kwargs)
+    run('execute_transfer', BUYER, CREATOR)
+    run('setup_sale', BUYER, PRICE)
+    run('buy', OTHER, BUYER, PRICE)
+    run('execute_transfer', OTHER, BUYER)
+    return ledger, app_id, asset_id, run
+
+
+@pytest.mark.parametrize('fee_pooling', [False, True])
+def test_claim_fees_pays_the_royalty_split(fee_pooling):
+    split = [(3, 6000), (OTHER, 4000)]
+    ledger, app_id, asset_id, run = sold_twice(fee_pooling=fee_pooling, split=split)
+    fees = ledger.apps[app_id].global_state[b'collected_fees']
+    assert fees > 0
+    before = {actor: ledger.accounts[address(actor)].amount for actor, _ in split}
+    run('claim_fees', CREATOR, None)
+    paid = {actor: ledger.accounts[address(actor)].amount - before[actor] for actor, _ in split}
+    assert paid == {3: fees * 6000 // 10000, OTHER: fees - fees * 6000 // 10000}
+    assert ledger.apps[app_id].global_state[b'collected_fees'] == 0
+
+
+# eight payees, more than the foreign accounts of one call: actors repeat, so each actor's expected pay is summed
+EIGHT_PAYEES = [(1, 2000), (2, 1500), (3, 1500), (1, 1000), (2, 1000), (3, 1000), (CREATOR, 1000), (3, 1000)]
+
+
+def split_pay(fees: int, split: list) -> dict:
+    pay = {}
+    for i, (actor, share) in enumerate(split):
+        amount = fees - sum(fees * s // 10000 for _, s in split[:-1]) if i == len(split) - 1 else fees * share // 10000
+        pay[actor] = pay.get(actor, 0) + amount
+    return pay
+
+
+def balances(ledger):
+    return {actor: ledger.accounts[address(actor)].amount for actor in range(4)}
+
+
+@pytest.mark.parametrize('fee_pooling', [False, True])
+def test_claim_fees_pays_eight_payees_in_one_group(fee_pooling):
+    ledger, app_id, asset_id, run = sold_twice(fee_pooling=fee_pooling, split=EIGHT_PAYEES)
+    state = ledger.apps[app_id].global_state
+    fees = state[b'collected_fees']
+    before = balances(ledger)
+    result = run('claim_fees', CREATOR, None)  # two calls, paying four payees each
+    assert result.inner_txns == 8
+    after = balances(ledger)
+    fee = 1000 * (1 + 4) if fee_pooling else 1000
+    expected = split_pay(fees, EIGHT_PAYEES)
+    expected[CREATOR] -= 2 * fee
+    assert {actor: after[actor] - before[actor] for actor in expected} == expected
+    assert (state[b'collected_fees'], state[b'claim_cursor'], state[b'claim_paid']) == (0, 0, fees)
+
+
+def test_claim_fees_pages_resume_from_the_cursor():
+    ledger, app_id, asset_id, run = sold_twice(split=EIGHT_PAYEES)
+    fees = ledger.apps[app_id].global_state[b'collected_fees']
+    before = balances(ledger)
+    run('claim_fees', CREATOR, 3)
+    state = ledger.apps[app_id].global_state
+    assert (state[b'collected_fees'], state[b'claim_cursor'], state[b'claim_amount']) == (0, 3, fees)
+    with pytest.raises(EvaluationError):
+        run('claim_fees', BUYER, 4)  # only the creator claims
+    run('claim_fees', CREATOR, 4)
+    assert ledger.apps[app_id].global_state[b'claim_cursor'] == 7
+    run('claim_fees', CREATOR, 4)  # one payee left
+    state = ledger.apps[app_id].global_state
+    assert (state[b'claim_cursor'], state[b'claim_paid']) == (0, fees)
+    after = balances(ledger)
+    assert sum(after[actor] - before[actor] for actor in after) == fees - 3 * 1000
+    # the next claim starts over and needs new fees
+    with pytest.raises(EvaluationError):
+        run('claim_fees', CREATOR, None)
+
+
+def test_split_of_more_than_max_payees_is_rejected():
+    with pytest.raises(EvaluationError):
+        make_sale(split=EIGHT_PAYEES + [(1, 0)])
+    with pytest.raises(EvaluationError):
+        make_sale(split=[(1, 5000), (2, 4000)])  # not adding up to 100%
+
+
+def test_claim_fees_without_the_payee_accounts_is_rejected():
+    ledger, app_id, asset_id, run = sold_twice(split=[(3, 6000), (OTHER, 4000)])
+    with pytest.raises(EvaluationError):
+        evaluate_group(ledger, [txn('appl', Sender=address(CREATOR), ApplicationID=app_id,
+                                    ApplicationArgs=[AppArgs.claim_fees])])
+    assert ledger.apps[app_id].global_state[b'collected_fees'] > 0
+
+
+def test_relisting_during_a_paid_sale_is_rejected():
+    ledger, app_id, asset_id, run = paid_sale()
+    with pytest.raises(EvaluationError):
+        run('setup_sale', CREATOR, PRICE + 1)
+    with pytest.raises(EvaluationError):
+        run('setup_sales', CREATOR, PRICE + 1, PRICE + 2)
+    assert local(ledger, CREATOR, app_id)[b'approve_transfer'] == 1
+    # once refunded the seller can list again
+    run('refund', BUYER, CREATOR)
+    run('setup_sale', CREATOR, PRICE + 1)
+
+
+def test_buying_an_unlisted_nft_is_rejected():
+    ledger, app_id, asset_id, run = make_sale()
+    with pytest.raises(EvaluationError):
+        run('buy', BUYER, CREATOR, 0)
+    assert b'approve_transfer' not in local(ledger, CREATOR, app_id)
+
+
+def app_balance(ledger, app_id):
+    return ledger.accounts[ledger.apps[app_id].address].amount
+
+
+@pytest.mark.parametrize('fee_pooling', [False, True])
+def test_buy_now_settles_the_sale_at_once(fee_pooling):
+    ledger, app_id, asset_id, run = make_sale(fee_pooling=fee_pooling)
+    run('setup_sale', CREATOR, PRICE)
+    before, app_before = balances(ledger), app_balance(ledger, app_id)
+    result = run('buy_now', BUYER, CREATOR, PRICE)
+    assert result.inner_txns == 2  # the nft transfer and the payout
+    assert ledger.accounts[address(BUYER)].assets[asset_id] == 1
+    after = balances(ledger)
+    service_cost, call_fee = (0, 3000) if fee_pooling else (2000, 1000)
+    fees = ledger.apps[app_id].global_state[b'collected_fees']
+    assert before[BUYER] - after[BUYER] == PRICE + 1000 + call_fee
+    assert after[CREATOR] - before[CREATOR] == PRICE - service_cost - fees
+    assert app_balance(ledger, app_id) - app_before == fees  # nothing else stays in the app
+    assert b'amount_payment' not in local(ledger, CREATOR, app_id)
+    assert b'approve_transfer' not in local(ledger, CREATOR, app_id)
+
+
+@pytest.mark.parametrize('fee_pooling', [False, True])
+def test_buy_now_resale_collects_royalty(fee_pooling):
+    ledger, app_id, asset_id, run = make_sale(fee_pooling=fee_pooling)
+    run('setup_sale', CREATOR, PRICE)
+    run('buy_now', BUYER, CREATOR, PRICE)
+    run('setup_sale', BUYER, PRICE)
+    fees_before = ledger.apps[app_id].global_state[b'collected_fees']
+    before = balances(ledger)
+    run('buy_now', OTHER, BUYER, PRICE)
+    assert ledger.accounts[address(OTHER)].assets[asset_id] == 1
+    service_cost = 0 if fee_pooling else 2000
+    royalty = (PRICE - service_cost) * DefaultValues.royalty_fee // 1000
+    assert ledger.apps[app_id].global_state[b'collected_fees'] - fees_before == royalty
+    assert balances(ledger)[BUYER] - before[BUYER] == PRICE - service_cost - royalty
+
+
+def test_buy_now_of_an_unlisted_nft_is_rejected():
+    ledger, app_id, asset_id, run = make_sale()
+    before = balances(ledger)
+    with pytest.raises(EvaluationError):
+        run('buy_now', BUYER, CREATOR, PRICE)
+    with pytest.raises(EvaluationError):
+        run('buy_now', BUYER, CREATOR, 0)
+    assert balances(ledger) == before
+    assert ledger.accounts[address(CREATOR)].assets[asset_id] == 1
+
+
+def test_buy_now_during_a_paid_sale_is_rejected():
+    ledger, app_id, asset_id, run = paid_sale()
+    before = balances(ledger)
+    with pytest.raises(EvaluationError):
+        run('buy_now', OTHER, CREATOR, PRICE)
+    assert balances(ledger) == before
+    # the paying buyer still gets the nft
+    run('execute_transfer', BUYER, CREATOR)
+    assert ledger.accounts[address(BUYER)].assets[asset_id] == 1
+
+
+def test_second_buy_now_of_a_listing_is_rejected():
+    ledger, app_id, asset_id, run = make_sale()
+    run('setup_sale', CREATOR, PRICE)
+    run('buy_now', BUYER, CREATOR, PRICE)
+    before = balances(ledger)
+    for price in (PRICE, 0):
+        with pytest.raises(EvaluationError):
+            run('buy_now', OTHER, CREATOR, price)
+    assert balances(ledger) == before
+    assert ledger.accounts[address(BUYER)].assets[asset_id] == 1
@@ -0,0 +1,157 @@
+import base64
+import json
+import os
+import stat
+import threading
+from http.client import HTTPConnection
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from helpers.order_book import OrderBook
+from helpers.registry import Deployment, Registry
+import services.daemon
+from services.daemon import Daemon, UnixHTTPServer, make_handler
+
+# the daemon's http front: authentication, content type and dispatching, with a daemon holding no keys and a stub
+# algod client (refused requests must never reach an operation)
+
+TOKEN = 'test-token'
+
+
+class StubClient:
+    def suggested_params(self):
+        raise AssertionError('no operation should run')
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    daemon = Daemon(client=StubClient(), keys={}, registry=Registry(str(tmp_path / 'registry.db')), workers=2)
+    calls = []
+    daemon.operations['buy'] = lambda req: calls.append(req) or {'ok': True}
+    daemon.calls = calls
+    yield daemon
+    daemon.close()
+
+
+@pytest.fixture
+def server(daemon):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(daemon, TOKEN))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def post(server, path, body, headers):
+    connection = HTTPConnection('127.0.0.1', server.server_port, timeout=5)
+    connection.request('POST', path, body=body, headers=headers)
+    response = connection.getresponse()
+    return response.status, json.loads(response.read())
+
+
+def test_post_without_token_is_refused(server, daemon):
+    status, body = post(server, '/buy', '{"asset_id": 1}', {'Content-Type': 'application/json'})
+    assert status == 401
+    status, _ = post(server, '/buy', '{"asset_id": 1}', {'Content-Type': 'application/json',
+                                                        'X-Daemon-Token': 'wrong'})
+    assert status == 401
+    assert daemon.calls == []
+
+
+def test_simple_cross_origin_post_is_refused(server, daemon):
+    # what a web page can send without a preflight: text/plain, even with a guessed token
+    status, _ = post(server, '/buy', '{"asset_id": 1}', {'Content-Type': 'text/plain', 'X-Daemon-Token': TOKEN})
+    assert status == 415
+    status, _ = post(server, '/batch', '[{"op": "buy"}]', {'X-Daemon-Token': TOKEN})
+    assert status == 415
+    assert daemon.calls == []
+
+
+def test_authorized_json_post_is_dispatched(server, daemon):
+    status, body = post(server, '/buy', '{"asset_id": 1}', {'Content-Type': 'application/json; charset=utf-8',
+                                                           'X-Daemon-Token': TOKEN})
+    assert (status, body) == (200, {'ok': True})
+    assert daemon.calls == [{'asset_id': 1}]
+
+
+def test_health_requires_the_token(server):
+    connection = HTTPConnection('127.0.0.1', server.server_port, timeout=5)
+    connection.request('GET', '/health')
+    assert connection.getresponse().status == 401
+    connection = HTTPConnection('127.0.0.1', server.server_port, timeout=5)
+    connection.request('GET', '/health', headers={'X-Daemon-Token': TOKEN})
+    response = connection.getresponse()
+    assert response.status == 200
+    assert json.loads(response.read())['keys'] == {}
+
+
+def test_unix_socket_is_private(daemon, tmp_path):
+    path = str(tmp_path / 'daemon.sock')
+    server = UnixHTTPServer(path, make_handler(daemon, TOKEN))
+    try:
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    finally:
+        server.server_close()
+
+
+def test_buy_now_uses_the_fee_pooling_of_the_deployment(daemon, monkeypatch):
+    calls = []
+    monkeypatch.setattr(services.daemon, 'buy_now', lambda *args, **kwargs: calls.append((args, kwargs)) or
+                        ('app-txn', 'pay-txn'))
+    daemon.keys = {'buyer_1': 'buyer-key', 'seller': 'seller-key'}
+    daemon.address = lambda value: f'address of {value}'
+    daemon.registry.add_deployment(Deployment(100, 'ADDR100', 5, 'A', fee_pooling=True))
+    status, body = daemon.handle('buy_now', {'asset_id': 5, 'seller': 'seller', 'price': 2000})
+    assert (status, body) == (200, {'app_txn_id': 'app-txn', 'pay_txn_id': 'pay-txn'})
+    args, kwargs = calls[0]
+    assert args[1:] == ('buyer-key', 'address of seller', 100, 5, 2000, True)
+    assert kwargs == {'preflight': False}
+
+
+class StubIndexer:
+    # app 100 of asset 5: seller A listed, seller B was paid; later round 60 lists C
+    def __init__(self):
+        self.local = {'A': {b'amount_payment': 3000, b'approve_transfer': 0},
+                      'B': {b'amount_payment': 1000, b'approve_transfer': 1}}
+        self.calls = []
+
+    def key_values(self, state):
+        return [{'key': base64.b64encode(k).decode(), 'value': {'type': 2, 'uint': v}} for k, v in state.items()]
+
+    def applications(self, app_id):
+        return {'current-round': 50,
+                'application': {'params': {'global-state': self.key_values({b'asset_id': 5})}}}
+
+    def accounts(self, application_id=None, next_page=None):
+        self.calls.append('accounts')
+        return {'accounts': [{'address': seller, 'apps-local-state': [{'id': 100, 'key-value': self.key_values(state)}]}
+                             for seller, state in self.local.items()]}
+
+    def search_transactions(self, application_id=None, min_round=0, **kwargs):
+        self.calls.append(f'search from {min_round}')
+        return {'current-round': 60, 'transactions': [{'sender': 'C'}] if 'C' in self.local else []}
+
+    def account_info(self, address):
+        local = [{'id': 100, 'key-value': self.key_values(self.local[address])}] if address in self.local else []
+        return {'account': {'apps-local-state': local}}
+
+
+def test_listings_are_served_from_the_order_book(daemon, tmp_path, monkeypatch):
+    indexer = StubIndexer()
+    daemon.indexer, daemon.book_path = indexer, str(tmp_path / 'book.json')
+    daemon.registry.add_deployment(Deployment(100, 'ADDR100', 5, 'A'))
+    status, body = daemon.handle('listings', {})
+    assert (status, body) == (200, {'round': 50, 'listings': [
+        {'app_id': 100, 'seller': 'A', 'asset_id': 5, 'price': 3000}]})
+    assert indexer.calls == ['accounts']  # no snapshot: a full scan
+    # within BOOK_TTL the book answers from memory
+    indexer.local['C'] = {b'amount_payment': 2000, b'approve_transfer': 0}
+    assert daemon.handle('listings', {'max_price': 5000})[1]['listings'][0]['seller'] == 'A'
+    assert indexer.calls == ['accounts']
+    monkeypatch.setattr(services.daemon, 'BOOK_TTL', 0)
+    status, body = daemon.handle('listings', {'asset_id': 5, 'limit': 1})
+    assert [listing['seller'] for listing in body['listings']] == ['C']
+    assert indexer.calls == ['accounts', 'search from 51'] and body['round'] == 60
+    daemon.close()
+    assert OrderBook.load(daemon.book_path).round == 60
@@ -0,0 +1,121 @@
+import base64
+import json
+import os
+from collections import Counter
+
+import algosdk
+import pytest
+import pyteal
+from algosdk import account, encoding, logic
+
+from asc.asset_sale_contract import TEAL_VERSION, asset_sale_contract
+from helpers.escrow_template import compile_template, listing_signature
+
+# a listing escrow signed from the template must be the program asset_sale_contract() compiles for that listing.
+# there is no node here, so programs are assembled by StubAlgod: the opcodes of algosdk's langspec, and int and byte
+# constants gathered in intcblock/bytecblock, shared when repeated and ordered by use, as algod's assembler does
+
+pytestmark = pytest.mark.skipif(pyteal.MAX_TEAL_VERSION < TEAL_VERSION,
+                                reason=f'the installed pyteal does not compile teal version {TEAL_VERSION}')
+
+with open(os.path.join(os.path.dirname(algosdk.__file__), 'data', 'langspec.json')) as f:
+    OPS = {op['Name']: op for op in json.load(f)['Ops']}
+GLOBAL_FIELDS = ['MinTxnFee', 'MinBalance', 'MaxTxnLife', 'ZeroAddress', 'GroupSize']
+NAMED_INTS = {'pay': 1, 'keyreg': 2, 'acfg': 3, 'axfer': 4, 'afrz': 5, 'appl': 6}
+
+
+def varuint(n: int) -> bytes:
+    out = bytearray()
+    while n >= 0x80:
+        out.append(n & 0x7f | 0x80)
+        n >>= 7
+    return bytes(out + bytes([n]))
+
+
+def constant_block(name: str, values: list, encode) -> tuple:
+    ordered = [value for value, _ in Counter(values).most_common()]
+    block = bytes([OPS[name]['Opcode']]) + varuint(len(ordered)) + b''.join(encode(v) for v in ordered)
+    return block if ordered else b'', {value: index for index, value in enumerate(ordered)}
+
+
+def constant_ref(name: str, index: int) -> bytes:
+    return bytes([OPS[f'{name}_{index}']['Opcode']]) if index < 4 else bytes([OPS[name]['Opcode'], index])
+
+
+def assemble(teal: str) -> bytes:
+    lines = [line.split() for line in teal.splitlines() if line.strip() and not line.startswith('#')]
+    ints = [int(NAMED_INTS.get(args[0], args[0])) for op, *args in lines if op == 'int']
+    byte_values = [encoding.decode_address(args[0]) if op == 'addr' else bytes.fromhex(args[0][2:])
+                   for op, *args in lines if op in ('addr', 'byte')]
+    intcblock, int_index = constant_block('intcblock', ints, varuint)
+    bytecblock, byte_index = constant_block('bytecblock', byte_values, lambda v: varuint(len(v)) + v)
+    header = varuint(int(teal.split()[2])) + intcblock + bytecblock
+
+    def encode(op, args, labels, at):
+        if op == 'int':
+            return constant_ref('intc', int_index[int(NAMED_INTS.get(args[0], args[0]))])
+        if op in ('addr', 'byte'):
+            value = encoding.decode_address(args[0]) if op == 'addr' else bytes.fromhex(args[0][2:])
+            return constant_ref('bytec', byte_index[value])
+        code = bytes([OPS[op]['Opcode']])
+        if op in ('b', 'bz', 'bnz'):
+            return code + (labels.get(args[0], at + 3) - at - 3).to_bytes(2, 'big', signed=True)
+        if op == 'global':
+            return code + bytes([GLOBAL_FIELDS.index(args[0])])
+        if op == 'txn':
+            return code + bytes([OPS['txn']['ArgEnum'].index(args[0])])
+        if op == 'gtxn':
+            return code + bytes([int(args[0]), OPS['gtxn']['ArgEnum'].index(args[1])])
+        return code
+
+    labels = {}
+    for _ in range(2):  # the second pass resolves the labels found by the first
+        program = bytearray(header)
+        for op, *args in lines:
+            if op.endswith(':'):
+                labels[op[:-1]] = len(program)
+            else:
+                program += encode(op, args, labels, len(program))
+    return bytes(program)
+
+
+class StubAlgod:
+    def __init__(self):
+        self.compiled = 0
+
+    def compile(self, teal: str) -> dict:
+        self.compiled += 1
+        program = assemble(teal)
+        return {'result': base64.b64encode(program).decode(), 'hash': logic.address(program)}
+
+
+@pytest.fixture
+def template():
+    return compile_template(StubAlgod())
+
+
+@pytest.mark.parametrize('asset_index, price', [(78961298, 1000000), (1, 7000), (2 ** 63, 10 ** 15)])
+def test_template_matches_the_listing_compile(template, asset_index, price):
+    seller = account.generate_account()[1]
+    signature = template.signature(seller, asset_index, price)
+    teal = asset_sale_contract(seller, asset_index, price)
+    compiled = StubAlgod().compile(teal)
+    assert signature.teal == teal
+    assert (signature.address, signature.bytecode_b64) == (compiled['hash'], compiled['result'])
+
+
+def test_listing_values_repeating_a_constant_are_compiled(template, tmp_path):
+    seller = account.generate_account()[1]
+    # price 0: every share is 0, so the assembler would share one constant between them
+    assert not template.fits(seller, 5, 0)
+    with pytest.raises(ValueError):
+        template.program(seller, 5, 0)
+    path = str(tmp_path / 'template.json')
+    template.save(path)
+    client = StubAlgod()
+    signature = listing_signature(seller, 5, 0, client, path)
+    assert client.compiled == 1  # the cached template was reused, the listing compiled
+    assert signature.address == StubAlgod().compile(asset_sale_contract(seller, 5, 0))['hash']
+    assert listing_signature(seller, 5, 1000000, client, path).address == \
+        template.signature(seller, 5, 1000000).address
+    assert client.compiled == 1
@@ -0,0 +1,187 @@
+import pytest
+from algosdk.encoding import encode_address
+
+from helpers.evaluator import (Ledger, Program, EvaluationError, evaluate_group, txn, MAX_UINT64, MIN_TXN_FEE,
+                               ON_COMPLETIONS, TYPE_ENUMS)
+
+# the local evaluator every contract test and the fuzzer rely on, checked opcode by opcode on small programs
+
+ALICE, BOB, CAROL = b'\x01' * 32, b'\x02' * 32, b'\x03' * 32
+
+
+# creates an app running `body` (creation itself always approves), returns (ledger, app id)
+def create_app(body: str, fund_app=0):
+    ledger = Ledger()
+    ledger.account(ALICE).amount = ledger.account(BOB).amount = 10 ** 9
+    program = Program('#pragma version 5\ntxn ApplicationID\nbz create\n' + body + '\ncreate:\nint 1\nreturn')
+    evaluate_group(ledger, [txn('appl', Sender=ALICE, ApplicationID=0)], program)
+    app_id = max(ledger.apps)
+    if fund_app:
+        ledger.account(ledger.apps[app_id].address).amount = fund_app
+    return ledger, app_id
+
+
+# creates an app running `body` and evaluates `group` (a plain call by default) against it
+def run_program(body: str, group=None, fund_app=0):
+    ledger, app_id = create_app(body, fund_app)
+    group = group or [txn('appl', Sender=ALICE)]
+    for t in group:
+        if t['TypeEnum'] == TYPE_ENUMS['appl']:
+            t['ApplicationID'] = app_id
+    return ledger, app_id, evaluate_group(ledger, group)
+
+
+# runs `body`, which must leave the expected value on the stack, and returns whether it approved
+def approves(body: str) -> bool:
+    try:
+        run_program(body + '\nreturn')
+    except EvaluationError:
+        return False
+    return True
+
+
+@pytest.mark.parametrize('a, b', [(0, 0), (3, 7), (MAX_UINT64, MAX_UINT64), (2 ** 32, 2 ** 33), (MAX_UINT64, 2)])
+def test_mulw(a, b):
+    high, low = (a * b) >> 64, (a * b) & MAX_UINT64
+    assert approves(f'int {a}\nint {b}\nmulw\nint {low}\n==\nassert\nint {high}\n==')
+
+
+@pytest.mark.parametrize('n, d', [(10, 3), (MAX_UINT64 * MAX_UINT64, 1000), (2 ** 127 + 5, 2 ** 64 + 1), (7, 9)])
+def test_divmodw(n, d):
+    q, r = divmod(n, d)
+    words = [n >> 64, n & MAX_UINT64, d >> 64, d & MAX_UINT64]
+    expected = [q >> 64, q & MAX_UINT64, r >> 64, r & MAX_UINT64]
+    checks = '\n'.join(f'int {value}\n==\nassert' for value in reversed(expected[1:]))
+    assert approves('\n'.join(f'int {w}' for w in words) + f'\ndivmodw\n{checks}\nint {expected[0]}\n==')
+
+
+def test_divmodw_by_zero_fails():
+    assert not approves('int 1\nint 1\nint 0\nint 0\ndivmodw\npop\npop\npop')
+
+
+@pytest.mark.parametrize('body, ok', [
+    (f'int {MAX_UINT64}\nint 1\n+', False),
+    ('int 0\nint 1\n-', False),
+    (f'int {2 ** 32}\nint {2 ** 32}\n*', False),
+    ('int 1\nint 0\n/', False),
+    ('int 7\nint 2\n%\nint 1\n==', True),
+    ('int 5\nitob\nbtoi\nint 5\n==', True),
+    ('byte 0x010203040506070809\nbtoi', False),
+    ('int 1\nbyte "a"\n==', False),
+    ('int 1\nint 2\n<\nint 0\n||', True),
+    ('byte "abc"\nlen\nint 3\n==', True),
+])
+def test_arithmetic_and_types(body, ok):
+    assert approves(body) == ok
+
+
+def test_subroutines_and_branches():
+    assert approves('int 4\ncallsub double\nint 8\n==\nb end\ndouble:\ndup\n+\nretsub\nend:')
+
+
+def test_group_access():
+    body = ('gtxn 1 Amount\nint 5\n==\nassert\nint 1\ngtxns Receiver\nglobal CurrentApplicationAddress\n==\nassert\n'
+            'txn GroupIndex\nint 0\n==\nassert\nglobal GroupSize\nint 2\n==\nassert\n'
+            'txna ApplicationArgs 0\nbyte "go"\n==\nassert\n'
+            f'gtxna 0 Accounts 1\naddr {encode_address(BOB)}\n==\nreturn')
+    ledger, app_id = create_app(body, fund_app=10 ** 6)
+    app_address = ledger.apps[app_id].address
+    for amount, ok in ((5, True), (6, False)):
+        group = [txn('appl', Sender=ALICE, ApplicationID=app_id, ApplicationArgs=[b'go'], Accounts=[BOB]),
+                 txn('pay', Sender=BOB, Receiver=app_address, Amount=amount)]
+        if ok:
+            evaluate_group(ledger, group)
+        else:
+            with pytest.raises(EvaluationError, match='assert failed'):
+                evaluate_group(ledger, group)
+    assert ledger.accounts[app_address].amount == 10 ** 6 + 5
+
+
+def test_gtxns_out_of_range():
+    assert not approves('int 3\ngtxns Amount\npop\nint 1')
+
+
+def test_global_and_local_state():
+    body = ('byte "n"\nbyte "n"\napp_global_get\nint 1\n+\napp_global_put\n'
+            'int 0\nbyte "k"\nint 7\napp_local_put\nint 0\nbyte "k"\napp_local_get\nint 7\n==')
+    ledger, app_id, _ = run_program(body + '\nreturn', [txn('appl', Sender=ALICE,
+                                                            OnCompletion=ON_COMPLETIONS['OptIn'])])
+    evaluate_group(ledger, [txn('appl', Sender=ALICE, ApplicationID=app_id)])
+    assert ledger.apps[app_id].global_state[b'n'] == 2
+    assert ledger.accounts[ALICE].local[app_id] == {b'k': 7}
+    # an account that has not opted in has no local state to write
+    with pytest.raises(EvaluationError, match='not opted in'):
+        evaluate_group(ledger, [txn('appl', Sender=BOB, ApplicationID=app_id)])
+
+
+PAY_BOB = ('itxn_begin\nint pay\nitxn_field TypeEnum\nint 1000\nitxn_field Amount\ntxna Accounts 1\n'
+           'itxn_field Receiver\nint {fee}\nitxn_field Fee\nitxn_submit\nint 1\nreturn')
+
+
+def test_inner_payment():
+    group = [txn('appl', Sender=ALICE, Accounts=[BOB])]
+    ledger, app_id, result = run_program(PAY_BOB.format(fee=MIN_TXN_FEE), group, fund_app=10 ** 6)
+    assert ledger.accounts[BOB].amount == 10 ** 9 + 1000
+    assert ledger.accounts[ledger.apps[app_id].address].amount == 10 ** 6 - 1000 - MIN_TXN_FEE
+    assert (result.inner_txns, result.fees) == (1, 2 * MIN_TXN_FEE)
+
+
+def test_inner_receiver_must_be_referenced():
+    body = PAY_BOB.format(fee=MIN_TXN_FEE).replace('txna Accounts 1', f'addr {encode_address(CAROL)}')
+    with pytest.raises(EvaluationError, match='invalid account reference'):
+        run_program(body, [txn('appl', Sender=ALICE, Accounts=[BOB])], fund_app=10 ** 6)
+
+
+@pytest.mark.parametrize('outer_fee, ok', [(2 * MIN_TXN_FEE, True), (MIN_TXN_FEE, False)])
+def test_inner_fee_pooling(outer_fee, ok):
+    group = [txn('appl', Sender=ALICE, Accounts=[BOB], Fee=outer_fee)]
+    if ok:
+        ledger, app_id, _ = run_program(PAY_BOB.format(fee=0), group, fund_app=10 ** 6)
+        assert ledger.accounts[ledger.apps[app_id].address].amount == 10 ** 6 - 1000
+    else:
+        with pytest.raises(EvaluationError, match='fee too small'):
+            run_program(PAY_BOB.format(fee=0), group, fund_app=10 ** 6)
+
+
+def test_inner_clawback_transfer():
+    ledger, app_id = create_app('int 1\nreturn')
+    app_address = ledger.apps[app_id].address
+    asset_id = ledger.create_asset(ALICE, clawback=app_address)
+    ledger.accounts[BOB].assets[asset_id] = 0
+    ledger.account(app_address).amount = 10 ** 6
+    program = Program('#pragma version 5\nitxn_begin\nint axfer\nitxn_field TypeEnum\ntxna Assets 0\n'
+                      'itxn_field XferAsset\nint 1\nitxn_field AssetAmount\ntxna Accounts 1\nitxn_field AssetSender\n'
+                      'txna Accounts 2\nitxn_field AssetReceiver\nitxn_submit\nint 1\nreturn')
+    ledger.apps[app_id].program = program
+    evaluate_group(ledger, [txn('appl', Sender=BOB, ApplicationID=app_id, Accounts=[ALICE, BOB], Assets=[asset_id])])
+    assert (ledger.accounts[ALICE].assets[asset_id], ledger.accounts[BOB].assets[asset_id]) == (0, 1)
+
+
+def test_failed_group_leaves_the_ledger_untouched():
+    ledger, app_id = create_app('int 0\nreturn')
+    before = (ledger.accounts[ALICE].amount, ledger.accounts[BOB].amount, ledger.fee_sink)
+    group = [txn('pay', Sender=ALICE, Receiver=BOB, Amount=10 ** 6), txn('appl', Sender=ALICE, ApplicationID=app_id)]
+    with pytest.raises(EvaluationError) as err:
+        evaluate_group(ledger, group)
+    assert err.value.txn_index == 1
+    assert (ledger.accounts[ALICE].amount, ledger.accounts[BOB].amount, ledger.fee_sink) == before
+
+
+def test_budget_and_minimum_balance():
+    assert not approves('loop:\nint 1\nbnz loop\nint 1')
+    ledger, app_id = create_app('int 1\nreturn')
+    spendable = ledger.accounts[ALICE].amount - MIN_TXN_FEE
+    with pytest.raises(EvaluationError, match='minimum balance'):
+        evaluate_group(ledger, [txn('pay', Sender=ALICE, Receiver=BOB, Amount=spendable - 1)])
+    evaluate_group(ledger, [txn('pay', Sender=ALICE, Receiver=BOB, Amount=spendable, CloseRemainderTo=BOB)])
+    assert ledger.accounts[ALICE].amount == 0
+
+
+@pytest.mark.parametrize('body, ok', [
+    ('byte 0x0102030405\nint 1\nint 3\nextract3\nbyte 0x020304\n==', True),
+    ('byte 0x0102030405\nint 3\nint 3\nextract3\nlen', False),
+    ('byte 0xff0000000000000102\nint 1\nextract_uint64\nint 258\n==', True),
+    ('byte 0x0000000000000102\nint 1\nextract_uint64', False),
+])
+def test_extract(body, ok):
+    assert approves(body) == ok
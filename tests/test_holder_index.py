@@ -0,0 +1,80 @@
+from algosdk import encoding
+
+from helpers.evaluator import Ledger, evaluate_group, txn
+from helpers.holder_index import HolderIndex, LedgerIndexer
+
+# the holder index over an evaluator ledger, through LedgerIndexer
+
+
+def address(n: int) -> bytes:
+    return bytes([n]) * 32
+
+
+def name(n: int) -> str:
+    return encoding.encode_address(address(n))
+
+
+class CountingSource:
+    def __init__(self, source):
+        self.source = source
+        self.searches = []
+
+    def asset_balances(self, *args, **kwargs):
+        return self.source.asset_balances(*args, **kwargs)
+
+    def search_transactions(self, **kwargs):
+        self.searches.append(kwargs)
+        return self.source.search_transactions(**kwargs)
+
+
+def collection():
+    ledger = Ledger()
+    for n in (1, 2, 3):
+        ledger.account(address(n)).amount = 10 ** 9
+    asset_ids = [ledger.create_asset(address(1)) for _ in range(3)]
+    for asset_id in asset_ids:
+        evaluate_group(ledger, [txn('axfer', Sender=address(2), AssetReceiver=address(2), XferAsset=asset_id)])
+    indexer = LedgerIndexer(ledger)
+    return ledger, indexer, asset_ids
+
+
+def transfer(ledger, indexer, asset_id, sender, receiver):
+    ledger.round += 1
+    evaluate_group(ledger, [txn('axfer', Sender=address(sender), AssetReceiver=address(receiver),
+                                XferAsset=asset_id, AssetAmount=1)])
+    indexer.record()
+
+
+def test_build_and_update():
+    ledger, indexer, asset_ids = collection()
+    index = HolderIndex.build(indexer, asset_ids)
+    assert index.holders() == {name(1): asset_ids}
+    transfer(ledger, indexer, asset_ids[1], 1, 2)
+    source = CountingSource(indexer)
+    assert index.update(source) == [asset_ids[1]]
+    assert index.holder(asset_ids[1]) == name(2)
+    assert index.assets_of(name(1)) == [asset_ids[0], asset_ids[2]]
+    # one single-result query per asset of the collection, never an unfiltered scan
+    assert sorted(search['asset_id'] for search in source.searches) == asset_ids
+    assert all(search['limit'] == 1 for search in source.searches)
+    assert index.round == ledger.round
+    assert index.update(indexer) == []
+
+
+def test_transfers_of_other_assets_are_ignored():
+    ledger, indexer, asset_ids = collection()
+    other = ledger.create_asset(address(3))
+    evaluate_group(ledger, [txn('axfer', Sender=address(2), AssetReceiver=address(2), XferAsset=other)])
+    index = HolderIndex.build(indexer, asset_ids)
+    transfer(ledger, indexer, other, 3, 2)
+    assert index.update(indexer) == []
+
+
+def test_save_and_load(tmp_path):
+    ledger, indexer, asset_ids = collection()
+    index = HolderIndex.build(indexer, asset_ids)
+    transfer(ledger, indexer, asset_ids[0], 1, 2)
+    index.update(indexer)
+    index.save(str(tmp_path / 'holders.idx'))
+    loaded = HolderIndex.load(str(tmp_path / 'holders.idx'))
+    assert loaded.holders() == index.holders() and loaded.round == index.round
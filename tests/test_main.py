@@ -0,0 +1,86 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+# the command line entry point, run as a script
+
+MAIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'main.py')
+
+
+def run_main(*args, env=None):
+    environ = {k: v for k, v in os.environ.items() if not k.endswith('_MNEMONIC')}
+    environ.update(env or {})
+    return subprocess.run([sys.executable, MAIN, *args], capture_output=True, text=True, env=environ, timeout=60)
+
+
+@pytest.mark.parametrize('args', [['mint'], ['deploy', '--asset-id', '1'], ['mint', '--key', 'ARTIST_MNEMONIC']])
+def test_unset_key_is_a_clear_error(args):
+    result = run_main(*args)
+    assert result.returncode == 1
+    key = args[args.index('--key') + 1] if '--key' in args else 'CREATOR_MNEMONIC'
+    assert result.stderr.strip() == f'{key} is not set'
+
+
+def test_help_lists_the_commands():
+    result = run_main('--help')
+    assert result.returncode == 0
+    for command in ('deploy', 'mint', 'bulk-list', 'serve', 'cassette'):
+        assert command in result.stdout
+
+
+# the settings of a .env loaded after the helpers were imported (as main.py does) still reach the clients
+def test_env_file_settings_reach_the_client(tmp_path, monkeypatch):
+    from dotenv import load_dotenv
+    from helpers.registry import Registry
+    from helpers.utils import get_algod_client
+
+    for name in ('ALGOD_ENDPOINT', 'ALGOD_ENDPOINTS', 'ALGOD_TOKEN', 'ALGOD_CASSETTE', 'REGISTRY_PATH'):
+        monkeypatch.setenv(name, '')  # restored when the test ends
+    env = tmp_path / '.env'
+    env.write_text(f'ALGOD_ENDPOINT=http://127.0.0.1:4001\nALGOD_TOKEN={"a" * 64}\n'
+                   f'REGISTRY_PATH={tmp_path / "registry.db"}\n')
+    load_dotenv(env, override=True)
+    client = get_algod_client()
+    assert client.algod_address == 'http://127.0.0.1:4001'
+    assert client.algod_token == 'a' * 64
+    registry = Registry()
+    assert registry.path == str(tmp_path / 'registry.db')
+    registry.close()
+
+
+# claim finds the app of --asset-id in the registry; the progress of the operation stays off stdout
+def test_claim_resolves_the_app_and_prints_only_json(tmp_path, monkeypatch, capsys):
+    from algosdk import account, mnemonic
+    import helpers.operations
+    import helpers.utils
+    import main
+    from helpers.registry import Deployment, Registry
+
+    monkeypatch.setenv('REGISTRY_PATH', str(tmp_path / 'registry.db'))
+    registry = Registry()
+    registry.add_deployment(Deployment(100, 'ADDR100', 5, 'A'))
+    registry.close()
+    monkeypatch.setenv('CREATOR_MNEMONIC', mnemonic.from_private_key(account.generate_account()[0]))
+    monkeypatch.setattr(main, 'load_env', lambda: None)
+    monkeypatch.setattr(main, 'get_client', lambda: 'client')
+    monkeypatch.setattr(helpers.utils, 'get_royalty_split', lambda client, app_id: [('PAYEE', 10000)])
+    calls = []
+
+    def creator_claim_fees(client, private_key, app_id, app_args, fee_pooling, payees):
+        print('sending claim_fees transaction')
+        calls.append((app_id, payees))
+        return 'claim-txn'
+    monkeypatch.setattr(helpers.operations, 'creator_claim_fees', creator_claim_fees)
+    main.main(['claim', '--asset-id', '5'])
+    out, err = capsys.readouterr()
+    assert json.loads(out) == {'txn_id': 'claim-txn'}
+    assert err == 'sending claim_fees transaction\n'
+    assert calls == [(100, ['PAYEE'])]
+
+
+def test_claim_needs_an_app_or_an_asset():
+    result = run_main('claim')
+    assert result.returncode == 1 and result.stderr.strip() == 'pass --app-id or --asset-id'
@@ -0,0 +1,85 @@
+from helpers.consts import AppSchema, InnerTxns, MinBalance
+from helpers.min_balance import ESCROW_TXNS, MinBalancePlanner, escrow_funding, plan_sale_app, schema_min_balance
+
+# what the planner asks each account to hold, against account info shaped like algod's
+
+LOCAL_SCHEMA = schema_min_balance(AppSchema.local_ints, AppSchema.local_bytes)
+GLOBAL_SCHEMA = schema_min_balance(AppSchema.global_ints, AppSchema.global_bytes)
+
+
+def account_info(min_balance: int, amount: int = 0, assets=(), apps=()) -> dict:
+    return {'min-balance': min_balance, 'amount': amount,
+            'assets': [{'asset-id': asset_id, 'amount': 0} for asset_id in assets],
+            'apps-local-state': [{'id': app_id} for app_id in apps]}
+
+
+class StubClient:
+    def __init__(self, infos: dict):
+        self.infos = infos
+
+    def account_info(self, address):
+        return self.infos[address]
+
+
+def test_new_account_needs_the_account_minimum_and_its_opt_ins():
+    planner = MinBalancePlanner()
+    planner.opt_in_asset('A', 10)
+    planner.opt_in_asset('A', 10)  # planned twice, held once
+    planner.opt_in_app('A', 7)
+    assert planner.required('A') == MinBalance.account + MinBalance.asset_opt_in + MinBalance.app_opt_in + \
+        LOCAL_SCHEMA
+
+
+def test_opt_ins_already_held_are_not_counted_again():
+    planner = MinBalancePlanner()
+    planner.opt_in_asset('A', 10)
+    planner.opt_in_asset('A', 11)
+    planner.opt_in_app('A', 7)
+    # the account min balance already includes what it holds
+    info = account_info(min_balance=300000, assets=[10], apps=[7])
+    assert planner.required('A', info) == 300000 + MinBalance.asset_opt_in
+
+
+def test_app_schemas():
+    planner = MinBalancePlanner()
+    planner.opt_in_app('A', 7, local_schema=(2, 1))
+    planner.create_app('A')
+    planner.create_app('A', global_schema=(0, 4), extra_pages=2)
+    assert planner.required('A') == (MinBalance.account
+                                     + MinBalance.app_opt_in + 2 * MinBalance.schema_int + MinBalance.schema_bytes
+                                     + MinBalance.app_page + GLOBAL_SCHEMA
+                                     + 3 * MinBalance.app_page + 4 * MinBalance.schema_bytes)
+
+
+def test_fee_reserves_and_spending():
+    planner = MinBalancePlanner(min_txn_fee=2500)
+    planner.pay_fees('A', 3)
+    planner.pay_fees('A', 2)
+    planner.spend('A', 1000000)
+    assert planner.required('A', account_info(min_balance=100000)) == 100000 + 5 * 2500 + 1000000
+
+
+def test_sale_app_reserves_the_claim_fees_it_pays():
+    planner = MinBalancePlanner()
+    plan_sale_app(planner, 'APP', claims=2)
+    plan_sale_app(planner, 'SPLIT_APP', payees=5)
+    plan_sale_app(planner, 'POOLED_APP', fee_pooling=True, claims=2, payees=5)
+    assert planner.required('APP') == MinBalance.account + 2 * InnerTxns.claim_fees * MinBalance.txn_fee
+    assert planner.required('SPLIT_APP') == MinBalance.account + 5 * MinBalance.txn_fee
+    assert planner.required('POOLED_APP') == MinBalance.account
+
+
+def test_shortfalls_only_list_accounts_missing_algos():
+    planner = MinBalancePlanner()
+    planner.opt_in_asset('POOR', 10)
+    planner.opt_in_asset('RICH', 10)
+    planner.pay_fees('EXACT', 1)
+    client = StubClient({'POOR': account_info(100000, amount=150000),
+                         'RICH': account_info(100000, amount=10 ** 6),
+                         'EXACT': account_info(100000, amount=101000)})
+    assert planner.shortfalls(client) == {'POOR': 50000}
+
+
+def test_escrow_funding_follows_the_min_fee():
+    assert escrow_funding() == MinBalance.account + MinBalance.asset_opt_in + ESCROW_TXNS * MinBalance.txn_fee
+    assert escrow_funding(2000) - escrow_funding() == ESCROW_TXNS * 1000
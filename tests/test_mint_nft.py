@@ -0,0 +1,60 @@
+import pytest
+from algosdk import account
+from algosdk.error import AlgodHTTPError
+from algosdk.future import transaction
+
+from helpers.registry import Registry
+from services.mint_nft import create_asa, mint_collection
+
+# minting against a stub algod client: failures reach the caller, and a collection reports them per piece
+
+
+class StubClient:
+    def __init__(self, reject: set = ()):
+        self.reject = set(reject)  # asset names refused by the node
+        self.next_asset = 100
+        self.confirmed = {}
+
+    def suggested_params(self):
+        return transaction.SuggestedParams(1000, 1, 1000, 'SGO1GKSzyE7IEPItTxCByw9x8FmnrCDexi9/cOUJOiI=', 'testnet-v1.0', flat_fee=True)
+
+    def send_transaction(self, signed_txn):
+        if signed_txn.transaction.asset_name in self.reject:
+            raise AlgodHTTPError('overspend', 400)
+        self.next_asset += 1
+        txn_id = signed_txn.transaction.get_txid()
+        self.confirmed[txn_id] = {'confirmed-round': 2, 'asset-index': self.next_asset}
+        return txn_id
+
+    def status(self):
+        return {'last-round': 1}
+
+    def pending_transaction_info(self, txn_id):
+        return self.confirmed[txn_id]
+
+
+@pytest.fixture
+def registry(tmp_path):
+    registry = Registry(str(tmp_path / 'registry.db'))
+    yield registry
+    registry.close()
+
+
+def test_create_asa_raises_the_node_error(registry):
+    key, _ = account.generate_account()
+    with pytest.raises(AlgodHTTPError):
+        create_asa(key, 'broken', algod_client=StubClient({'broken'}), registry=registry)
+    assert create_asa(key, 'fine', algod_client=StubClient(), registry=registry) == 101
+
+
+def test_mint_collection_reports_failed_pieces(tmp_path, registry):
+    collection = tmp_path / 'collection'
+    collection.mkdir()
+    for name in ('a', 'b', 'c'):
+        (collection / f'{name}.png').write_bytes(name.encode())
+    key, creator = account.generate_account()
+    minted, failed = mint_collection(str(collection), 'ipfs://cid', private_key=key,
+                                     algod_client=StubClient({'b'}), registry=registry)
+    assert minted == {'a': 101, 'c': 102}
+    assert list(failed) == ['b'] and 'overspend' in failed['b']
+    assert [asset.asset_id for asset in registry.assets_of(creator)] == [101, 102]
@@ -0,0 +1,87 @@
+import base64
+import random
+
+from helpers.order_book import Listing, OrderBook, SortedList
+
+# the order book indexes, its snapshot and the catch-up from a stub indexer
+
+
+def key_values(state: dict):
+    return [{'key': base64.b64encode(key).decode(), 'value': {'type': 2, 'uint': value}}
+            for key, value in state.items()]
+
+
+class StubIndexer:
+    def __init__(self, current_round: int, asset_id: int):
+        self.current_round = current_round
+        self.asset_id = asset_id
+        self.transactions = []  # (round, app id, sender, accounts)
+        self.local = {}  # (address, app id) -> local state
+        self.fetched = []
+
+    def search_transactions(self, application_id=None, txn_type=None, min_round=0, next_page=None, **kwargs):
+        txns = [{'sender': sender, 'confirmed-round': r,
+                 'application-transaction': {'application-id': app_id, 'accounts': accounts}}
+                for r, app_id, sender, accounts in self.transactions if app_id == application_id and r >= min_round]
+        return {'transactions': txns, 'current-round': self.current_round}
+
+    def applications(self, app_id):
+        return {'application': {'params': {'global-state': key_values({b'asset_id': self.asset_id})}}}
+
+    def account_info(self, address):
+        self.fetched.append(address)
+        local = [{'id': app_id, 'key-value': key_values(state)}
+                 for (owner, app_id), state in self.local.items() if owner == address]
+        return {'account': {'address': address, 'apps-local-state': local}}
+
+
+def test_sorted_list_matches_sorted():
+    rng = random.Random(1)
+    items = [rng.randrange(10000) for _ in range(5000)]
+    sorted_list = SortedList(items[:2000])
+    for item in items[2000:]:
+        sorted_list.add(item)
+    for item in items[::3]:
+        sorted_list.remove(item)
+        items.remove(item)
+    assert list(sorted_list) == sorted(items)
+    assert list(sorted_list.irange(100, 200)) == [i for i in sorted(items) if 100 <= i < 200]
+    assert sorted_list.count_below(5000) == sum(1 for i in items if i < 5000)
+
+
+def test_queries_and_snapshot(tmp_path):
+    book = OrderBook()
+    book.apply_local_state(1, 10, 'A', {b'amount_payment': 300, b'approve_transfer': 0})
+    book.apply_local_state(2, 20, 'B', {b'amount_payment': 100, b'approve_transfer': 0})
+    book.apply_local_state(3, 10, 'C', {b'amount_payment': 200, b'approve_transfer': 1})  # paid, not for sale
+    assert [l.seller for l in book.cheapest(5)] == ['B', 'A']
+    assert book.under(200) == [Listing(2, 'B', 20, 100)]
+    assert book.cheapest(1, asset_id=10) == [Listing(1, 'A', 10, 300)]
+    book.round = 42
+    book.save(str(tmp_path / 'book.json'))
+    loaded = OrderBook.load(str(tmp_path / 'book.json'))
+    assert loaded.round == 42 and loaded.cheapest(5) == book.cheapest(5)
+
+
+def test_catch_up_refreshes_only_the_touched_sellers():
+    book = OrderBook()
+    book.apply_local_state(7, 10, 'A', {b'amount_payment': 300, b'approve_transfer': 0})
+    book.apply_local_state(7, 10, 'B', {b'amount_payment': 500, b'approve_transfer': 0})
+    book.round = 100
+    indexer = StubIndexer(current_round=120, asset_id=10)
+    indexer.transactions = [
+        (90, 7, 'B', []),  # before the snapshot round, already reflected
+        (105, 7, 'C', ['A']),  # C paid for A's listing
+        (110, 7, 'D', []),  # D listed
+    ]
+    indexer.local = {('A', 7): {b'amount_payment': 300, b'approve_transfer': 1},
+                     ('C', 7): {b'approve_transfer': 1},
+                     ('D', 7): {b'amount_payment': 50, b'approve_transfer': 0}}
+    refreshed = book.catch_up(indexer, [7])
+    assert sorted(refreshed) == [(7, 'A'), (7, 'C'), (7, 'D')]
+    assert sorted(indexer.fetched) == ['A', 'C', 'D']
+    assert [(l.seller, l.price) for l in book.cheapest(5)] == [('D', 50), ('B', 500)]
+    assert book.round == 120
+    # nothing new: no account is fetched again
+    indexer.fetched.clear()
+    assert book.catch_up(indexer, [7]) == [] and indexer.fetched == []
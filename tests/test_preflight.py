@@ -0,0 +1,126 @@
+import base64
+import copy
+
+import msgpack
+import pytest
+from algosdk import account, encoding
+from algosdk.error import AlgodHTTPError
+from algosdk.future import transaction
+from algosdk.logic import get_application_address
+
+from helpers.consts import AppArgs, DefaultValues
+from helpers.evaluator import evaluate_group
+from helpers.preflight import PreflightError, preflight, preflight_local, to_evaluator_txn
+from helpers.utils import int_to_bytes
+from services.fuzz_contract import address, compile_programs, initial_ledger, _init_worker
+
+# preflight against a stub node (simulate, then the dryrun fallback) and against the local evaluator
+
+PARAMS = transaction.SuggestedParams(fee=1000, first=1, last=1000, flat_fee=True, min_fee=1000,
+                                     gh='SGO1GKSzyE7IEPItTxCByw9x8FmnrCDexi9/cOUJOiI=')
+KEY, SENDER = account.generate_account()
+
+
+class StubNode:
+    def __init__(self, simulate=None, dryrun=None):
+        self.simulate = simulate  # response, or the status code of an error
+        self.dryrun_response = dryrun
+        self.simulated = []
+
+    def algod_request(self, method, requrl, params=None, data=None, headers=None, response_format='json'):
+        assert (method, requrl) == ('POST', '/transactions/simulate')
+        self.simulated.append(msgpack.unpackb(data, raw=False))
+        if isinstance(self.simulate, int):
+            raise AlgodHTTPError('simulate failed', self.simulate)
+        return self.simulate
+
+    def dryrun(self, request):
+        if self.dryrun_response is None:
+            raise AlgodHTTPError('dryrun is disabled', 404)
+        return self.dryrun_response
+
+
+def payments(count=2):
+    txns = [transaction.PaymentTxn(SENDER, PARAMS, SENDER, i) for i in range(count)]
+    transaction.assign_group_id(txns)
+    return [t.sign(KEY) for t in txns]
+
+
+def test_simulate_counts_inner_transactions():
+    inner = {'inner-txns': [{'inner-txns': [{}]}, {}]}  # two inner transactions, the first issuing one more
+    node = StubNode({'txn-groups': [{'app-budget-consumed': 120, 'txn-results': [{'txn-result': {}},
+                                                                                {'txn-result': inner}]}]})
+    result = preflight(node, payments())
+    assert (result.cost, result.inner_txns) == (120, 3)
+    sent = node.simulated[0]['txn-groups'][0]['txns']
+    assert [base64.b64encode(msgpack.packb(t, use_bin_type=True)).decode() for t in sent] == \
+        [encoding.msgpack_encode(stxn) for stxn in payments()]
+
+
+def test_simulate_failure():
+    message = 'transaction rejected: logic eval error: assert failed pc=87'
+    node = StubNode({'txn-groups': [{'app-budget-consumed': 35, 'failed-at': [1], 'failure-message': message}]})
+    with pytest.raises(PreflightError) as err:
+        preflight(node, payments())
+    assert (err.value.txn_index, err.value.pc, err.value.cost) == (1, 87, 35)
+
+
+def test_simulate_refusal_is_not_retried_with_dryrun():
+    node = StubNode(400, {'txns': []})
+    with pytest.raises(PreflightError, match='simulate refused'):
+        preflight(node, payments())
+
+
+def test_dryrun_fallback():
+    rejected = {'app-call-messages': ['ApprovalProgram', 'assert failed', 'REJECT'],
+                'app-call-trace': [{'pc': 1, 'line': 2}, {'pc': 40, 'line': 61}], 'budget-consumed': 12}
+    node = StubNode(404, {'txns': [{'budget-consumed': 5, 'app-call-messages': ['ApprovalProgram', 'PASS']},
+                                   rejected]})
+    with pytest.raises(PreflightError, match='app-call rejected: assert failed') as err:
+        preflight(node, payments())
+    assert (err.value.txn_index, err.value.pc, err.value.line, err.value.cost) == (1, 40, 61, 17)
+    node.dryrun_response = {'txns': [{'budget-consumed': 5}, {'cost': 7}]}
+    result = preflight(node, payments())
+    assert (result.cost, result.inner_txns) == (12, None)  # dryrun does not report inner transactions
+    node.dryrun_response = None
+    with pytest.raises(PreflightError, match='neither simulate nor dryrun'):
+        preflight(node, payments())
+
+
+@pytest.fixture(scope='module')
+def sale():
+    _init_worker(compile_programs())
+    config = {'royalty_fee': DefaultValues.royalty_fee, 'waiting_time': 0, 'fee_pooling': False, 'split': []}
+    return initial_ledger(config)
+
+
+def call(sender: int, app_id: int, asset_id: int, args: list, accounts=()):
+    txn = transaction.ApplicationCallTxn(encoding.encode_address(address(sender)), PARAMS, app_id,
+                                         transaction.OnComplete.NoOpOC, app_args=args, foreign_assets=[asset_id],
+                                         accounts=[encoding.encode_address(address(a)) for a in accounts])
+    return transaction.SignedTransaction(txn, None)
+
+
+def test_preflight_local(sale):
+    ledger, app_id, asset_id = sale
+    result = preflight_local(ledger, [call(0, app_id, asset_id, [AppArgs.setup_sale, int_to_bytes(5000)])])
+    assert result.cost > 0 and result.inner_txns == 0
+    assert b'amount_payment' not in ledger.accounts[address(0)].local[app_id]  # the ledger is left untouched
+    listed = copy.deepcopy(ledger)
+    evaluate_group(listed, [to_evaluator_txn(call(0, app_id, asset_id,
+                                                  [AppArgs.setup_sale, int_to_bytes(5000)]).transaction)])
+    pay = transaction.PaymentTxn(encoding.encode_address(address(1)), PARAMS, get_application_address(app_id), 5000)
+    buy_now = call(1, app_id, asset_id, [AppArgs.buy_now, int_to_bytes(asset_id)], accounts=[0]).transaction
+    transaction.assign_group_id([pay, buy_now])
+    result = preflight_local(listed, [transaction.SignedTransaction(t, None) for t in (pay, buy_now)])
+    assert result.inner_txns == 2  # the nft transfer and the payout
+
+
+def test_preflight_local_rejection(sale):
+    ledger, app_id, asset_id = sale
+    buy = call(1, app_id, asset_id, [AppArgs.buy, int_to_bytes(asset_id)], accounts=[0])
+    pay = transaction.SignedTransaction(transaction.PaymentTxn(
+        encoding.encode_address(address(1)), PARAMS, get_application_address(app_id), 5000), None)
+    with pytest.raises(PreflightError, match='assert failed') as err:
+        preflight_local(ledger, [buy, pay])  # nothing is listed
+    assert err.value.txn_index == 0 and err.value.line is not None
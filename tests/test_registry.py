@@ -0,0 +1,61 @@
+import threading
+
+import pytest
+
+from helpers.registry import Asset, Deployment, Registry
+
+# the sqlite registry of mints and deployments
+
+
+@pytest.fixture
+def registry(tmp_path):
+    registry = Registry(str(tmp_path / 'registry.db'))
+    yield registry
+    registry.close()
+
+
+def test_assets(registry):
+    registry.add_asset(Asset(5, 'A', 'five', 'ipfs://5'))
+    registry.add_asset(Asset(9, 'A', 'nine'))
+    registry.add_asset(Asset(7, 'B'))
+    registry.add_asset(Asset(5, 'A', 'renamed', 'ipfs://5'))  # a second record updates the first
+    assert registry.asset(5) == Asset(5, 'A', 'renamed', 'ipfs://5')
+    assert [asset.asset_id for asset in registry.assets_of('A')] == [5, 9]
+    assert registry.latest_asset().asset_id == 9
+    assert registry.latest_asset('B').asset_id == 7
+    assert registry.asset(6) is None and registry.latest_asset('C') is None
+
+
+def test_deployments(registry):
+    registry.add_deployment(Deployment(100, 'ADDR100', 5, 'A', 'hash', 50, 10, True))
+    registry.add_deployment(Deployment(120, 'ADDR120', 5, 'A'))
+    registry.add_deployment(Deployment(110, 'ADDR110', 7, 'B'))
+    assert registry.deployment(100) == Deployment(100, 'ADDR100', 5, 'A', 'hash', 50, 10, True)
+    assert registry.deployment(100).fee_pooling is True
+    assert registry.deployment_for_asset(5).app_id == 120  # the latest app of the asset
+    assert [d.app_id for d in registry.deployments_of('A')] == [100, 120]
+    assert registry.deployment_for_asset(8) is None
+
+
+def test_concurrent_writers(tmp_path):
+    path = str(tmp_path / 'registry.db')
+    registries = [Registry(path) for _ in range(4)]
+
+    def mint(n):
+        for i in range(50):
+            registries[n].add_asset(Asset(n * 1000 + i, f'creator{n}'))
+
+    threads = [threading.Thread(target=mint, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(len(registries[0].assets_of(f'creator{n}')) == 50 for n in range(4))
+
+
+def test_import_env(registry, tmp_path):
+    env = tmp_path / '.env'
+    env.write_text('ASSET_ID=5\nAPP_ID=100\nAPP_ADDRESS=ADDR100\n')
+    registry.import_env(str(env), 'A')
+    assert registry.asset(5).creator == 'A'
+    assert registry.deployment_for_asset(5) == Deployment(100, 'ADDR100', 5, 'A')
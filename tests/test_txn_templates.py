@@ -0,0 +1,93 @@
+import base64
+import copy
+
+import pytest
+from algosdk import account, encoding
+from algosdk.future import transaction
+from algosdk.logic import get_application_address
+
+from helpers.consts import AppArgs, InnerTxns
+from helpers.txn_templates import (buy_now_template, buy_now_values, buy_template, buy_values, cached_template,
+                                   decode_signed, setup_sale_template, setup_sale_values, sign_group)
+from helpers.utils import int_to_bytes, pooled_fee_params
+
+# groups signed from templates must be byte for byte what algosdk builds and signs for the same transactions
+
+APP_ID, ASSET_ID, PRICE = 1234567, 7654321, 1000000
+
+
+def params(fee=0, flat_fee=False):
+    return transaction.SuggestedParams(fee=fee, first=20000000, last=20001000, flat_fee=flat_fee, min_fee=1000,
+                                       gh='SGO1GKSzyE7IEPItTxCByw9x8FmnrCDexi9/cOUJOiI=', gen='testnet-v1.0')
+
+
+def signed_bytes(private_key, txns: list) -> list:
+    if len(txns) > 1:
+        transaction.assign_group_id(txns)
+    return [base64.b64decode(encoding.msgpack_encode(txn.sign(private_key))) for txn in txns]
+
+
+def setup_sale_txn(seller, app_id, asset_id, price, sp):
+    return transaction.ApplicationCallTxn(sender=seller, sp=sp, index=app_id, on_complete=transaction.OnComplete.NoOpOC,
+                                          app_args=[AppArgs.setup_sale, int_to_bytes(price)],
+                                          foreign_assets=[asset_id])
+
+
+@pytest.mark.parametrize('count', [1, 3])
+def test_setup_sale_groups_across_apps(count):
+    private_key, seller = account.generate_account()
+    sp = params()
+    listings = [(APP_ID + i, ASSET_ID + i, PRICE + i) for i in range(count)]
+    signed, txids = sign_group(private_key, [(setup_sale_template(sp, app_id, asset_id),
+                                              setup_sale_values(price, sp.first, sp.last))
+                                             for app_id, asset_id, price in listings])
+    expected = [setup_sale_txn(seller, app_id, asset_id, price, sp) for app_id, asset_id, price in listings]
+    assert signed == signed_bytes(private_key, expected)
+    assert txids == [txn.get_txid() for txn in expected]
+    assert [stxn.transaction.get_txid() for stxn in decode_signed(signed)] == txids
+
+
+def test_buy_group():
+    private_key, buyer = account.generate_account()
+    seller = account.generate_account()[1]
+    sp = params(fee=1000, flat_fee=True)
+    app_args = [AppArgs.buy, int_to_bytes(ASSET_ID)]
+    signed, _ = sign_group(private_key, [(buy_template(sp, APP_ID, ASSET_ID),
+                                          buy_values(app_args, seller, PRICE, sp.first, sp.last))])
+    expected = [transaction.ApplicationCallTxn(sender=buyer, sp=sp, index=APP_ID,
+                                               on_complete=transaction.OnComplete.NoOpOC, app_args=app_args,
+                                               accounts=[seller], foreign_assets=[ASSET_ID]),
+                transaction.PaymentTxn(sender=buyer, receiver=get_application_address(APP_ID), amt=PRICE, sp=sp)]
+    assert signed == signed_bytes(private_key, expected)
+
+
+@pytest.mark.parametrize('fee_pooling', [False, True])
+def test_buy_now_group(fee_pooling):
+    private_key, buyer = account.generate_account()
+    seller = account.generate_account()[1]
+    sp = params()
+    inner_txns = InnerTxns.buy_now if fee_pooling else 0
+    signed, _ = sign_group(private_key, [(buy_now_template(sp, APP_ID, ASSET_ID, inner_txns),
+                                          buy_now_values(seller, PRICE, sp.first, sp.last))])
+    call_sp = pooled_fee_params(copy.copy(sp), inner_txns) if fee_pooling else sp
+    expected = [transaction.PaymentTxn(sender=buyer, receiver=get_application_address(APP_ID), amt=PRICE, sp=sp),
+                transaction.ApplicationCallTxn(sender=buyer, sp=call_sp, index=APP_ID,
+                                               on_complete=transaction.OnComplete.NoOpOC,
+                                               app_args=[AppArgs.buy_now, int_to_bytes(ASSET_ID)],
+                                               accounts=[seller], foreign_assets=[ASSET_ID])]
+    assert signed == signed_bytes(private_key, expected)
+
+
+def test_templates_are_cached_per_params_and_app():
+    template = cached_template(setup_sale_template, params(), APP_ID, ASSET_ID)
+    assert cached_template(setup_sale_template, params(), APP_ID, ASSET_ID) is template
+    assert cached_template(setup_sale_template, params(fee=2000, flat_fee=True), APP_ID, ASSET_ID) is not template
+    assert cached_template(setup_sale_template, params(), APP_ID + 1, ASSET_ID) is not template
+
+
+def test_zero_values_are_refused():
+    private_key = account.generate_account()[0]
+    sp = params()
+    with pytest.raises(ValueError, match='amt'):
+        sign_group(private_key, [(buy_now_template(sp, APP_ID, ASSET_ID), buy_now_values(
+            account.generate_account()[1], 0, sp.first, sp.last))])
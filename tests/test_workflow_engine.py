@@ -0,0 +1,87 @@
+import threading
+
+import pytest
+
+from helpers.workflow_engine import Journal, Step, WorkflowError, run_workflow
+
+# the workflow engine: steps run after their dependencies, outcomes are journaled, and a rerun skips what the
+# journal or the on-chain check says already happened
+
+
+class Recorder:
+    def __init__(self):
+        self.order = []
+        self.lock = threading.Lock()
+
+    def step(self, name: str, result=None, fail: bool = False):
+        def run():
+            with self.lock:
+                self.order.append(name)
+            if fail:
+                raise RuntimeError(f'{name} broke')
+            return result if result is not None else f'{name}-txn'
+        return run
+
+
+@pytest.fixture
+def journal(tmp_path):
+    return Journal(str(tmp_path / 'workflow.journal'))
+
+
+def test_dependencies_run_first(journal):
+    recorder = Recorder()
+    steps = [Step('claim', recorder.step('claim'), depends_on=('sale_1', 'sale_2')),
+             Step('sale_2', recorder.step('sale_2'), depends_on=('sale_1',)),
+             Step('fund', recorder.step('fund')),
+             Step('sale_1', recorder.step('sale_1'), depends_on=('fund', 'opt_in')),
+             Step('opt_in', recorder.step('opt_in'), depends_on=('fund',))]
+    results = run_workflow(steps, journal)
+    assert results == {name: f'{name}-txn' for name in ('claim', 'sale_2', 'fund', 'sale_1', 'opt_in')}
+    assert recorder.order == ['fund', 'opt_in', 'sale_1', 'sale_2', 'claim']
+    assert [(e['step'], e['status']) for e in journal.entries()] == [(name, 'done') for name in recorder.order]
+
+
+def sale_workflow(recorder, sale_fails=False):
+    return [Step('fund', recorder.step('fund')),
+            Step('sale', recorder.step('sale', fail=sale_fails), depends_on=('fund',)),
+            Step('claim', recorder.step('claim'), depends_on=('sale',))]
+
+
+def test_resume_after_a_failure(journal):
+    recorder = Recorder()
+    with pytest.raises(WorkflowError) as err:
+        run_workflow(sale_workflow(recorder, sale_fails=True), journal)
+    assert err.value.step == 'sale' and str(err.value.cause) == 'sale broke'
+    assert recorder.order == ['fund', 'sale']  # the claim never started
+    assert journal.entries()[-1]['status'] == 'failed'
+
+    recorder = Recorder()
+    results = run_workflow(sale_workflow(recorder), journal)
+    assert recorder.order == ['sale', 'claim']  # funding is not repeated
+    assert results['fund'] == 'fund-txn'  # but its journaled result is returned
+
+
+def test_steps_already_on_chain_are_skipped(journal):
+    recorder = Recorder()
+    checks = []
+    steps = [Step('fund', recorder.step('fund'), is_done=lambda: checks.append('fund') or True),
+             Step('sale', recorder.step('sale'), depends_on=('fund',),
+                  is_done=lambda: checks.append('sale') or False)]
+    results = run_workflow(steps, journal)
+    assert recorder.order == ['sale'] and checks == ['fund', 'sale']
+    assert results == {'fund': 'already on chain', 'sale': 'sale-txn'}
+    assert [(e['step'], e['status']) for e in journal.entries()] == [('fund', 'skipped'), ('sale', 'done')]
+    # journaled steps are not checked again
+    run_workflow(steps, journal)
+    assert checks == ['fund', 'sale'] and recorder.order == ['sale']
+
+
+def test_invalid_graphs_are_refused(journal):
+    run = Recorder().step('x')
+    with pytest.raises(ValueError, match='unique'):
+        run_workflow([Step('a', run), Step('a', run)], journal)
+    with pytest.raises(ValueError, match='unknown steps'):
+        run_workflow([Step('a', run, depends_on=('b',))], journal)
+    with pytest.raises(ValueError, match='cycle'):
+        run_workflow([Step('a', run, depends_on=('b',)), Step('b', run, depends_on=('a',))], journal)
+    assert journal.entries() == []